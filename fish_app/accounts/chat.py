@@ -0,0 +1,276 @@
+import asyncio
+import json
+import logging
+import threading
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.signals import setting_changed
+from django.db import close_old_connections, connection
+from django.dispatch import receiver
+from django.http.request import split_domain_port, validate_host
+from django.utils import formats
+
+from .forms import MessageForm
+from .models import Message, Room
+
+logger = logging.getLogger(__name__)
+
+# 新着メッセージをLISTEN/NOTIFYで配るときのチャンネル名
+NOTIFY_CHANNEL = 'chat_messages'
+# LISTENする接続が切れたときに、つなぎ直すまで待つ秒数
+LISTEN_RETRY_DELAY = 1
+
+
+def message_payload(message):
+    return {
+        'id': message.id,
+        'room': message.room_id,
+        'sender': message.sender.username,
+        'content': message.content,
+        'created_at': formats.date_format(message.created_at, 'DATETIME_FORMAT'),
+    }
+
+
+class MemoryBroker:
+    # 同じプロセスで接続しているWebSocketにだけ配る。部屋ごとに接続のキューを持つ
+
+    def __init__(self):
+        self.rooms = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, room_id):
+        queue = asyncio.Queue(maxsize=settings.CHAT_QUEUE_SIZE)
+        loop = asyncio.get_event_loop()
+        with self.lock:
+            self.rooms.setdefault(room_id, set()).add((loop, queue))
+        return queue
+
+    def unsubscribe(self, room_id, queue):
+        with self.lock:
+            subscribers = self.rooms.get(room_id, set())
+            for subscriber in [s for s in subscribers if s[1] is queue]:
+                subscribers.discard(subscriber)
+            if not subscribers:
+                self.rooms.pop(room_id, None)
+
+    def connection_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.rooms.values())
+
+    def publish(self, data):
+        self.deliver(data)
+
+    def deliver(self, data):
+        # 保存はワーカースレッドで行われるので、キューへの追加はイベントループに任せる
+        with self.lock:
+            subscribers = list(self.rooms.get(data['room'], ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(put_message, queue, data)
+
+
+def put_message(queue, data):
+    try:
+        queue.put_nowait(data)
+    except asyncio.QueueFull:
+        logger.warning('chat queue is full, dropped message %s', data['id'])
+
+
+class PostgresBroker(MemoryBroker):
+    # uWSGIのプロセスで保存されたメッセージもNOTIFYで受け取り、このプロセスの接続に配る
+    # LISTENする接続はイベントループごとに1本で、そのループの購読者がいなくなったら閉じる
+
+    def __init__(self):
+        super().__init__()
+        self.listeners = {}
+
+    def subscribe(self, room_id):
+        self.close_finished_loops()
+        queue = super().subscribe(room_id)
+        self.listen(asyncio.get_event_loop())
+        return queue
+
+    def unsubscribe(self, room_id, queue):
+        super().unsubscribe(room_id, queue)
+        loop = asyncio.get_event_loop()
+        if not self.has_subscribers(loop):
+            self.close_listener(loop)
+
+    def has_subscribers(self, loop):
+        with self.lock:
+            return any(s[0] is loop for subscribers in self.rooms.values() for s in subscribers)
+
+    def close_finished_loops(self):
+        # 購読を解除しないまま終了したイベントループの購読者と接続を片付ける
+        for loop in [loop for loop in self.listeners if loop.is_closed()]:
+            with self.lock:
+                for room_id, subscribers in list(self.rooms.items()):
+                    subscribers.difference_update([s for s in subscribers if s[0] is loop])
+                    if not subscribers:
+                        self.rooms.pop(room_id)
+            self.close_listener(loop)
+
+    def listen(self, loop):
+        # つながらなければLISTEN_RETRY_DELAY秒後にやり直す。その間に届いたNOTIFYは失われる
+        import psycopg2
+
+        if loop in self.listeners or loop.is_closed() or not self.has_subscribers(loop):
+            return
+        try:
+            listener = psycopg2.connect(**connection.get_connection_params())
+            listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with listener.cursor() as cursor:
+                cursor.execute('LISTEN {}'.format(NOTIFY_CHANNEL))
+        except psycopg2.Error as e:
+            logger.warning('chat listener could not connect: %s', e)
+            loop.call_later(LISTEN_RETRY_DELAY, self.listen, loop)
+            return
+        fileno = listener.fileno()
+        loop.add_reader(fileno, self.on_notify, loop, listener)
+        self.listeners[loop] = (listener, fileno)
+
+    def close_listener(self, loop):
+        listener, fileno = self.listeners.pop(loop, (None, None))
+        if listener is None:
+            return
+        if not loop.is_closed():
+            loop.remove_reader(fileno)
+        listener.close()
+
+    def on_notify(self, loop, listener):
+        import psycopg2
+
+        try:
+            listener.poll()
+        except psycopg2.Error as e:
+            # 接続が切れたらつなぎ直してLISTENし直す
+            logger.warning('chat listener connection lost: %s', e)
+            self.close_listener(loop)
+            self.listen(loop)
+            return
+        while listener.notifies:
+            notify = listener.notifies.pop(0)
+            self.deliver(json.loads(notify.payload))
+
+    def publish(self, data):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, json.dumps(data)])
+
+
+_broker = None
+
+
+def get_broker():
+    # PostgreSQL以外(開発用のSQLiteなど)ではプロセス内だけで配る
+    global _broker
+    if _broker is None:
+        if settings.CHAT_BROKER == 'postgres' and connection.vendor == 'postgresql':
+            _broker = PostgresBroker()
+        else:
+            _broker = MemoryBroker()
+    return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    # テストでCHAT_BROKERを切り替えたら作り直す
+    global _broker
+    if setting == 'CHAT_BROKER':
+        _broker = None
+
+
+def database_sync_to_async(func):
+    # ORMはイベントループ上で呼べないので、スレッドで実行して古い接続を片付ける
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper)
+
+
+def scope_headers(scope):
+    return {name.decode('latin1'): value.decode('latin1') for name, value in scope.get('headers', [])}
+
+
+def origin_allowed(headers):
+    # 別サイトのページからログイン中のユーザーとして接続されないよう、同じホストからの接続だけ受け付ける
+    origin = headers.get('origin')
+    if origin is None:
+        return True
+    domain, port = split_domain_port(origin.split('://', 1)[-1])
+    if 'host' in headers:
+        return domain == split_domain_port(headers['host'])[0]
+    return bool(domain) and validate_host(domain, settings.ALLOWED_HOSTS)
+
+
+@database_sync_to_async
+def scope_user(headers):
+    cookie = SimpleCookie(headers.get('cookie', ''))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value if morsel else None)
+    return get_user(SimpleNamespace(session=session))
+
+
+@database_sync_to_async
+def is_room_member(room_id, user):
+    return Room.objects.filter(id=room_id, users=user).exists()
+
+
+@database_sync_to_async
+def create_message(room_id, user, content):
+    # 送信できるのはRoomDetailViewと同じく相互フォローの間だけ
+    if not Room.objects.with_status(user).filter(id=room_id, mutural_follow=True).exists():
+        return 'メッセージの送信は相互フォロー状態でのみ可能です'
+    form = MessageForm({'content': content})
+    if not form.is_valid():
+        return ' '.join(form.errors['content'])
+    Message.objects.create(sender=user, content=form.cleaned_data['content'], room_id=room_id)
+    return None
+
+
+async def room_consumer(scope, receive, send):
+    # /ws/rooms/<pk>/ 部屋のメンバーに新着メッセージを送り、受け取ったメッセージを保存する
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    room_id = int(scope['url_route']['kwargs']['pk'])
+    headers = scope_headers(scope)
+    user = await scope_user(headers) if origin_allowed(headers) else None
+    if user is None or not user.is_authenticated or not await is_room_member(room_id, user):
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+
+    broker = get_broker()
+    queue = broker.subscribe(room_id)
+    await send({'type': 'websocket.accept'})
+    receiving = asyncio.ensure_future(receive())
+    waiting = asyncio.ensure_future(queue.get())
+    try:
+        while True:
+            done, pending = await asyncio.wait({receiving, waiting}, return_when=asyncio.FIRST_COMPLETED)
+            if waiting in done:
+                await send({'type': 'websocket.send', 'text': json.dumps(waiting.result())})
+                waiting = asyncio.ensure_future(queue.get())
+            if receiving in done:
+                event = receiving.result()
+                if event['type'] == 'websocket.disconnect':
+                    break
+                if event['type'] == 'websocket.receive':
+                    try:
+                        content = json.loads(event.get('text') or '{}').get('content', '')
+                    except (AttributeError, ValueError):
+                        content = ''
+                    error = await create_message(room_id, user, content)
+                    if error:
+                        await send({'type': 'websocket.send', 'text': json.dumps({'error': error})})
+                receiving = asyncio.ensure_future(receive())
+    finally:
+        receiving.cancel()
+        waiting.cancel()
+        broker.unsubscribe(room_id, queue)
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:30
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicate_connections(apps, schema_editor):
+    # 一意制約を付ける前に、同じフォロー関係の重複行を最も古い1件だけ残して削除する
+    Connection = apps.get_model('accounts', 'Connection')
+    duplicates = Connection.objects.values('follower', 'followed').annotate(first_id=Min('id'), total=Count('id')).filter(total__gt=1).order_by()
+    for duplicate in duplicates:
+        Connection.objects.filter(
+            follower=duplicate['follower'], followed=duplicate['followed']
+        ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', '-created_at'], name='message_room_created_idx'),
+        ),
+        migrations.RunPython(delete_duplicate_connections, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='connection',
+            constraint=models.UniqueConstraint(fields=('follower', 'followed'), name='unique_connection'),
+        ),
+    ]
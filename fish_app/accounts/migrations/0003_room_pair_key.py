@@ -0,0 +1,40 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+def backfill_pair_keys(apps, schema_editor):
+    # 2人のルームにキーを付ける。同じ2人のルームが複数あれば最も古いルームにメッセージを移してまとめる
+    Room = apps.get_model('accounts', 'Room')
+    Message = apps.get_model('accounts', 'Message')
+    RoomUser = Room.users.through
+    members = {}
+    for room_id, user_id in RoomUser.objects.order_by('room_id').values_list('room_id', 'customuser_id'):
+        members.setdefault(room_id, []).append(user_id)
+    rooms = {}
+    for room_id, user_ids in sorted(members.items()):
+        if len(user_ids) != 2:
+            continue
+        key = '{}:{}'.format(*sorted(user_ids))
+        if key in rooms:
+            Message.objects.filter(room_id=room_id).update(room_id=rooms[key])
+            Room.objects.filter(id=room_id).delete()
+        else:
+            rooms[key] = room_id
+            Room.objects.filter(id=room_id).update(pair_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='pair_key',
+            field=models.CharField(editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_pair_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:47
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_follow_counts(apps, schema_editor):
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    Connection = apps.get_model('accounts', 'Connection')
+    for field, counter in (('follower', 'following_count'), ('followed', 'follower_count')):
+        counts = Connection.objects.values_list(field).annotate(total=Count('id')).order_by()
+        for user_id, total in counts:
+            CustomUser.objects.filter(id=user_id).update(**{counter: total})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_room_pair_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='フォロワー数'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='フォロー数'),
+        ),
+        migrations.RunPython(backfill_follow_counts, migrations.RunPython.noop),
+    ]
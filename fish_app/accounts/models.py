@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager  
-from django.db import models  
+from django.db import models, transaction  
+from django.db.models import Exists, ExpressionWrapper, OuterRef
 
 class CustomUserManager(BaseUserManager): 
     use_in_migrations = True 
@@ -32,6 +33,9 @@ class CustomUser(AbstractUser):
         db_table = 'custom_user'
     email = models.EmailField('メールアドレス', unique=True)
     introduce = models.TextField('自己紹介',max_length=300, blank=True)
+    # Connectionのシグナルで更新するフォロー数・フォロワー数(accounts.social)
+    following_count = models.PositiveIntegerField('フォロー数', default=0, editable=False)
+    follower_count = models.PositiveIntegerField('フォロワー数', default=0, editable=False)
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -39,6 +43,11 @@ class CustomUser(AbstractUser):
     objects = CustomUserManager()
 
 class Connection(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'followed'], name='unique_connection'),
+        ]
+
     follower = models.ForeignKey(CustomUser, related_name='follower', on_delete=models.CASCADE)
     followed = models.ForeignKey(CustomUser, related_name='followed', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -46,10 +55,44 @@ class Connection(models.Model):
     def __str__(self):
         return '{} : {}'.format(self.follower.username, self.followed.username)
 
+def room_pair_key(user1_id, user2_id):
+    # 2人のDMルームを引くためのキー。ユーザーIDの小さい方を先にする
+    return '{}:{}'.format(*sorted((user1_id, user2_id)))
+
+class RoomQuerySet(models.QuerySet):
+
+    def get_or_create_for_pair(self, user1, user2):
+        # pair_keyの一意制約で、同時に作成しても1つのルームにまとまる
+        with transaction.atomic():
+            room, created = self.get_or_create(pair_key=room_pair_key(user1.id, user2.id))
+            if created:
+                room.users.add(user1, user2)
+        return room, created
+
+    def with_status(self, user):
+        # 閲覧者がメンバーか、ルームの2人が相互フォローかを1クエリで取る
+        member = Room.users.through.objects.filter(room_id=OuterRef('pk'), customuser_id=user.id)
+        following = Connection.objects.filter(
+            follower_id=user.id, followed__room=OuterRef('pk')).exclude(followed_id=user.id)
+        followed_by = Connection.objects.filter(
+            followed_id=user.id, follower__room=OuterRef('pk')).exclude(follower_id=user.id)
+        return self.annotate(
+            is_member=Exists(member),
+            mutural_follow=ExpressionWrapper(Exists(following) & Exists(followed_by), output_field=models.BooleanField()),
+        )
+
 class Room(models.Model):
     users = models.ManyToManyField(CustomUser)
+    pair_key = models.CharField(max_length=41, unique=True, null=True, editable=False)
+
+    objects = RoomQuerySet.as_manager()
 
 class Message(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', '-created_at'], name='message_room_created_idx'),
+        ]
+
     sender = models.ForeignKey(CustomUser, related_name='sender', on_delete=models.CASCADE)
     content = models.TextField(max_length=600)
     room = models.ForeignKey(Room, related_name='room', on_delete=models.CASCADE)
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .chat import get_broker, message_payload
+from .models import Connection, Message
+from .social import add_follow_counts
+
+
+@receiver(post_save, sender=Message)
+def publish_message(sender, instance, created, raw=False, **kwargs):
+    # コミットされてから部屋に接続しているWebSocketへ配る
+    if raw or not created:
+        return
+    data = message_payload(instance)
+    transaction.on_commit(lambda: get_broker().publish(data))
+
+
+@receiver(post_save, sender=Connection)
+def count_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        add_follow_counts(instance.follower_id, instance.followed_id, 1)
+
+
+@receiver(post_delete, sender=Connection)
+def count_unfollow(sender, instance, **kwargs):
+    add_follow_counts(instance.follower_id, instance.followed_id, -1)
@@ -0,0 +1,84 @@
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Connection, CustomUser
+
+# フォローリストの1ページあたりの件数
+FOLLOW_PAGE_SIZE = 20
+
+
+def follow(follower, followed):
+    # 件数の更新はConnectionのシグナルで行う。同じトランザクションで反映させる
+    if follower.id == followed.id:
+        return False
+    with transaction.atomic():
+        connection, created = Connection.objects.get_or_create(follower=follower, followed=followed)
+    return created
+
+
+def unfollow(follower, followed):
+    with transaction.atomic():
+        deleted, _ = Connection.objects.filter(follower=follower, followed=followed).delete()
+    return deleted > 0
+
+
+def add_follow_counts(follower_id, followed_id, delta):
+    CustomUser.objects.filter(id=follower_id).update(following_count=F('following_count') + delta)
+    CustomUser.objects.filter(id=followed_id).update(follower_count=F('follower_count') + delta)
+
+
+def refresh_counts(user_ids=None):
+    # 一括登録などシグナルを通らない変更のあとに、Connectionから数え直す
+    def count(field):
+        return Coalesce(Subquery(
+            Connection.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+            .annotate(total=Count('id')).values('total')
+        ), Value(0))
+    users = CustomUser.objects.all()
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    return users.update(following_count=count('follower'), follower_count=count('followed'))
+
+
+def follow_states(user, user_ids):
+    # userから見た各ユーザーとの関係を1クエリでまとめて返す
+    # {user_id: {'following': userがフォロー中, 'followed_by': userをフォロー中, 'mutual': 相互フォロー}}
+    user_ids = list(user_ids)
+    states = {user_id: {'following': False, 'followed_by': False, 'mutual': False} for user_id in user_ids}
+    if not user.is_authenticated or not user_ids:
+        return states
+    connections = Connection.objects.filter(
+        Q(follower_id=user.id, followed_id__in=user_ids) | Q(followed_id=user.id, follower_id__in=user_ids)
+    ).values_list('follower_id', 'followed_id')
+    for follower_id, followed_id in connections:
+        if follower_id == user.id:
+            states[followed_id]['following'] = True
+        if followed_id == user.id:
+            states[follower_id]['followed_by'] = True
+    for state in states.values():
+        state['mutual'] = state['following'] and state['followed_by']
+    return states
+
+
+def paginate(queryset, count, page_number):
+    # 件数はCustomUserのカウンタを使い、ページごとのCOUNT(*)を発行しない
+    paginator = Paginator(queryset, FOLLOW_PAGE_SIZE)
+    paginator.count = count
+    return paginator.get_page(page_number)
+
+
+def following_page(user, page_number=None):
+    # userがフォローしているユーザーを新しくフォローした順に。user.trip_countに投稿数を付ける
+    users = CustomUser.objects.filter(followed__follower=user).annotate(
+        followed_at=F('followed__created_at'), trip_count=Count('trip', distinct=True)
+    ).order_by('-followed_at', '-id')
+    return paginate(users, user.following_count, page_number)
+
+
+def followers_page(user, page_number=None):
+    users = CustomUser.objects.filter(follower__followed=user).annotate(
+        followed_at=F('follower__created_at'), trip_count=Count('trip', distinct=True)
+    ).order_by('-followed_at', '-id')
+    return paginate(users, user.follower_count, page_number)
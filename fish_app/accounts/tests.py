@@ -1,10 +1,22 @@
-from django.test import TestCase
+from django.test import Client, TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.urls import reverse
+from django.conf import settings
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from unittest import skipUnless
+import asyncio
 import datetime
+import json
 
+from config.asgi import application
+
+from .chat import PostgresBroker, get_broker
 from .models import Connection, Room, Message
 from .forms import MessageForm
+from .views import MESSAGE_PAGE_SIZE
+from . import social
 
 class CustomUserTest(TestCase):
 
@@ -117,6 +129,65 @@ class FollowPageTest(TestCase):
         self.assertNotContains(self.response, 'フォローを外す')
         self.assertNotContains(self.response, 'メッセージ')
 
+class SocialGraphTest(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.users = [
+            User.objects.create_user(username='testuser{}'.format(i), email='test{}@email.com'.format(i), password='testpass123')
+            for i in range(4)
+        ]
+
+    def reload(self):
+        return [get_user_model().objects.get(id=user.id) for user in self.users]
+
+    def test_follow_and_unfollow_update_counts(self):
+        a, b, c, d = self.users
+        self.client.login(email='test0@email.com', password='testpass123')
+        self.client.post(reverse('follow', args=[b.id]))
+        self.client.post(reverse('follow', args=[b.id]))
+        social.follow(c, b)
+        a, b, c, d = self.reload()
+        self.assertEqual((a.following_count, b.follower_count, c.following_count), (1, 2, 1))
+        # フォローしていない相手のフォローを外してもエラーにならず、件数も変わらない
+        self.client.post(reverse('unfollow', args=[b.id]))
+        self.client.post(reverse('unfollow', args=[b.id]))
+        a, b, c, d = self.reload()
+        self.assertEqual((a.following_count, b.follower_count), (0, 1))
+        # 数え直しても同じ値になる
+        get_user_model().objects.update(follower_count=0, following_count=0)
+        social.refresh_counts()
+        a, b, c, d = self.reload()
+        self.assertEqual((a.following_count, b.follower_count, c.following_count), (0, 1, 1))
+
+    def test_follow_states(self):
+        a, b, c, d = self.users
+        social.follow(a, b)
+        social.follow(b, a)
+        social.follow(a, c)
+        social.follow(d, a)
+        with self.assertNumQueries(1):
+            states = social.follow_states(a, [b.id, c.id, d.id])
+        self.assertEqual(states[b.id], {'following': True, 'followed_by': True, 'mutual': True})
+        self.assertEqual(states[c.id], {'following': True, 'followed_by': False, 'mutual': False})
+        self.assertEqual(states[d.id], {'following': False, 'followed_by': True, 'mutual': False})
+
+    def test_follow_list_is_paginated(self):
+        a = self.users[0]
+        User = get_user_model()
+        for i in range(social.FOLLOW_PAGE_SIZE + 1):
+            social.follow(a, User.objects.create_user(username='f{}'.format(i), email='f{}@email.com'.format(i)))
+        self.client.login(email='test0@email.com', password='testpass123')
+        # セッション・ユーザー・表示するユーザー・フォローリスト・関係・ルームの6クエリ
+        # フォロワーは0人なのでカウンタから空のページになりクエリを発行しない
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('follow_list', args=[a.id]))
+        self.assertContains(response, 'フォローしています({})'.format(social.FOLLOW_PAGE_SIZE + 1))
+        self.assertEqual(len(response.context['following_list']), social.FOLLOW_PAGE_SIZE)
+        self.assertContains(response, '?following=2')
+        response = self.client.get(reverse('follow_list', args=[a.id]), {'following': 2})
+        self.assertEqual([user.username for user in response.context['following_list']], ['f0'])
+
 class RoomCreateTest(TestCase):
     
     def setUp(self):
@@ -151,12 +222,19 @@ class RoomCreateTest(TestCase):
         self.client.login(email='test1@email.com', password='testpass123')
         data = {'sender':self.user1, 'receiver':self.user2}
         response = self.client.post(reverse('room_create', args=[2]), data)
-        self.assertRedirects(response, expected_url='/accounts/room/1',status_code=302,target_status_code=301)
+        # PostgreSQLのシーケンスはテストごとに戻らないので、IDは作成されたRoomから取る
+        room_url = '/accounts/room/{}'.format(Room.objects.get().id)
+        self.assertRedirects(response, expected_url=room_url,status_code=302,target_status_code=301)
         self.assertEqual(Room.objects.all().count(), 1)
         # Room作成後に再度room_createを実行しても新しいRoomは作成せず、リダイレクトする
         response = self.client.post(reverse('room_create', args=[2]), data)
-        self.assertRedirects(response, expected_url='/accounts/room/1',status_code=302,target_status_code=301)
+        self.assertRedirects(response, expected_url=room_url,status_code=302,target_status_code=301)
         self.assertEqual(Room.objects.all().count(), 1)
+        # 相手側から作成しても同じRoomになる
+        self.client.login(email='test2@email.com', password='testpass123')
+        response = self.client.post(reverse('room_create', args=[1]), data)
+        self.assertRedirects(response, expected_url=room_url,status_code=302,target_status_code=301)
+        self.assertEqual(Room.objects.get().pair_key, '1:2')
     
     def test_room_detail_view(self):
         self.room = Room.objects.create(
@@ -203,6 +281,62 @@ class RoomCreateTest(TestCase):
         response = self.client.get('/accounts/room/1/')
         self.assertEqual(response.status_code, 403)
 
+class MessageHistoryTest(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user1 = User.objects.create_user(username='testuser1', email='test1@email.com', password='testpass123')
+        self.user2 = User.objects.create_user(username='testuser2', email='test2@email.com', password='testpass123')
+        Connection.objects.create(follower=self.user1, followed=self.user2)
+        Connection.objects.create(follower=self.user2, followed=self.user1)
+        self.room = Room.objects.create()
+        self.room.users.add(self.user1, self.user2)
+        self.messages = [
+            Message.objects.create(sender=self.user1, content='MESSAGE {}'.format(i), room=self.room)
+            for i in range(MESSAGE_PAGE_SIZE + 5)
+        ]
+        self.client.login(email='test1@email.com', password='testpass123')
+
+    def test_room_detail_shows_latest_messages(self):
+        # セッション・ユーザー・ルーム(メンバーと相互フォローを含む)・メンバー一覧・メッセージの5クエリ
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('room_detail', args=[self.room.id]))
+        self.assertContains(response, 'MESSAGE {}'.format(MESSAGE_PAGE_SIZE + 4))
+        self.assertEqual([m.content for m in response.context['messages']][-1], 'MESSAGE 5')
+        self.assertContains(response, '以前のメッセージを見る')
+        self.assertTrue(response.context['mutural_follow'])
+
+    def test_message_list_before_and_since(self):
+        url = reverse('message_list', args=[self.room.id])
+        # beforeより古いメッセージを新しい順に返す
+        data = self.client.get(url, {'before': self.messages[5].id}).json()
+        self.assertEqual([m['content'] for m in data['messages']], ['MESSAGE {}'.format(i) for i in range(4, -1, -1)])
+        self.assertFalse(data['has_more'])
+        # sinceより新しいメッセージを古い順に返す
+        data = self.client.get(url, {'since': self.messages[-3].id}).json()
+        self.assertEqual([m['id'] for m in data['messages']], [m.id for m in self.messages[-2:]])
+        self.assertEqual(self.client.get(url, {'since': 'x'}).status_code, 400)
+        # メンバー以外は取得できない
+        get_user_model().objects.create_user(username='testuser3', email='test3@email.com', password='testpass123')
+        self.client.login(email='test3@email.com', password='testpass123')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_message_create_requires_member_and_mutual_follow(self):
+        url = reverse('message_create', args=[self.room.id])
+        # メンバーは送れる
+        response = self.client.post(url, {'content': 'メンバーから'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Message.objects.filter(room=self.room, content='メンバーから').exists())
+        # メンバー以外は送れない
+        get_user_model().objects.create_user(username='testuser3', email='test3@email.com', password='testpass123')
+        self.client.login(email='test3@email.com', password='testpass123')
+        self.assertEqual(self.client.post(url, {'content': '部外者から'}).status_code, 403)
+        # 相互フォローでなくなったメンバーも送れない
+        Connection.objects.filter(follower=self.user2).delete()
+        self.client.login(email='test1@email.com', password='testpass123')
+        self.assertEqual(self.client.post(url, {'content': '片思い'}).status_code, 403)
+        self.assertEqual(Message.objects.filter(room=self.room, content__in=['部外者から', '片思い']).count(), 0)
+
 class MessageFormTest(TestCase):
 
     def setUp(self):
@@ -219,3 +353,109 @@ class MessageFormTest(TestCase):
         self.data['content'] = ''
         form = MessageForm(self.data)
         self.assertFalse(form.is_valid())
+
+
+@override_settings(CHAT_BROKER='memory')
+class ChatConsumerTest(TransactionTestCase):
+    # on_commitで配信するのでトランザクションを実際にコミットするTransactionTestCaseを使う
+    # 配信の経路はPostgresBrokerTestで確かめ、ここではプロセス内のブローカーを使う
+
+    def setUp(self):
+        User = get_user_model()
+        self.user1 = User.objects.create_user(username='testuser1', email='test1@email.com', password='testpass123')
+        self.user2 = User.objects.create_user(username='testuser2', email='test2@email.com', password='testpass123')
+        self.user3 = User.objects.create_user(username='testuser3', email='test3@email.com', password='testpass123')
+        Connection.objects.create(follower=self.user1, followed=self.user2)
+        Connection.objects.create(follower=self.user2, followed=self.user1)
+        self.room = Room.objects.create()
+        self.room.users.add(self.user1, self.user2)
+
+    def connect(self, user, origin='http://testserver'):
+        client = Client()
+        client.force_login(user)
+        cookie = '{}={}'.format(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+        scope = {
+            'type': 'websocket',
+            'path': '/ws/rooms/{}/'.format(self.room.id),
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode()), (b'origin', origin.encode())],
+        }
+        return ApplicationCommunicator(application, scope)
+
+    def test_outsiders_are_rejected(self):
+        communicators = [self.connect(self.user3), self.connect(self.user1, origin='http://evil.example')]
+
+        async def run():
+            # 部屋のメンバーでないユーザーと、別サイトからの接続は拒否される
+            for communicator in communicators:
+                await communicator.send_input({'type': 'websocket.connect'})
+                output = await communicator.receive_output(1)
+                self.assertEqual(output['type'], 'websocket.close')
+        async_to_sync(run)()
+
+    def test_messages_are_pushed_to_members(self):
+        first = self.connect(self.user1)
+        second = self.connect(self.user2)
+
+        async def run():
+            for communicator in (first, second):
+                await communicator.send_input({'type': 'websocket.connect'})
+                self.assertEqual((await communicator.receive_output(1))['type'], 'websocket.accept')
+            # WebSocketで送ったメッセージは保存され、両方の接続に届く
+            await first.send_input({'type': 'websocket.receive', 'text': json.dumps({'content': 'こんにちは'})})
+            for communicator in (first, second):
+                data = json.loads((await communicator.receive_output(1))['text'])
+                self.assertEqual(data['content'], 'こんにちは')
+                self.assertEqual(data['sender'], 'testuser1')
+            # 通常のフォームから保存されたメッセージも届く
+            await sync_to_async(Message.objects.create)(sender=self.user2, content='やあ', room=self.room)
+            for communicator in (first, second):
+                self.assertEqual(json.loads((await communicator.receive_output(1))['text'])['content'], 'やあ')
+            # 相互フォローでなくなると送信できない
+            await sync_to_async(Connection.objects.filter(follower=self.user2).delete)()
+            await second.send_input({'type': 'websocket.receive', 'text': json.dumps({'content': '届かない'})})
+            self.assertIn('error', json.loads((await second.receive_output(1))['text']))
+            for communicator in (first, second):
+                await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+                await communicator.wait(1)
+        async_to_sync(run)()
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 2)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFYはPostgreSQLでのみ使える')
+@override_settings(CHAT_BROKER='postgres')
+class PostgresBrokerTest(TransactionTestCase):
+
+    def test_listener_lifecycle(self):
+        broker = get_broker()
+        self.assertIsInstance(broker, PostgresBroker)
+        payload = {'id': 1, 'room': 1, 'sender': 'testuser1', 'content': 'こんにちは', 'created_at': ''}
+
+        def terminate(listener):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_terminate_backend(%s)', [listener.get_backend_pid()])
+
+        async def wait_for_new_listener(loop, old):
+            for _ in range(50):
+                if loop in broker.listeners and broker.listeners[loop][0] is not old:
+                    return broker.listeners[loop][0]
+                await asyncio.sleep(0.1)
+            self.fail('listener was not reconnected')
+
+        async def run():
+            loop = asyncio.get_event_loop()
+            queue = broker.subscribe(1)
+            listener = broker.listeners[loop][0]
+            # NOTIFYで届く
+            await sync_to_async(broker.publish)(payload)
+            self.assertEqual((await asyncio.wait_for(queue.get(), 5))['content'], 'こんにちは')
+            # 接続が切られたらつなぎ直してLISTENし直す
+            await sync_to_async(terminate)(listener)
+            reconnected = await wait_for_new_listener(loop, listener)
+            self.assertTrue(listener.closed)
+            await sync_to_async(broker.publish)(dict(payload, id=2))
+            self.assertEqual((await asyncio.wait_for(queue.get(), 5))['id'], 2)
+            # 最後の購読者がいなくなったら接続を閉じる
+            broker.unsubscribe(1, queue)
+            self.assertNotIn(loop, broker.listeners)
+            self.assertTrue(reconnected.closed)
+        async_to_sync(run)()
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import FollowListView, RoomDetailView, SignupView, UserUpdateView, follow, message_create, room_create, unfollow
+from .views import FollowListView, RoomDetailView, SignupView, UserUpdateView, follow, message_create, message_list, room_create, unfollow
 
 urlpatterns = [
     path('signup/', SignupView.as_view(), name='signup'),
@@ -9,5 +9,6 @@ urlpatterns = [
     path('unfollow/<int:pk>/', unfollow, name='unfollow'),
     path('room-create/<int:pk>/', room_create, name='room_create'),
     path('room/<int:pk>/', RoomDetailView.as_view(), name='room_detail'),
+    path('room/<int:pk>/messages/', message_list, name='message_list'),
     path('message/<int:pk>/', message_create, name='message_create')
 ]
\ No newline at end of file
@@ -9,8 +9,14 @@ from django.contrib.auth import views as auth_views
 from django.urls import reverse
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
 
-from accounts.models import CustomUser, Connection, Room, Message
+from accounts import social
+from accounts.chat import message_payload
+from accounts.models import CustomUser, Room, Message, room_pair_key
 
 
 class SignupView(CreateView):
@@ -57,30 +63,27 @@ class FollowListView(DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['pk'] = int(self.kwargs['pk'])
-        following_list = Connection.objects.filter(follower=CustomUser.objects.get(id=self.kwargs['pk'])).select_related('followed')
-        followed_by_list = Connection.objects.filter(followed=CustomUser.objects.get(id=self.kwargs['pk'])).select_related('follower')
+        following_list = social.following_page(self.object, self.request.GET.get('following'))
+        followed_by_list = social.followers_page(self.object, self.request.GET.get('followers'))
         context['following_list'] = following_list
         context['followed_by_list'] = followed_by_list
-        if self.request.user.username:
-            follower = CustomUser.objects.get(username=self.request.user.username)
-            followed = CustomUser.objects.get(id=self.kwargs['pk'])
-            connection_exist = Connection.objects.filter(follower=follower, followed=followed).exists()
-            context['connection_exist'] = connection_exist
-            reverse_connection_exist = Connection.objects.filter(follower=followed, followed=follower).exists()
-            mutural_follow = connection_exist and reverse_connection_exist
-            context['mutural_follow'] = mutural_follow
-            sender = CustomUser.objects.get(id=self.request.user.id)
-            receiver = CustomUser.objects.get(id=self.kwargs['pk'])
-            room_exist = Room.objects.filter(users__in=[sender]).filter(users__in=[receiver]).exists()
+        if self.request.user.is_authenticated:
+            # 表示中のユーザーとリストの各ユーザーについて、閲覧者との関係をまとめて取る
+            users = [self.object] + list(following_list) + list(followed_by_list)
+            states = social.follow_states(self.request.user, {user.id for user in users})
+            for user in users:
+                user.follow_state = states[user.id]
+            context['connection_exist'] = states[self.object.id]['following']
+            context['mutural_follow'] = states[self.object.id]['mutual']
+            room_exist = Room.objects.filter(pair_key=room_pair_key(self.request.user.id, self.kwargs['pk'])).exists()
             context['room_exist'] = room_exist
         return context
 
 @login_required
 def follow(request, *args, **kwargs):
     if request.method == 'POST':
-        follower = CustomUser.objects.get(username=request.user.username)
-        followed = CustomUser.objects.get(id=kwargs['pk'])
-        Connection.objects.create(follower=follower, followed=followed)
+        followed = get_object_or_404(CustomUser, id=kwargs['pk'])
+        social.follow(request.user, followed)
         return redirect(to='/accounts/follow-list/{}/'.format(kwargs['pk']))
     else:
         return render(request, 'user_follow.html',)
@@ -88,9 +91,8 @@ def follow(request, *args, **kwargs):
 @login_required
 def unfollow(request, *args, **kwargs):
     if request.method == 'POST':
-        follower = CustomUser.objects.get(username=request.user.username)
-        followed = CustomUser.objects.get(id=kwargs['pk'])
-        Connection.objects.get(follower=follower, followed=followed).delete()
+        followed = get_object_or_404(CustomUser, id=kwargs['pk'])
+        social.unfollow(request.user, followed)
         return redirect(to='/accounts/follow-list/{}/'.format(kwargs['pk']))
     else:
         return render(request, 'user_follow.html',)
@@ -98,51 +100,76 @@ def unfollow(request, *args, **kwargs):
 @login_required
 def room_create(request, **kwargs):
     if request.method == 'POST':
-        sender = CustomUser.objects.get(id=request.user.id)
-        receiver = CustomUser.objects.get(id=kwargs['pk'])
-        if Room.objects.filter(users__in=[sender]).filter(users__in=[receiver]).count() == 0:
-            room = Room.objects.create()
-            room.users.add(sender)
-            room.users.add(receiver)
-        else:
-            room = Room.objects.filter(users__in=[sender]).filter(users__in=[receiver]).first()
+        receiver = get_object_or_404(CustomUser, id=kwargs['pk'])
+        room, created = Room.objects.get_or_create_for_pair(request.user, receiver)
     return redirect(to='/accounts/room/{}'.format(room.id))
 
+# ルームページに最初に表示するメッセージ数と、JSONで一度に返すメッセージ数
+MESSAGE_PAGE_SIZE = 30
+
+
 class RoomDetailView(LoginRequiredMixin,UserPassesTestMixin,DetailView):
     model = Room
     template_name = 'accounts/room_detail.html'
 
+    def get_queryset(self):
+        return Room.objects.with_status(self.request.user)
+
+    def get_object(self, queryset=None):
+        # test_funcとget()で同じルームを2回取らない
+        if not hasattr(self, 'room'):
+            self.room = super().get_object(queryset)
+        return self.room
+
     def test_func(self):
-        user = self.request.user
-        room = Room.objects.get(id = self.kwargs['pk'])
-        room_users = room.users.all().values_list('id', flat=True)
-        room_users = {id for id in room_users}
-        return {user.id} < room_users
+        return self.get_object().is_member
 
     def get_context_data(self, **kwargs):
         context = super(RoomDetailView, self).get_context_data(**kwargs)
         context['pk'] = self.kwargs['pk']
         form = MessageForm()
         context['form'] = form
-        messages = Message.objects.filter(room_id=self.kwargs['pk']).order_by('-created_at')
-        context['messages'] = messages
+        messages = list(Message.objects.filter(room_id=self.kwargs['pk']).select_related('sender')
+                        .order_by('-id')[:MESSAGE_PAGE_SIZE + 1])
+        context['messages'] = messages[:MESSAGE_PAGE_SIZE]
+        context['has_older'] = len(messages) > MESSAGE_PAGE_SIZE
+        context['latest_id'] = messages[0].id if messages else 0
         # 相互フォロー状態の真偽を'mutural_follow'で返す
-        room = Room.objects.get(id=self.kwargs['pk'])
-        room_users = room.users.all().values_list('id', flat=True)
-        room_users = list(room_users)
-        user1 = CustomUser.objects.get(id=room_users[0])
-        user2 = CustomUser.objects.get(id=room_users[1])
-        connection_exist = Connection.objects.filter(follower=user1, followed=user2).exists()
-        reverse_connection_exist = Connection.objects.filter(follower=user2, followed=user1).exists()
-        mutural_follow = connection_exist and reverse_connection_exist
-        context['mutural_follow'] = mutural_follow
+        context['mutural_follow'] = self.object.mutural_follow
         return context
 
+
+@login_required
+@require_GET
+def message_list(request, **kwargs):
+    # ?before=<id> でそれより古いメッセージを新しい順に、?since=<id> でそれより新しいメッセージを古い順に返す
+    room = get_object_or_404(Room.objects.with_status(request.user), id=kwargs['pk'])
+    if not room.is_member:
+        raise PermissionDenied
+    messages = Message.objects.filter(room_id=room.id).select_related('sender')
+    try:
+        if 'since' in request.GET:
+            messages = messages.filter(id__gt=int(request.GET['since'])).order_by('id')
+        else:
+            if 'before' in request.GET:
+                messages = messages.filter(id__lt=int(request.GET['before']))
+            messages = messages.order_by('-id')
+    except ValueError:
+        return JsonResponse({'error': 'invalid cursor'}, status=400)
+    messages = list(messages[:MESSAGE_PAGE_SIZE + 1])
+    return JsonResponse({
+        'messages': [message_payload(message) for message in messages[:MESSAGE_PAGE_SIZE]],
+        'has_more': len(messages) > MESSAGE_PAGE_SIZE,
+    })
+
 @login_required
 def message_create(request, **kwargs):
     if request.method == 'POST':
-        sender = request.user
-        content = request.POST['content']
-        room = Room.objects.get(id=kwargs['pk'])
-        Message.objects.create(sender=sender, content=content, room=room)
+        # 保存したメッセージはWebSocketで配られるので、chat.create_messageと同じくメンバーで相互フォローの間だけ送れる
+        room = get_object_or_404(Room.objects.with_status(request.user), id=kwargs['pk'])
+        if not room.is_member or not room.mutural_follow:
+            raise PermissionDenied
+        form = MessageForm(request.POST)
+        if form.is_valid():
+            Message.objects.create(sender=request.user, content=form.cleaned_data['content'], room=room)
     return redirect(to='/accounts/room/{}/'.format(kwargs['pk']))
\ No newline at end of file
@@ -0,0 +1,8 @@
+import os
+
+
+def setup():
+    # manage.pyを経由せずに python -m benchmarks.xxx で実行できるようにする
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
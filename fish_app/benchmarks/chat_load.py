@@ -0,0 +1,145 @@
+"""DMのWebSocketに多数の接続を張ったまま、メッセージが全員に届くまでの時間を測る。
+
+uvicornのワーカー1つに対して実行する(同じデータベースを参照すること)::
+
+    uvicorn config.asgi:application --port 8001 --workers 1
+    python -m benchmarks.chat_load --url ws://localhost:8001 --connections 500 --rooms 50
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from benchmarks import setup
+
+
+def prepare(rooms):
+    # 部屋のユーザーを相互フォローにし、それぞれのセッションを作る
+    from django.conf import settings
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from importlib import import_module
+
+    from accounts.models import Connection, Room
+
+    SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+    sessions = {}
+    members = []
+    for room in Room.objects.prefetch_related('users').order_by('id')[:rooms]:
+        users = list(room.users.all())
+        if len(users) != 2:
+            continue
+        Connection.objects.get_or_create(follower=users[0], followed=users[1])
+        Connection.objects.get_or_create(follower=users[1], followed=users[0])
+        for user in users:
+            if user.pk not in sessions:
+                session = SessionStore()
+                session[SESSION_KEY] = str(user.pk)
+                session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+                session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+                session.create()
+                sessions[user.pk] = session.session_key
+        members.append((room.pk, [sessions[user.pk] for user in users]))
+    return settings.SESSION_COOKIE_NAME, members
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def run(url, cookie_name, members, connections, messages, interval, connect_concurrency):
+    import websockets
+
+    sent = {}
+    latencies = []
+    received = 0
+    failures = 0
+    semaphore = asyncio.Semaphore(connect_concurrency)
+    host = url.split('://', 1)[-1].split('/', 1)[0]
+
+    async def open_connection(index):
+        nonlocal failures
+        room_id, session_keys = members[index % len(members)]
+        session_key = session_keys[index // len(members) % 2]
+        async with semaphore:
+            try:
+                return room_id, await websockets.connect(
+                    '{}/ws/rooms/{}/'.format(url, room_id),
+                    extra_headers={'Cookie': '{}={}'.format(cookie_name, session_key)},
+                    origin='http://{}'.format(host), max_queue=None)
+            except Exception:
+                failures += 1
+                return room_id, None
+
+    async def read(socket):
+        nonlocal received
+        async for text in socket:
+            received += 1
+            content = json.loads(text).get('content')
+            if content in sent:
+                latencies.append((time.perf_counter() - sent[content]) * 1000)
+
+    started = time.perf_counter()
+    opened = await asyncio.gather(*(open_connection(i) for i in range(connections)))
+    opened = [(room_id, socket) for room_id, socket in opened if socket is not None]
+    connect_seconds = time.perf_counter() - started
+    readers = [asyncio.ensure_future(read(socket)) for room_id, socket in opened]
+
+    # 部屋ごとに最初の接続から送信する。届くべき数は部屋の接続数の合計
+    senders = {}
+    for room_id, socket in opened:
+        senders.setdefault(room_id, []).append(socket)
+    expected = 0
+    for n in range(messages):
+        for room_id, sockets in senders.items():
+            content = 'load-{}-{}'.format(room_id, n)
+            sent[content] = time.perf_counter()
+            await sockets[0].send(json.dumps({'content': content}))
+            expected += len(sockets)
+        await asyncio.sleep(interval)
+    await asyncio.sleep(max(interval, 1))
+
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*(socket.close() for room_id, socket in opened), return_exceptions=True)
+    return {
+        'connections': len(opened),
+        'failures': failures,
+        'connect_seconds': connect_seconds,
+        'expected': expected,
+        'received': received,
+        'latencies': latencies,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='ws://localhost:8001')
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20, help='1部屋あたりの送信数')
+    parser.add_argument('--interval', type=float, default=0.5)
+    parser.add_argument('--connect-concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    setup()
+    cookie_name, members = prepare(args.rooms)
+    if not members:
+        parser.error('部屋がありません。先に benchmarks.seed でデータを作ってください')
+    report = asyncio.run(run(
+        args.url, cookie_name, members, args.connections, args.messages, args.interval,
+        args.connect_concurrency))
+
+    latencies = report['latencies']
+    print('connections: {connections} (failed {failures}) in {connect_seconds:.2f}s'.format(**report))
+    print('deliveries:  {received}/{expected}'.format(**report))
+    print('latency ms:  p50 {:.1f} / p95 {:.1f} / p99 {:.1f} / max {:.1f} / mean {:.1f}'.format(
+        percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99),
+        max(latencies, default=0.0), statistics.mean(latencies) if latencies else 0.0))
+
+
+if __name__ == '__main__':
+    main()
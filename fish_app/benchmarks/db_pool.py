@@ -0,0 +1,139 @@
+"""DB接続のプール(config/db_pool)の有無で、follow/unfollowの1秒あたりのリクエスト数を比べる。
+
+リクエストごとに接続する場合・CONN_MAX_AGEで持ち続ける場合・プールを使う場合を、それぞれ別のプロセスで実行する。
+テスト用のクライアントはリクエストの終わりに接続を閉じないので、WSGIのハンドラーを直接呼ぶ。
+PostgreSQLのデータベースに対して実行すること::
+
+    python -m benchmarks.db_pool --requests 2000 --threads 4
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks import setup
+
+MODES = {
+    'close': {'DB_POOL': 'False', 'CONN_MAX_AGE': '0'},
+    'persistent': {'DB_POOL': 'False', 'CONN_MAX_AGE': '600'},
+    'pool': {'DB_POOL': 'True', 'CONN_MAX_AGE': '0'},
+}
+
+
+def prepare(threads):
+    # スレッドごとにフォローする側のユーザーとセッション、フォローされる側のユーザーを用意する
+    from importlib import import_module
+
+    from django.conf import settings
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+
+    User = get_user_model()
+    SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+    users = []
+    for i in range(threads + 1):
+        user, created = User.objects.get_or_create(
+            username='pool-bench-{}'.format(i), defaults={'email': 'pool-bench-{}@example.com'.format(i)})
+        users.append(user)
+    sessions = []
+    for user in users[1:]:
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        sessions.append(session.session_key)
+    return users[0].pk, sessions
+
+
+def request(application, path, cookie, csrf_token, host):
+    environ = {
+        'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+        'SERVER_NAME': host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': host,
+        'HTTP_COOKIE': cookie, 'HTTP_X_CSRFTOKEN': csrf_token, 'CONTENT_LENGTH': '0',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False, 'wsgi.version': (1, 0),
+    }
+    status = []
+    response = application(environ, lambda s, headers: status.append(s))
+    try:
+        b''.join(response)
+    finally:
+        # request_finishedが送られ、接続が閉じられる(プールなら返される)
+        response.close()
+    return status[0]
+
+
+def run(requests, threads):
+    # 1つのモードを実行して、結果をJSONで標準出力に書く
+    setup()
+    from django.conf import settings
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connection
+    from django.middleware.csrf import _get_new_csrf_token
+    from django.urls import reverse
+
+    from config.db_pool.pool import pool_stats
+
+    followed_id, sessions = prepare(threads)
+    connection.close()
+    application = get_wsgi_application()
+    host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+    paths = [reverse('follow', args=[followed_id]), reverse('unfollow', args=[followed_id])]
+    per_thread = requests // threads
+    errors = []
+
+    def worker(session_key):
+        csrf_token = _get_new_csrf_token()
+        cookie = '{}={}; {}={}'.format(
+            settings.SESSION_COOKIE_NAME, session_key, settings.CSRF_COOKIE_NAME, csrf_token)
+        for i in range(per_thread):
+            status = request(application, paths[i % 2], cookie, csrf_token, host)
+            if not status.startswith('302'):
+                errors.append(status)
+
+    workers = [threading.Thread(target=worker, args=[session_key]) for session_key in sessions]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        'requests': per_thread * threads, 'seconds': elapsed, 'errors': len(errors),
+        'pool': pool_stats().get('default'),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--mode', choices=MODES, help='1つのモードだけを実行する(比較のときに内部で使う)')
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.requests, args.threads)
+        return
+
+    print('{:<12} {:>10} {:>8} {:>10} {:>10} {:>10}'.format(
+        'mode', 'req/s', 'errors', 'created', 'waits', 'exhausted'))
+    for mode, variables in MODES.items():
+        env = dict(os.environ, DB_POOL_MAX_SIZE=str(args.pool_size), **variables)
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.db_pool', '--mode', mode,
+             '--requests', str(args.requests), '--threads', str(args.threads)],
+            env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        pool = result['pool'] or {}
+        print('{:<12} {:>10.0f} {:>8} {:>10} {:>10} {:>10}'.format(
+            mode, result['requests'] / result['seconds'], result['errors'],
+            pool.get('created', '-'), pool.get('waits', '-'), pool.get('exhausted', '-')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""主要なクエリのEXPLAINと実行時間を、インデックスを外した状態と付けた状態で比較する。
+
+使い捨てのデータベースで実行すること(インデックスを一時的に削除する)::
+
+    python -m benchmarks.query_indexes --users 5000 --trips 200000
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks import setup
+
+
+def build_queries():
+    from accounts.models import Connection, Message
+    from trips.models import Result, Trip
+    from benchmarks.seed import FISH_NAMES
+
+    trip = Trip.objects.order_by('-created_at').values('user_id').first()
+    connection = Connection.objects.values('follower_id', 'followed_id').first()
+    message = Message.objects.values('room_id').first()
+    return {
+        'search': Result.objects.filter(fish_name=FISH_NAMES[0], trip__prefecture='東京都').values(
+            'id', 'fish_name', 'created_at', 'trip__title', 'trip__user__username').order_by('-created_at', '-id')[:12],
+        'top': Trip.objects.select_related('user').order_by('-created_at')[:6],
+        'user_trips': Trip.objects.filter(user_id=trip['user_id']).order_by('-created_at')[:6],
+        'room_messages': Message.objects.filter(room_id=message['room_id']).order_by('-created_at')[:30],
+        'connection_exists': Connection.objects.filter(
+            follower_id=connection['follower_id'], followed_id=connection['followed_id'])[:1],
+    }
+
+
+def managed_indexes():
+    from accounts.models import Connection, Message
+    from trips.models import Comment, Result, Trip
+
+    for model in (Trip, Result, Comment, Message):
+        for index in model._meta.indexes:
+            yield model, index, 'index'
+    for constraint in Connection._meta.constraints:
+        yield Connection, constraint, 'constraint'
+
+
+def drop_indexes():
+    from django.db import connection
+    with connection.schema_editor() as editor:
+        for model, index, kind in managed_indexes():
+            getattr(editor, 'remove_' + kind)(model, index)
+
+
+def create_indexes():
+    from django.db import connection
+    with connection.schema_editor() as editor:
+        for model, index, kind in managed_indexes():
+            getattr(editor, 'add_' + kind)(model, index)
+
+
+def analyze():
+    from django.db import connection
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def measure(queries, repeat):
+    report = {}
+    for name, queryset in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset._chain())
+            timings.append((time.perf_counter() - started) * 1000)
+        report[name] = {'plan': queryset.explain(), 'median_ms': statistics.median(timings), 'min_ms': min(timings)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--trips', type=int, default=50000)
+    parser.add_argument('--skip-seed', action='store_true', help='既存のデータをそのまま使う')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+    import sys
+    from benchmarks.seed import seed
+
+    if not args.skip_seed:
+        seed(users=args.users, trips=args.trips, rooms=args.users // 4, stdout=sys.stdout)
+    queries = build_queries()
+
+    drop_indexes()
+    analyze()
+    before = measure(queries, args.repeat)
+    create_indexes()
+    analyze()
+    after = measure(queries, args.repeat)
+
+    for name in queries:
+        print('=' * 70)
+        print(name)
+        print('-- before: median {median_ms:.2f}ms / min {min_ms:.2f}ms'.format(**before[name]))
+        print(before[name]['plan'])
+        print('-- after:  median {median_ms:.2f}ms / min {min_ms:.2f}ms'.format(**after[name]))
+        print(after[name]['plan'])
+
+
+if __name__ == '__main__':
+    main()
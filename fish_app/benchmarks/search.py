@@ -0,0 +1,125 @@
+"""魚名・キーワード検索の実行時間を、以前の完全一致・単純な部分一致と比べる。
+
+釣果が100万件前後になるようにデータを作ってから測る。使い捨てのデータベースで実行すること::
+
+    python -m benchmarks.search --users 5000 --trips 400000 --results-per-trip 2
+    python -m benchmarks.search --skip-seed --explain
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks import setup
+
+PAGE_SIZE = 12
+FISH_QUERIES = ['サバ', 'ごまさば', 'ｶﾚｲ', 'カサコ', 'シーバス']
+KEYWORDS = ['堤防', '朝まずめ', 'サビキで数釣り', 'ジグ', '管理釣り場']
+PREFIXES = ['マ', 'カ', 'サク']
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+
+def build_cases():
+    # (名前, 検索語, 以前の方法, 新しい方法)
+    from django.db.models import Q
+
+    from trips import search
+    from trips.models import Result, Trip
+    from trips.normalize import normalize_fish_name
+
+    columns = ('id', 'fish_name', 'created_at', 'trip__title', 'trip__user__username')
+
+    def fish_exact(query):
+        return list(Result.objects.filter(fish_name=query).values(*columns).order_by('-created_at', '-id')[:PAGE_SIZE])
+
+    def fish_contains(query):
+        query = normalize_fish_name(query)
+        return list(Result.objects.filter(fish_name__contains=query).values(*columns).order_by(
+            '-created_at', '-id')[:PAGE_SIZE])
+
+    def fish_search(query):
+        names = [row['fish_name'] for row in search.fish_name_candidates(query)]
+        if not names:
+            return search.similar_fish_names(query)
+        return list(Result.objects.filter(fish_name__in=names).values(*columns).order_by(
+            '-created_at', '-id')[:PAGE_SIZE])
+
+    def keyword_contains(query):
+        return list(Trip.objects.filter(Q(title__icontains=query) | Q(content__icontains=query)).order_by(
+            '-created_at', '-id')[:PAGE_SIZE])
+
+    def keyword_search(query):
+        return search.search_page(search.search_trips(query), 1, PAGE_SIZE)[0]
+
+    def suggest_scan(query):
+        query = normalize_fish_name(query)
+        return sorted({name for name in Result.objects.filter(fish_name__startswith=query).values_list(
+            'fish_name', flat=True).distinct()})[:search.SUGGEST_LIMIT]
+
+    cases = []
+    cases += [('fish', query, lambda q=query: fish_exact(q), lambda q=query: fish_search(q)) for query in FISH_QUERIES]
+    cases += [('fish-contains', query, lambda q=query: fish_contains(q), lambda q=query: fish_search(q))
+              for query in FISH_QUERIES[:2]]
+    cases += [('keyword', query, lambda q=query: keyword_contains(q), lambda q=query: keyword_search(q))
+              for query in KEYWORDS]
+    cases += [('suggest', query, lambda q=query: suggest_scan(q), lambda q=query: search.suggest_fish_names(q))
+              for query in PREFIXES]
+    return cases
+
+
+def explain(query):
+    from trips import search
+
+    print('-- keyword plan: {}'.format(query))
+    print(search.search_trips(query)[:PAGE_SIZE].explain())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--trips', type=int, default=400000)
+    parser.add_argument('--results-per-trip', type=int, default=2, help='釣行あたりの平均釣果数(0〜2倍でばらつく)')
+    parser.add_argument('--skip-seed', action='store_true', help='既存のデータをそのまま使う')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--explain', action='store_true', help='キーワード検索の実行計画を表示する')
+    args = parser.parse_args()
+
+    setup()
+    import sys
+    from django.db import connection
+    from benchmarks.seed import seed
+    from trips.models import Result, Trip
+
+    if not args.skip_seed:
+        seed(users=args.users, trips=args.trips, results_per_trip=args.results_per_trip, comments_per_trip=0,
+             follows_per_user=0, rooms=0, stdout=sys.stdout)
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    else:
+        print('PostgreSQL以外ではトライグラム・全文検索のインデックスを使わない方法で測ります')
+    print('trips: {} results: {}'.format(Trip.objects.count(), Result.objects.count()))
+
+    print('{:<14} {:<16} {:>12} {:>12} {:>12} {:>12}'.format(
+        'case', 'query', 'before-p50', 'before-p95', 'after-p50', 'after-p95'))
+    for name, query, before, after in build_cases():
+        before_p50, before_p95 = timed(before, args.repeat)
+        after_p50, after_p95 = timed(after, args.repeat)
+        print('{:<14} {:<16} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}'.format(
+            name, query, before_p50, before_p95, after_p50, after_p95))
+
+    if args.explain:
+        for query in KEYWORDS:
+            explain(query)
+
+
+if __name__ == '__main__':
+    main()
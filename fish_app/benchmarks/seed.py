@@ -0,0 +1,160 @@
+"""ベンチマーク用の架空のデータ(ユーザー・釣行・釣果・コメント・フォロー・DMのルームとメッセージ)を投入する。
+
+使い捨てのデータベースで実行すること::
+
+    python -m benchmarks.seed --users 5000 --trips 100000 --rooms 2000
+"""
+import argparse
+import datetime
+import itertools
+import random
+import sys
+
+from benchmarks import setup
+
+setup()
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+
+from accounts.models import Connection, Message, Room, room_pair_key
+from accounts.social import refresh_counts
+from trips.models import Comment, Result, Trip
+from trips.prefectures import choice_prefectures
+from trips.search import refresh_search_vectors
+from trips.transfer import explicit_timestamps
+
+FISH_NAMES = [
+    'アジ', 'マアジ', 'サバ', 'マサバ', 'ゴマサバ', 'イワシ', 'カタクチイワシ', 'カレイ', 'マコガレイ', 'ヒラメ',
+    'メバル', 'カサゴ', 'アイナメ', 'スズキ', 'シーバス', 'クロダイ', 'マダイ', 'イシダイ', 'ブリ', 'ハマチ',
+    'カンパチ', 'ヒラマサ', 'カツオ', 'マグロ', 'タチウオ', 'キス', 'ハゼ', 'アオリイカ', 'ヤリイカ', 'マダコ',
+    'ニジマス', 'ヤマメ', 'イワナ', 'アユ', 'ブラックバス', 'ナマズ', 'コイ', 'フナ', 'ウナギ', 'カワハギ',
+    'ベラ', 'サヨリ', 'メジナ', 'グレ', 'ソイ', 'ホッケ', 'サケ', 'サクラマス', 'ワカサギ', 'シロギス',
+]
+PREFECTURES = [value for value, label in choice_prefectures if value]
+# 全文検索のベンチマーク用に、タイトルと内容をばらつかせる
+SPOTS = ['堤防', '磯', '船', 'サーフ', '河口', '漁港', '渓流', '湖', '管理釣り場', 'テトラ帯']
+PHRASES = [
+    '朝まずめに時合いが来ました。', '潮止まりで食いが落ちました。', 'サビキで数釣りを楽しみました。',
+    'ルアーにはあまり反応がありませんでした。', '風が強くて釣りにくい一日でした。', '家族で釣りに行きました。',
+    '夕方から夜にかけて釣れ続きました。', '餌はオキアミを使いました。', '型は小さめでしたが数は出ました。',
+    '次回は仕掛けを見直したいです。', 'ジグを遠投して底を探りました。', '水温が下がって渋い状況でした。',
+]
+BATCH_SIZE = 500
+
+
+def bulk_insert(model, objs):
+    # 大量の行でもメモリに全件載せないように、BATCH_SIZE件ずつ投入する
+    objs = iter(objs)
+    while True:
+        batch = list(itertools.islice(objs, BATCH_SIZE))
+        if not batch:
+            return
+        model.objects.bulk_create(batch)
+
+
+def random_datetime(rng, days=730):
+    return datetime.datetime.now() - datetime.timedelta(seconds=rng.randrange(days * 24 * 60 * 60))
+
+
+# 人気の魚種に偏らせる(Zipf分布に近い重み)
+FISH_WEIGHTS = [1 / (rank + 1) for rank in range(len(FISH_NAMES))]
+
+
+def seed(users=1000, trips=10000, results_per_trip=2, comments_per_trip=1,
+         follows_per_user=20, rooms=500, messages_per_room=20, random_seed=0, stdout=None):
+    rng = random.Random(random_seed)
+    User = get_user_model()
+    password = make_password('benchpass123')
+
+    def log(message):
+        if stdout is not None:
+            stdout.write(message + '\n')
+
+    with explicit_timestamps(Trip, Result, Comment, Connection, Message):
+        offset = User.objects.count()
+        bulk_insert(User,
+            (User(username='bench{}'.format(offset + i), email='bench{}@example.com'.format(offset + i),
+                  password=password, introduce='ベンチマーク用ユーザー')
+             for i in range(users)))
+        user_ids = list(User.objects.values_list('id', flat=True))
+        log('users: {}'.format(len(user_ids)))
+
+        bulk_insert(Trip,
+            (Trip(title='{}で{}釣り{}'.format(rng.choice(SPOTS), rng.choices(FISH_NAMES, FISH_WEIGHTS)[0], i),
+                  prefecture=rng.choice(PREFECTURES), content=''.join(rng.sample(PHRASES, 3)),
+                  user_id=rng.choice(user_ids), created_at=created_at, updated_at=created_at)
+             for i, created_at in enumerate(random_datetime(rng) for _ in range(trips))))
+        trip_rows = list(Trip.objects.values_list('id', 'created_at'))
+        log('trips: {}'.format(len(trip_rows)))
+
+        bulk_insert(Result,
+            (Result(fish_name=fish_name, trip_id=trip_id, created_at=created_at)
+             for trip_id, created_at in trip_rows
+             for fish_name in rng.choices(FISH_NAMES, FISH_WEIGHTS, k=rng.randint(0, results_per_trip * 2))))
+        bulk_insert(Comment,
+            (Comment(content='コメント', trip_id=trip_id, user_id=rng.choice(user_ids),
+                     created_at=created_at + datetime.timedelta(hours=1))
+             for trip_id, created_at in trip_rows
+             for _ in range(rng.randint(0, comments_per_trip * 2))))
+        log('results: {} comments: {}'.format(Result.objects.count(), Comment.objects.count()))
+
+        pairs = set()
+        for follower in user_ids:
+            for followed in rng.sample(user_ids, min(follows_per_user, len(user_ids))):
+                if follower != followed:
+                    pairs.add((follower, followed))
+        existing = set(Connection.objects.values_list('follower_id', 'followed_id'))
+        bulk_insert(Connection,
+            (Connection(follower_id=a, followed_id=b, created_at=random_datetime(rng))
+             for a, b in pairs - existing))
+        # bulk_createはシグナルを送らないのでフォロー数を数え直す
+        refresh_counts()
+        log('connections: {}'.format(Connection.objects.count()))
+
+        RoomUser = Room.users.through
+        existing = set(Room.objects.values_list('pair_key', flat=True))
+        pair_keys = {}
+        for _ in range(rooms):
+            pair = rng.sample(user_ids, 2)
+            key = room_pair_key(*pair)
+            if key not in existing:
+                pair_keys[key] = pair
+        bulk_insert(Room, (Room(pair_key=key) for key in pair_keys))
+        members = {room_id: pair_keys[key] for room_id, key in
+                   Room.objects.filter(pair_key__in=list(pair_keys)).values_list('id', 'pair_key')}
+        bulk_insert(RoomUser,
+            (RoomUser(room_id=room_id, customuser_id=user_id)
+             for room_id, pair in members.items() for user_id in pair))
+        bulk_insert(Message,
+            (Message(room_id=room_id, sender_id=rng.choice(pair), content='メッセージ', created_at=random_datetime(rng))
+             for room_id, pair in members.items() for _ in range(messages_per_room)))
+        log('rooms: {} messages: {}'.format(Room.objects.count(), Message.objects.count()))
+
+    # bulk_createはシグナルを送らないので集計テーブルと一覧用の値を作り直す
+    call_command('rebuild_monthly_catch', stdout=stdout)
+    Trip.objects.refresh_listings()
+    log('search vectors: {}'.format(refresh_search_vectors()))
+    call_command('rebuild_timelines', stdout=stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--trips', type=int, default=10000)
+    parser.add_argument('--results-per-trip', type=int, default=2, help='釣行あたりの釣果の平均')
+    parser.add_argument('--comments-per-trip', type=int, default=1, help='釣行あたりのコメントの平均')
+    parser.add_argument('--follows-per-user', type=int, default=20)
+    parser.add_argument('--rooms', type=int, default=500)
+    parser.add_argument('--messages-per-room', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    seed(users=args.users, trips=args.trips, results_per_trip=args.results_per_trip,
+         comments_per_trip=args.comments_per_trip, follows_per_user=args.follows_per_user, rooms=args.rooms,
+         messages_per_room=args.messages_per_room, random_seed=args.seed, stdout=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
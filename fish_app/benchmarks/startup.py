@@ -0,0 +1,63 @@
+"""ワーカーの起動時(config.wsgiとURLconfの読み込み)にかかる時間とメモリを、モジュールごとに測る。
+
+python -X importtime で別プロセスに読み込ませ、累計時間の長いパッケージから順に表示する。
+config.wsgiだけではビューは読み込まれず、最初のリクエストでconfig.urlsから読み込まれるので、既定では両方を読み込む::
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --modules config.wsgi --top 30
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# 子プロセスで実行する。読み込み後の最大RSS(KiB)と、重いライブラリが読み込まれたかを出力する
+CHILD = '''
+import importlib, resource, sys, time
+started = time.perf_counter()
+for module in {modules!r}:
+    importlib.import_module(module)
+elapsed = time.perf_counter() - started
+print('elapsed', elapsed)
+print('maxrss', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+print('loaded', ','.join(name for name in ('matplotlib', 'numpy', 'PIL', 'psycopg2') if name in sys.modules))
+'''
+
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package" の行を(累計us, 自身us, 深さ, 名前)にする
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), int(self_us), depth, name.strip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modules', nargs='+', default=['config.wsgi', 'config.urls'], help='順に読み込むモジュール')
+    parser.add_argument('--top', type=int, default=20, help='表示するモジュールの数')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD.format(modules=args.modules)],
+        env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    result = dict(line.split(' ', 1) for line in output.stdout.splitlines() if ' ' in line)
+    rows = parse_importtime(output.stderr)
+
+    print('{}: {:.0f}ms / maxrss {:.1f}MiB / modules {}'.format(
+        ' + '.join(args.modules), float(result['elapsed']) * 1000, int(result['maxrss']) / 1024, len(rows)))
+    print('loaded: {}'.format(result.get('loaded', '').strip() or '-'))
+    # 他のモジュールの中で読み込まれた分も含む累計時間の順。深さ0がトップレベルで読み込んだモジュール
+    print('{:>10} {:>10} {:>6}  {}'.format('cum(ms)', 'self(ms)', 'depth', 'module'))
+    for cumulative_us, self_us, depth, name in sorted(rows, reverse=True)[:args.top]:
+        print('{:>10.1f} {:>10.1f} {:>6}  {}'.format(cumulative_us / 1000, self_us / 1000, depth, name))
+
+
+if __name__ == '__main__':
+    main()
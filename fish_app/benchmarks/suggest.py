@@ -0,0 +1,96 @@
+"""魚名の補完候補の索引(trips.suggest)のメモリ使用量と1回あたりの検索時間を測る。
+
+魚名は架空のカタカナ名を作るか、--from-db でデータベースの集計テーブルから読む::
+
+    python -m benchmarks.suggest --names 50000
+    python -m benchmarks.suggest --from-db --compare-db
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from benchmarks import setup
+
+KATAKANA = [chr(code) for code in range(ord('ァ'), ord('ン') + 1)] + ['ー']
+
+
+def fake_counts(size, rng):
+    # 実際の魚名と同じく2〜8文字のカタカナ名。件数は順位の逆数に比例させる
+    names = set()
+    while len(names) < size:
+        names.add(''.join(rng.choice(KATAKANA) for _ in range(rng.randint(2, 8))))
+    return {name: max(1, int(100000 / (rank + 1))) for rank, name in enumerate(sorted(names, key=lambda n: rng.random()))}
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def measure(func, prefixes):
+    timings = []
+    for prefix in prefixes:
+        started = time.perf_counter_ns()
+        func(prefix)
+        timings.append((time.perf_counter_ns() - started) / 1000)
+    return percentile(timings, 50), percentile(timings, 99), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--names', type=int, default=20000, help='架空の魚名の数')
+    parser.add_argument('--from-db', action='store_true', help='データベースの魚名を使う')
+    parser.add_argument('--compare-db', action='store_true', help='データベースに前方一致で問い合わせた場合と比べる')
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup()
+    from django.db.models import Sum
+    from trips.models import MonthlyCatch
+    from trips.suggest import FishNameIndex
+
+    rng = random.Random(args.seed)
+    if args.from_db:
+        counts = dict(MonthlyCatch.objects.values_list('fish_name').annotate(total=Sum('count')).order_by())
+    else:
+        counts = fake_counts(args.names, rng)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = FishNameIndex()
+    index.load(counts)
+    load_ms = (time.perf_counter() - started) * 1000
+    del counts
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('names: {} / load {:.1f}ms / memory {:.1f}KiB (peak {:.1f}KiB)'.format(
+        len(index), load_ms, size / 1024, peak / 1024))
+    if not len(index):
+        parser.error('魚名がありません。先に benchmarks.seed でデータを作ってください')
+
+    # 入力途中を想定して、実在する魚名の先頭1〜3文字で引く
+    names = index.names
+    print('{:<10} {:>10} {:>10} {:>10}'.format('prefix', 'p50(us)', 'p99(us)', 'max(us)'))
+    for length in (1, 2, 3):
+        prefixes = [rng.choice(names)[:length] for _ in range(args.lookups)]
+        print('{:<10} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            '{} chars'.format(length), *measure(lambda p: index.lookup(p, args.limit), prefixes)))
+
+    updates = [rng.choice(names) for _ in range(args.lookups)]
+    print('{:<10} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+        'add', *measure(lambda name: index.add(name, 1), updates)))
+
+    if args.compare_db:
+        def query(prefix):
+            return list(MonthlyCatch.objects.filter(fish_name__startswith=prefix).values('fish_name').annotate(
+                total=Sum('count')).filter(total__gt=0).order_by('-total', 'fish_name').values_list(
+                'fish_name', flat=True)[:args.limit])
+        prefixes = [rng.choice(names)[:2] for _ in range(min(args.lookups, 500))]
+        print('{:<10} {:>10.1f} {:>10.1f} {:>10.1f}'.format('database', *measure(query, prefixes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""タイムラインの書き込み時展開(fan-out-on-write)と表示時取得(fan-out-on-read)を比較する。
+
+人気に偏りのあるフォロー関係を作り、フォロー数ごとに読み込み時間、投稿者のフォロワー数ごとに書き込み時間を測る。
+使い捨てのデータベースで実行すること::
+
+    python -m benchmarks.timeline --users 5000 --trips 100000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks import setup
+
+PAGE_SIZE = 6
+
+
+def build_graph(user_ids, max_follows, rng):
+    # フォローされる側は順位の逆数の重みで選び、フォローする数も少数のユーザーに偏らせる
+    from accounts.models import Connection
+    from accounts.social import refresh_counts
+    from benchmarks.seed import bulk_insert
+
+    Connection.objects.all().delete()
+    weights = [1 / (rank + 1) for rank in range(len(user_ids))]
+    pairs = set()
+    for follower in user_ids:
+        count = min(int(rng.paretovariate(1.2) * 5), max_follows, len(user_ids) - 1)
+        for followed in rng.choices(user_ids, weights, k=count):
+            if followed != follower:
+                pairs.add((follower, followed))
+    bulk_insert(Connection, (Connection(follower_id=a, followed_id=b) for a, b in pairs))
+    refresh_counts()
+    return len(pairs)
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def read_page(user, on_demand, depth):
+    from trips.timeline import timeline_page
+
+    page = timeline_page(user, PAGE_SIZE, on_demand=on_demand)
+    for _ in range(depth):
+        if not page.has_next:
+            break
+        page = timeline_page(user, PAGE_SIZE, after=page.next_cursor, on_demand=on_demand)
+    return page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--trips', type=int, default=50000)
+    parser.add_argument('--max-follows', type=int, default=3000)
+    parser.add_argument('--skip-seed', action='store_true', help='既存のデータをそのまま使う')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--depth', type=int, default=10, help='何ページ目まで読むか')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db import transaction
+    from benchmarks.seed import seed
+    from trips.models import TimelineEntry, Trip
+    from trips.timeline import fan_out_trip
+
+    rng = random.Random(args.seed)
+    User = get_user_model()
+    if not args.skip_seed:
+        seed(users=args.users, trips=args.trips, follows_per_user=0, rooms=0, random_seed=args.seed)
+        user_ids = list(User.objects.values_list('id', flat=True))
+        print('connections: {}'.format(build_graph(user_ids, args.max_follows, rng)))
+
+    # 比較のため全員のタイムラインを書き込んでおく
+    settings.TIMELINE_READ_THRESHOLD = User.objects.order_by('-following_count').values_list(
+        'following_count', flat=True).first() or 0
+    call_command('rebuild_timelines')
+    print('timeline entries: {}'.format(TimelineEntry.objects.count()))
+
+    print('\n-- read: first page / page {} (median ms)'.format(args.depth))
+    print('{:>10} {:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'following', 'user', 'stored-1st', 'query-1st', 'stored-deep', 'query-deep'))
+    users = User.objects.filter(following_count__gt=0).order_by('following_count')
+    total = users.count()
+    for fraction in (0.5, 0.9, 0.99, 1.0):
+        user = users[min(total - 1, int(total * fraction))]
+        print('{:>10} {:>8} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}'.format(
+            user.following_count, user.id,
+            timed(lambda: read_page(user, False, 0), args.repeat),
+            timed(lambda: read_page(user, True, 0), args.repeat),
+            timed(lambda: read_page(user, False, args.depth), args.repeat),
+            timed(lambda: read_page(user, True, args.depth), args.repeat)))
+
+    print('\n-- write: fan-out of one new trip (median ms)')
+    print('{:>10} {:>8} {:>12}'.format('followers', 'user', 'fan-out'))
+    authors = User.objects.filter(follower_count__gt=0).order_by('follower_count')
+    total = authors.count()
+    for fraction in (0.5, 0.9, 0.99, 1.0):
+        author = authors[min(total - 1, int(total * fraction))]
+
+        def post():
+            with transaction.atomic():
+                trip = Trip.objects.create(title='ベンチマーク', prefecture='東京都', content='', user=author)
+                fan_out_trip(trip)
+                transaction.set_rollback(True)
+        print('{:>10} {:>8} {:>12.2f}'.format(author.follower_count, author.id, timed(post, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
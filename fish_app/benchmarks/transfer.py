@@ -0,0 +1,101 @@
+"""釣行の取り込み(import_trips)と書き出し(export_trips)の行/秒とメモリ使用量を測る。
+
+架空の釣行を書いたJSONL/CSVファイルを作って取り込み、同じデータを書き出す。使い捨てのデータベースで実行すること::
+
+    python -m benchmarks.transfer --trips 100000 --format jsonl
+    python -m benchmarks.transfer --trips 100000 --format csv
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import setup
+
+
+def write_file(path, format, trips, usernames, rng):
+    # 1釣行あたり0〜4件の釣果と0〜2件のコメント(コメントはJSONLのみ)
+    from benchmarks.seed import FISH_NAMES, PHRASES, PREFECTURES, SPOTS, random_datetime
+    from trips.transfer import CSV_COLUMNS
+
+    rows = 0
+    with open(path, 'w', encoding='utf-8', newline='') as output:
+        writer = csv.writer(output)
+        if format == 'csv':
+            writer.writerow(CSV_COLUMNS)
+        for i in range(trips):
+            created_at = random_datetime(rng)
+            record = {
+                'id': i, 'user': rng.choice(usernames), 'title': '{}で釣り{}'.format(rng.choice(SPOTS), i),
+                'prefecture': rng.choice(PREFECTURES), 'content': ''.join(rng.sample(PHRASES, 2)),
+                'created_at': created_at.isoformat(),
+                'results': [{'fish_name': rng.choice(FISH_NAMES), 'image': '', 'created_at': created_at.isoformat()}
+                            for _ in range(rng.randint(0, 4))],
+                'comments': [{'user': rng.choice(usernames), 'content': 'コメント', 'created_at': created_at.isoformat()}
+                             for _ in range(rng.randint(0, 2))] if format == 'jsonl' else [],
+            }
+            rows += 1 + len(record['results']) + len(record['comments'])
+            if format == 'jsonl':
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                continue
+            columns = [record[key] for key in ('id', 'user', 'title', 'prefecture', 'content', 'created_at')]
+            for result in record['results'] or [{'fish_name': '', 'image': '', 'created_at': ''}]:
+                writer.writerow(columns + [result['fish_name'], result['image'], result['created_at']])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trips', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup()
+    from django.contrib.auth import get_user_model
+    from benchmarks.seed import seed
+    from trips.transfer import export_lines, import_records, read_records
+
+    rng = random.Random(args.seed)
+    User = get_user_model()
+    if User.objects.count() < args.users:
+        seed(users=args.users - User.objects.count(), trips=0, follows_per_user=0, rooms=0)
+    usernames = list(User.objects.values_list('username', flat=True)[:args.users])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'trips.' + args.format)
+        rows = write_file(path, args.format, args.trips, usernames, rng)
+        print('file: {} rows / {:.1f}MiB'.format(rows, os.path.getsize(path) / 1024 / 1024))
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        with open(path, encoding='utf-8', newline='') as lines:
+            report = import_records(read_records(lines, args.format), args.batch_size)
+        elapsed = time.perf_counter() - started
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('import: {} trips / {} results / {} comments / {} errors'.format(
+            report.trips, report.results, report.comments, len(report.errors)))
+        print('import: {:.1f}s / {:.0f} rows/s / peak memory {:.1f}MiB'.format(
+            elapsed, report.rows / elapsed, peak / 1024 / 1024))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    lines = 0
+    for line in export_lines(args.format):
+        lines += 1
+    elapsed = time.perf_counter() - started
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('export: {} lines in {:.1f}s / {:.0f} lines/s / peak memory {:.1f}MiB'.format(
+        lines, elapsed, lines / elapsed, peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
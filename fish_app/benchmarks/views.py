@@ -0,0 +1,221 @@
+"""trips・accountsの各ビューにリクエストを送り、レイテンシ(p50/p95/p99)・クエリ数・ピークメモリを測る。
+
+結果はJSONで書き出し、次回以降は --compare でその結果と比べる。benchmarks.seed で投入したデータベースで実行する::
+
+    python -m benchmarks.seed --users 5000 --trips 100000
+    python -m benchmarks.views --output baseline.json
+    python -m benchmarks.views --compare baseline.json
+
+テスト用のクライアントでプロセス内から呼ぶので、uWSGI・nginxの分は含まない。
+データを書き換えるビューのうち、釣行・コメント・メッセージの投稿と削除、サインアップの送信、
+釣行の書き出し(スタッフ用)は測らない。フォローはすぐに解除するので件数は元に戻る。
+"""
+import argparse
+import datetime
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from benchmarks import setup
+
+# p95が基準よりこの割合を超えて遅くなったら、またはクエリ数が増えたら悪化とみなす
+REGRESSION_RATIO = 0.2
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def sample_targets(rng, size):
+    # 釣行・ユーザー・ルームをIDの範囲から無作為に選ぶ。ログインするユーザーはDMのルームに入っている人にする
+    from django.db.models import Max, Min
+
+    from accounts.models import Room
+    from benchmarks.seed import FISH_NAMES, PREFECTURES
+    from trips.models import Trip
+
+    bounds = Trip.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        raise SystemExit('釣行がありません。先に benchmarks.seed でデータを作ってください')
+    trips = []
+    for _ in range(size):
+        row = Trip.objects.filter(id__gte=rng.randint(bounds['low'], bounds['high'])).order_by('id').values(
+            'id', 'user_id').first()
+        if row:
+            trips.append(row)
+    room = Room.objects.prefetch_related('users').order_by('id').first()
+    if room is None:
+        raise SystemExit('DMのルームがありません。benchmarks.seed に --rooms を指定してください')
+    viewer = room.users.all()[0]
+    own_trip = Trip.objects.filter(user=viewer).values_list('id', flat=True).first()
+    return {
+        'trips': trips, 'viewer': viewer, 'room': room.id, 'own_trip': own_trip,
+        'fish_names': [rng.choice(FISH_NAMES) for _ in range(size)],
+        'prefectures': [rng.choice(PREFECTURES) for _ in range(size)],
+    }
+
+
+def scenarios(targets):
+    # (名前, ログインするか, i番目のリクエストを送る関数)。関数はテスト用のクライアントとiを受け取る
+    from django.urls import reverse
+
+    trips, fish_names, prefectures = targets['trips'], targets['fish_names'], targets['prefectures']
+
+    def pick(values, i):
+        return values[i % len(values)]
+
+    def follow(client, i):
+        # フォローしてすぐに解除し、データを元に戻す。時間とクエリ数は2リクエスト分になる
+        user_id = pick(trips, i)['user_id']
+        response = client.post(reverse('follow', args=[user_id]))
+        if response.status_code >= 400:
+            return response
+        return client.post(reverse('unfollow', args=[user_id]))
+
+    views = [
+        ('index', False, lambda client, i: client.get(reverse('index'), {'page': i % 10 + 1})),
+        ('trip_detail', False, lambda client, i: client.get(reverse('trip_detail', args=[pick(trips, i)['id']]))),
+        ('trip_detail_login', True, lambda client, i: client.get(reverse('trip_detail', args=[pick(trips, i)['id']]))),
+        ('user_trips', False, lambda client, i: client.get(reverse('user_trips', args=[pick(trips, i)['user_id']]))),
+        ('timeline', True, lambda client, i: client.get(reverse('timeline'))),
+        ('search_fish_name', False, lambda client, i: client.get(reverse('search'), {
+            'keyword_fish_name': pick(fish_names, i), 'keyword_prefecture': pick(prefectures, i)})),
+        ('search_keyword', False, lambda client, i: client.get(reverse('search'), {'keyword': '堤防 朝まずめ'})),
+        ('search_suggest', False, lambda client, i: client.get(reverse('search_suggest'), {
+            'q': pick(fish_names, i)[:1]})),
+        ('search_chart_svg', False, lambda client, i: client.get(reverse('search_chart_svg'), {
+            'fish': pick(fish_names, i)})),
+        ('stats_species', False, lambda client, i: client.get(reverse('stats_species'), {
+            'prefecture': pick(prefectures, i)})),
+        ('stats_seasonality', False, lambda client, i: client.get(reverse('stats_seasonality'), {
+            'fish': pick(fish_names, i)})),
+        ('stats_years', False, lambda client, i: client.get(reverse('stats_years'), {
+            'fish': pick(fish_names, i)})),
+        ('create_form', True, lambda client, i: client.get(reverse('create'))),
+        ('update_form', True, lambda client, i: client.get(reverse('update', args=[targets['own_trip']]))),
+        ('signup_form', False, lambda client, i: client.get(reverse('signup'))),
+        ('user_update_form', True, lambda client, i: client.get(reverse('user_update', args=[targets['viewer'].id]))),
+        ('follow_list', False, lambda client, i: client.get(reverse('follow_list', args=[pick(trips, i)['user_id']]))),
+        ('follow_unfollow', True, follow),
+        ('room_detail', True, lambda client, i: client.get(reverse('room_detail', args=[targets['room']]))),
+        ('message_list', True, lambda client, i: client.get(reverse('message_list', args=[targets['room']]))),
+    ]
+    # ログインするユーザーに釣行がなければ編集画面は測れない
+    return [view for view in views if view[0] != 'update_form' or targets['own_trip'] is not None]
+
+
+def measure(name, client, send, requests, memory_requests):
+    # 1周目で時間とクエリ数を、2周目でtracemallocを有効にしてピークメモリを測る(tracemallocは遅くなるため)
+    from django.db import connection
+    from monitoring.metrics import RequestTimer
+
+    send(client, 0)
+    timings = []
+    queries = 0
+    errors = 0
+    for i in range(requests):
+        timer = RequestTimer()
+        with connection.execute_wrapper(timer):
+            started = time.perf_counter()
+            response = send(client, i)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries += timer.queries
+        if response.status_code >= 400:
+            errors += 1
+    tracemalloc.start()
+    for i in range(memory_requests):
+        send(client, i)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'requests': requests,
+        'p50_ms': percentile(timings, 50), 'p95_ms': percentile(timings, 95), 'p99_ms': percentile(timings, 99),
+        'queries': queries / requests, 'peak_kib': peak / 1024, 'errors': errors,
+    }
+
+
+def row_counts():
+    from django.contrib.auth import get_user_model
+
+    from accounts.models import Connection, Message, Room
+    from trips.models import Comment, Result, Trip
+
+    return {model.__name__: model.objects.count()
+            for model in (get_user_model(), Trip, Result, Comment, Connection, Room, Message)}
+
+
+def compare(report, baseline):
+    # 基準と比べた表を出し、悪化したビューの名前を返す
+    regressions = []
+    print('{:<20} {:>10} {:>10} {:>8} {:>10} {:>10}'.format(
+        'view', 'p95(ms)', 'base', 'change', 'queries', 'base'))
+    for name, stats in report['views'].items():
+        base = baseline['views'].get(name)
+        if base is None:
+            print('{:<20} {:>10.1f} {:>10} {:>8} {:>10.1f} {:>10}'.format(
+                name, stats['p95_ms'], '-', '-', stats['queries'], '-'))
+            continue
+        change = stats['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] else 0.0
+        worse = change > REGRESSION_RATIO or stats['queries'] > base['queries']
+        if worse:
+            regressions.append(name)
+        print('{:<20} {:>10.1f} {:>10.1f} {:>+7.0%} {:>10.1f} {:>10.1f}{}'.format(
+            name, stats['p95_ms'], base['p95_ms'], change, stats['queries'], base['queries'],
+            '  <- 悪化' if worse else ''))
+    if report['rows'] != baseline.get('rows'):
+        print('注意: データの件数が基準と異なります {} / 基準 {}'.format(report['rows'], baseline.get('rows')))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='ビューごとのリクエスト数')
+    parser.add_argument('--memory-requests', type=int, default=20, help='ピークメモリを測るリクエスト数')
+    parser.add_argument('--only', nargs='*', help='測るビューの名前')
+    parser.add_argument('--output', help='結果のJSONを書き出すファイル')
+    parser.add_argument('--compare', help='比べる基準のJSONファイル')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client
+
+    rng = random.Random(args.seed)
+    targets = sample_targets(rng, 100)
+    host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+    anonymous = Client(HTTP_HOST=host)
+    logged_in = Client(HTTP_HOST=host)
+    logged_in.force_login(targets['viewer'])
+
+    report = {
+        'created_at': datetime.datetime.now().isoformat(), 'database': connection.vendor,
+        'rows': row_counts(), 'views': {},
+    }
+    for name, login, send in scenarios(targets):
+        if args.only and name not in args.only:
+            continue
+        stats = measure(name, logged_in if login else anonymous, send, args.requests, args.memory_requests)
+        report['views'][name] = stats
+        print('{:<20} p50 {p50_ms:7.1f}ms  p95 {p95_ms:7.1f}ms  p99 {p99_ms:7.1f}ms  '
+              'queries {queries:5.1f}  peak {peak_kib:8.0f}KiB  errors {errors}'.format(name, **stats), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(report, baseline)
+        if regressions:
+            print('悪化したビュー: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
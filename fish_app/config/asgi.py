@@ -8,9 +8,46 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
 
 import os
+import re
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from accounts.chat import room_consumer  # noqa: E402 (django.setup()の後に読み込む)
+
+websocket_routes = [
+    (re.compile(r'^/ws/rooms/(?P<pk>\d+)/$'), room_consumer),
+]
+
+
+async def websocket_application(scope, receive, send):
+    for pattern, consumer in websocket_routes:
+        match = pattern.match(scope['path'])
+        if match:
+            scope = dict(scope, url_route={'args': (), 'kwargs': match.groupdict()})
+            return await consumer(scope, receive, send)
+    await receive()
+    await send({'type': 'websocket.close'})
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    # HTTPはこれまで通りDjangoに渡し、WebSocketだけここで振り分ける
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
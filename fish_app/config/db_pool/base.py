@@ -0,0 +1,52 @@
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from .pool import PoolExhausted, get_pool
+
+# DATABASESのPOOLを省略したときの値
+POOL_DEFAULTS = {'MAX_SIZE': 4, 'IDLE_TIMEOUT': 300, 'TIMEOUT': 10}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # リクエストの終わりに接続を閉じる代わりにプールへ返し、次のリクエストでヘルスチェックしてから使う
+    # CONN_MAX_AGEは0のままにする(リクエストごとにプールへ返す)
+
+    @property
+    def pool(self):
+        options = dict(POOL_DEFAULTS, **self.settings_dict.get('POOL', {}))
+        return get_pool(self.alias, options['MAX_SIZE'], options['IDLE_TIMEOUT'], options['TIMEOUT'])
+
+    def get_new_connection(self, conn_params):
+        try:
+            connection = self.pool.checkout(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+                                            self.is_healthy)
+        except PoolExhausted as e:
+            raise base.Database.OperationalError(str(e)) from e
+        # 作り直さなかった接続でも、親クラスが接続時に決めるisolation_levelをそろえる
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        return connection
+
+    def is_healthy(self, connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except base.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        if self.connection is None:
+            return
+        connection = self.connection
+        # 途中のトランザクションは取り消してから返す。取り消せなければ接続ごと捨てる
+        reusable = not connection.closed
+        if reusable and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except base.Database.Error:
+                reusable = False
+        self.pool.release(connection, reusable)
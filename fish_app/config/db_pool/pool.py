@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    # ワーカープロセスの中で使い回すDB接続。max_size本まで作り、空きがなければtimeout秒まで返却を待つ
+    # idle_timeout秒より長く使われなかった接続は閉じる
+
+    def __init__(self, max_size=4, idle_timeout=300, timeout=10):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.condition = threading.Condition()
+        # (接続, 返却された時刻)。最後に返された接続から使うので、古い接続ほど先頭に残って閉じられる
+        self.idle = []
+        self.size = 0
+        self.stats = {'checkouts': 0, 'created': 0, 'waits': 0, 'wait_ms': 0.0, 'max_wait_ms': 0.0,
+                      'exhausted': 0, 'unhealthy': 0, 'expired': 0}
+
+    def checkout(self, connect, check):
+        # 空いている接続をcheckで確かめてから返す。使えなければ閉じて作り直す
+        started = time.monotonic()
+        waited = False
+        with self.condition:
+            while True:
+                expired = self.take_expired()
+                if self.idle:
+                    connection, returned_at = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    connection = None
+                    break
+                waited = True
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.stats['exhausted'] += 1
+                    raise PoolExhausted('DB接続のプールが{}秒待っても空きませんでした(最大{}本)'.format(
+                        self.timeout, self.max_size))
+                self.condition.wait(remaining)
+            wait_ms = (time.monotonic() - started) * 1000
+            self.stats['checkouts'] += 1
+            if waited:
+                self.stats['waits'] += 1
+                self.stats['wait_ms'] += wait_ms
+                self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+        # 接続・切断・ヘルスチェックはネットワークを待つので、ロックの外で行う
+        for old in expired:
+            close_quietly(old)
+        if connection is not None and not check(connection):
+            close_quietly(connection)
+            connection = None
+            with self.condition:
+                self.stats['unhealthy'] += 1
+        if connection is None:
+            try:
+                connection = connect()
+            except Exception:
+                self.forget()
+                raise
+            with self.condition:
+                self.stats['created'] += 1
+        return connection
+
+    def release(self, connection, reusable=True):
+        if os.getpid() != self.pid:
+            # fork前の接続はソケットを親と共有しているので、閉じずに手放す
+            return
+        if reusable:
+            with self.condition:
+                self.idle.append((connection, time.monotonic()))
+                self.condition.notify()
+            return
+        close_quietly(connection)
+        self.forget()
+
+    def forget(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def take_expired(self):
+        # ロックを持った状態で呼ぶ。閉じるのは呼び出し側でロックの外で行う
+        now = time.monotonic()
+        expired = []
+        while self.idle and now - self.idle[0][1] > self.idle_timeout:
+            expired.append(self.idle.pop(0)[0])
+        self.size -= len(expired)
+        self.stats['expired'] += len(expired)
+        return expired
+
+    def close_all(self):
+        with self.condition:
+            connections = [connection for connection, returned_at in self.idle]
+            self.size -= len(connections)
+            self.idle = []
+            self.condition.notify_all()
+        for connection in connections:
+            close_quietly(connection)
+
+    def snapshot(self):
+        with self.condition:
+            return dict(self.stats, size=self.size, idle=len(self.idle), max_size=self.max_size)
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(alias, max_size, idle_timeout, timeout):
+    # DBの別名ごとに1つ。uWSGIがforkした後のワーカーでは親の接続を引き継がずに作り直す
+    with _lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[alias] = ConnectionPool(max_size, idle_timeout, timeout)
+        return pool
+
+
+def pool_stats():
+    with _lock:
+        pools = [(alias, pool) for alias, pool in _pools.items() if pool.pid == os.getpid()]
+    return {alias: pool.snapshot() for alias, pool in pools}
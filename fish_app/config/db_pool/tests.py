@@ -0,0 +1,61 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from .pool import ConnectionPool, PoolExhausted
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(SimpleTestCase):
+
+    def checkout(self, pool):
+        return pool.checkout(FakeConnection, lambda connection: not connection.closed)
+
+    def test_reuse_and_health_check(self):
+        # 返した接続を使い回し、ヘルスチェックに通らなければ作り直す
+        pool = ConnectionPool(max_size=2)
+        first = self.checkout(pool)
+        pool.release(first)
+        self.assertIs(self.checkout(pool), first)
+        pool.release(first)
+        first.closed = True
+        second = self.checkout(pool)
+        self.assertIsNot(second, first)
+        stats = pool.snapshot()
+        self.assertEqual((stats['created'], stats['unhealthy'], stats['size']), (2, 1, 1))
+        # 使えない接続として返すと閉じて枠を空ける
+        pool.release(second, reusable=False)
+        self.assertTrue(second.closed)
+        self.assertEqual(pool.snapshot()['size'], 0)
+
+    def test_exhausted(self):
+        # 最大数まで使われていれば返却を待ち、timeout秒を過ぎたら諦める
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        connection = self.checkout(pool)
+        with self.assertRaises(PoolExhausted):
+            self.checkout(pool)
+        threading.Timer(0.01, pool.release, [connection]).start()
+        pool.timeout = 5
+        self.assertIs(self.checkout(pool), connection)
+        stats = pool.snapshot()
+        self.assertEqual((stats['exhausted'], stats['waits']), (1, 1))
+        self.assertGreater(stats['max_wait_ms'], 0)
+
+    def test_idle_timeout(self):
+        # idle_timeout秒より長く使われなかった接続は閉じる
+        pool = ConnectionPool(max_size=2, idle_timeout=0.01)
+        connection = self.checkout(pool)
+        pool.release(connection)
+        time.sleep(0.02)
+        self.assertIsNot(self.checkout(pool), connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.snapshot()['expired'], 1)
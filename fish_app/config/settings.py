@@ -28,12 +28,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'bootstrap4',
-    'accounts',
-    'trips',
+    'accounts.apps.AccountsConfig',
+    'trips.apps.TripsConfig',
+    'monitoring',
+    'jobs.apps.JobsConfig',
 ]
 
 MIDDLEWARE = [
+    'monitoring.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -47,7 +51,7 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'monitoring.templates.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, "templates")],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -64,6 +68,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+ASGI_APPLICATION = 'config.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
@@ -76,9 +82,32 @@ DATABASES = {
         'PASSWORD': os.environ['POSTGRES_PASSWORD'],
         'HOST': os.environ['POSTGRES_HOST'],
         'PORT': os.environ['POSTGRES_PORT'],
+        # 0より大きければリクエストをまたいで接続を持ち続ける(DB_POOLを使うときは0のまま)
+        'CONN_MAX_AGE': env.int('CONN_MAX_AGE', default=0),
     }
 }
 
+# DB_POOL=Trueなら接続をワーカープロセスごとのプールで使い回す(config/db_pool)
+# 取り出すたびにSELECT 1で確かめ、IDLE_TIMEOUT秒使われなかった接続は閉じる。使用状況は/monitoring/metrics/で見られる
+if env.bool('DB_POOL', default=False):
+    DATABASES['default']['ENGINE'] = 'config.db_pool'
+    DATABASES['default']['POOL'] = {
+        'MAX_SIZE': env.int('DB_POOL_MAX_SIZE', default=4),
+        'IDLE_TIMEOUT': env.int('DB_POOL_IDLE_TIMEOUT', default=300),
+        'TIMEOUT': env.float('DB_POOL_TIMEOUT', default=10),
+    }
+
+
+# キャッシュのキーには釣行の更新日時(Trip.updated_at)を含めるので、プロセスごとのメモリでも古い内容は返らない
+# uWSGIのプロセス間で共有したい場合は CACHE_URL=filecache:///app/tmp/cache のようにする
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# 未ログインのユーザーに返す投稿詳細ページをキャッシュする秒数
+TRIP_CACHE_TIMEOUT = 60 * 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -128,6 +157,71 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# MEDIA_ROOT/private/以下はログインユーザーにだけnginxのinternalなlocation経由で返す
+MEDIA_ACCEL_REDIRECT_URL = '/protected-media/'
+
+
+# ビューごとの計測(monitoring)
+# METRICS_SAMPLE_RATEの割合のリクエストだけを計測する
+
+METRICS_SAMPLE_RATE = env.float('METRICS_SAMPLE_RATE', default=1.0)
+
+METRICS_WINDOW = 60 * 60
+
+METRICS_FLUSH_INTERVAL = 60
+
+# ワーカーごとの集計の書き出し先。終了したワーカーのファイルは読み込むときに消す。テスト中は書き出さない(config.test_runner)
+METRICS_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'tmp', 'metrics')
+
+TEST_RUNNER = 'config.test_runner.TestRunner'
+
+
+# ジョブキュー(jobs)
+# JOBS_EAGERがTrueのときはワーカーを使わずenqueueした場所で実行する
+
+JOBS_EAGER = env.bool('JOBS_EAGER', default=False)
+
+JOBS_POLL_INTERVAL = 2
+
+JOBS_RETRY_DELAY = 30
+
+JOBS_LOCK_TIMEOUT = 60 * 10
+
+JOBS_KEEP_DAYS = 7
+
+
+# フォロー中のユーザーの釣行のタイムライン(trips.timeline)
+# フォロー数がTIMELINE_READ_THRESHOLDを超えるユーザーは書き込まずに表示のたびに引く
+
+TIMELINE_LENGTH = 500
+
+TIMELINE_TRIM_SLACK = 50
+
+TIMELINE_READ_THRESHOLD = 1000
+
+
+# 魚名の補完候補(trips.suggest)
+# 各プロセスのメモリに持つ索引は同じプロセスの保存で更新し、他のプロセスの分はこの秒数ごとに読み直して取り込む
+
+FISH_INDEX_TTL = 60
+
+
+# 一覧ページのページ番号(trips.paginator.WindowedPaginator)
+# 総件数はこの秒数だけキャッシュする。PostgreSQLで絞り込みのない表がPAGINATOR_ESTIMATE_THRESHOLD行を超えたら統計情報の推定値を使う
+
+PAGINATOR_COUNT_TIMEOUT = 60 * 5
+
+PAGINATOR_ESTIMATE_THRESHOLD = 100000
+
+
+# DMのWebSocket(config/asgi.py)
+# postgresならLISTEN/NOTIFYでuWSGIのプロセスで保存されたメッセージも配る。memoryは同じプロセス内だけ
+
+CHAT_BROKER = env('CHAT_BROKER', default='postgres')
+
+# 1接続あたりの未送信メッセージの上限
+CHAT_QUEUE_SIZE = 100
+
 
 if DEBUG:
     def show_toolbar(request):
@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    # テスト中のリクエストの計測値をtmp/metricsに書き出さない
+    # 書き出しを確かめるテストはoverride_settingsで一時ディレクトリを指定する
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.METRICS_SNAPSHOT_DIR = ''
@@ -3,20 +3,22 @@ from django.contrib import admin
 from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
-from django.conf import settings
+from trips.views import private_media
 
 urlpatterns = [
+    path('media/private/<path:path>', private_media, name='private_media'),
     path('admin/', admin.site.urls),
     path('accounts/',include('django.contrib.auth.urls')),
     path('accounts/',include('accounts.urls')),
     path('trips/',include('trips.urls')),
+    path('monitoring/',include('monitoring.urls')),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
+# 本番ではnginxが/media/を直接配信する。Djangoで配信するのは開発時のみ
 if settings.DEBUG:
     import debug_toolbar
 
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += [
         path('__debug__/', include(debug_toolbar.urls)),
     ]
\ No newline at end of file
@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_after', 'finished_at')
+    list_filter = ('status', 'name')
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs.queue import purge_finished, requeue_stale, run_pending
+
+
+class Command(BaseCommand):
+    help = 'jobテーブルのジョブをポーリングして実行する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='待機中のジョブを実行したら終了する')
+        parser.add_argument('--batch-size', type=int, default=10, help='一度に取得するジョブ数')
+
+    def handle(self, *args, **options):
+        last_purge = 0
+        while True:
+            requeue_stale()
+            count = run_pending(options['batch_size'])
+            if count:
+                self.stdout.write('{}件のジョブを実行しました'.format(count))
+            if options['once']:
+                return
+            # 完了したジョブは1時間ごとにまとめて削除する
+            if time.time() - last_purge > 60 * 60:
+                purge_finished(settings.JOBS_KEEP_DAYS)
+                last_purge = time.time()
+            time.sleep(settings.JOBS_POLL_INTERVAL)
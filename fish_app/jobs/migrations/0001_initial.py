@@ -0,0 +1,39 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:37
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='ジョブ名')),
+                ('payload', models.TextField(default='{}', verbose_name='引数(JSON)')),
+                ('status', models.CharField(choices=[('queued', '待機中'), ('running', '実行中'), ('done', '完了'), ('failed', '失敗')], default='queued', max_length=10, verbose_name='状態')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='実行回数')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3, verbose_name='最大実行回数')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='実行予定日時')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='実行開始日時')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='終了日時')),
+                ('last_error', models.TextField(blank=True, verbose_name='エラー内容')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+            ],
+            options={
+                'verbose_name': 'ジョブ',
+                'db_table': 'job',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ),
+    ]
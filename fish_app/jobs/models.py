@@ -0,0 +1,36 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, '待機中'),
+        (RUNNING, '実行中'),
+        (DONE, '完了'),
+        (FAILED, '失敗'),
+    )
+
+    class Meta:
+        db_table = 'job'
+        verbose_name = 'ジョブ'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return '<' 'job_id=' + str(self.id) + ' name=' + self.name + ' status=' + self.status + '>'
+
+    name = models.CharField(max_length=100, verbose_name='ジョブ名')
+    payload = models.TextField(default='{}', verbose_name='引数(JSON)')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, verbose_name='状態')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='実行回数')
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name='最大実行回数')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='実行予定日時')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='実行開始日時')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='終了日時')
+    last_error = models.TextField(blank=True, verbose_name='エラー内容')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='作成日時')
@@ -0,0 +1,92 @@
+import datetime
+import json
+import logging
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+handlers = {}
+
+
+def register(name):
+    # @register('app.job_name') を付けた関数をジョブとして登録する
+    def decorator(func):
+        handlers[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, **payload):
+    if name not in handlers:
+        raise KeyError('unknown job: {}'.format(name))
+    if settings.JOBS_EAGER:
+        # ワーカーを起動しない環境(テストなど)ではその場で実行する
+        handlers[name](**payload)
+        return None
+    return Job.objects.create(name=name, payload=json.dumps(payload))
+
+
+def claim(batch_size=10):
+    # SKIP LOCKEDで他のワーカーが取得中の行を飛ばし、同じジョブを二重に実行しない
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED, run_after__lte=now)
+            .order_by('run_after', 'id')[:batch_size]
+        )
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=Job.RUNNING, locked_at=now, attempts=F('attempts') + 1)
+    for job in jobs:
+        job.status = Job.RUNNING
+        job.locked_at = now
+        job.attempts += 1
+    return jobs
+
+
+def run_job(job):
+    try:
+        handlers[job.name](**json.loads(job.payload))
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('job %s failed (attempt %s/%s)', job.pk, job.attempts, job.max_attempts)
+        if job.attempts < job.max_attempts:
+            # 失敗したら間隔を広げながら再実行する
+            delay = datetime.timedelta(seconds=settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1))
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, run_after=timezone.now() + delay, locked_at=None, last_error=error)
+        else:
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, finished_at=timezone.now(), last_error=error)
+        return False
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, finished_at=timezone.now())
+    return True
+
+
+def requeue_stale():
+    # 実行中のままJOBS_LOCK_TIMEOUT秒を過ぎたジョブは、ワーカーが落ちたとみなして戻す
+    deadline = timezone.now() - datetime.timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=deadline).update(status=Job.QUEUED, locked_at=None)
+
+
+def run_pending(batch_size=10):
+    # 待機中のジョブがなくなるまで実行し、実行した件数を返す
+    count = 0
+    while True:
+        jobs = claim(batch_size)
+        if not jobs:
+            return count
+        for job in jobs:
+            run_job(job)
+            count += 1
+
+
+def purge_finished(days):
+    deadline = timezone.now() - datetime.timedelta(days=days)
+    return Job.objects.filter(status=Job.DONE, finished_at__lt=deadline).delete()[0]
@@ -0,0 +1,74 @@
+import datetime
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import claim, enqueue, register, requeue_stale, run_pending
+
+calls = []
+
+
+@register('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@register('tests.fail')
+def fail():
+    raise ValueError('失敗')
+
+
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        # enqueueしたジョブはワーカーが実行するまで実行されない
+        job = enqueue('tests.record', value=1)
+        enqueue('tests.record', value=2)
+        self.assertEqual(calls, [])
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(run_pending(), 2)
+        self.assertEqual(calls, [1, 2])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(run_pending(), 0)
+
+    def test_unknown_job(self):
+        with self.assertRaises(KeyError):
+            enqueue('tests.unknown')
+
+    def test_retry_and_fail(self):
+        # 失敗したジョブは間隔をあけて再実行され、最大回数を超えると失敗になる
+        job = enqueue('tests.fail')
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('ValueError', job.last_error)
+        for attempt in range(2):
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 3)
+
+    def test_claim_marks_running_and_requeue_stale(self):
+        job = enqueue('tests.record', value=1)
+        self.assertEqual([claimed.pk for claimed in claim()], [job.pk])
+        # 取得済みのジョブは再度取得されない
+        self.assertEqual(claim(), [])
+        # ワーカーが落ちて実行中のまま残ったジョブは戻される
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, [1])
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager(self):
+        self.assertIsNone(enqueue('tests.record', value=1))
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
@@ -0,0 +1,22 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from monitoring.metrics import load_snapshots, merge_snapshots, summarize
+
+
+class Command(BaseCommand):
+    help = '各ワーカーが書き出したビューごとの計測値をまとめて表示する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='JSONで出力する')
+
+    def handle(self, *args, **options):
+        rows = summarize(merge_snapshots(load_snapshots()))
+        if options['json']:
+            self.stdout.write(json.dumps(rows, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write('{:<28} {:>8} {:>8} {:>9} {:>9} {:>9} {:>10}'.format(
+            'view', 'count', 'queries', 'db_ms', 'tpl_ms', 'total_ms', 'bytes'))
+        for row in rows:
+            self.stdout.write('{view:<28} {count:>8} {queries:>8.1f} {db_ms:>9.1f} {template_ms:>9.1f} {total_ms:>9.1f} {bytes:>10.0f}'.format(**row))
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+# レイテンシのヒストグラムの上限値(ms)。最後のバケットはそれ以上
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_local = threading.local()
+
+
+class RequestTimer:
+    # 1リクエスト分のSQL・テンプレートの計測値
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapperとして使う
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_ms += (time.perf_counter() - started) * 1000
+
+    def __enter__(self):
+        _local.timer = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.timer = None
+
+
+def record_template_time(ms):
+    timer = getattr(_local, 'timer', None)
+    if timer is not None:
+        timer.template_ms += ms
+
+
+def empty_stats():
+    return {'count': 0, 'queries': 0, 'db_ms': 0.0, 'template_ms': 0.0, 'total_ms': 0.0,
+            'bytes': 0, 'buckets': [0] * (len(BUCKETS_MS) + 1)}
+
+
+def merge_stats(into, stats):
+    for key in ('count', 'queries', 'db_ms', 'template_ms', 'total_ms', 'bytes'):
+        into[key] += stats[key]
+    into['buckets'] = [a + b for a, b in zip(into['buckets'], stats['buckets'])]
+    return into
+
+
+def merge_snapshots(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, stats in snapshot.items():
+            merge_stats(merged.setdefault(name, empty_stats()), stats)
+    return merged
+
+
+class Registry:
+    # URL名ごとの集計。METRICS_WINDOW秒ごとに窓をずらし、直近の窓と1つ前の窓だけを保持する
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = {}
+        self.previous = {}
+        self.window_started = time.time()
+        self.last_flush = 0.0
+
+    def record(self, name, timer, total_ms, size):
+        bucket = next((i for i, limit in enumerate(BUCKETS_MS) if total_ms <= limit), len(BUCKETS_MS))
+        with self.lock:
+            self.rotate()
+            stats = self.current.setdefault(name, empty_stats())
+            stats['count'] += 1
+            stats['queries'] += timer.queries
+            stats['db_ms'] += timer.db_ms
+            stats['template_ms'] += timer.template_ms
+            stats['total_ms'] += total_ms
+            stats['bytes'] += size
+            stats['buckets'][bucket] += 1
+        self.maybe_flush()
+
+    def rotate(self):
+        now = time.time()
+        if now - self.window_started >= settings.METRICS_WINDOW:
+            self.previous = self.current
+            self.current = {}
+            self.window_started = now
+
+    def snapshot(self):
+        with self.lock:
+            self.rotate()
+            return merge_snapshots([self.previous, self.current])
+
+    def reset(self):
+        with self.lock:
+            self.current = {}
+            self.previous = {}
+            self.window_started = time.time()
+
+    def maybe_flush(self):
+        # 別プロセスの管理コマンドから読めるように、プロセスごとのファイルへ書き出す
+        now = time.time()
+        if not settings.METRICS_SNAPSHOT_DIR:
+            return
+        with self.lock:
+            if now - self.last_flush < settings.METRICS_FLUSH_INTERVAL:
+                return
+            self.last_flush = now
+        os.makedirs(settings.METRICS_SNAPSHOT_DIR, exist_ok=True)
+        path = snapshot_path(os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'updated_at': now, 'views': self.snapshot()}, f)
+        os.replace(path + '.tmp', path)
+
+
+def snapshot_path(pid):
+    return os.path.join(settings.METRICS_SNAPSHOT_DIR, 'metrics-{}.json'.format(pid))
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # 別のユーザーで動いているプロセス
+        return True
+    return True
+
+
+def load_snapshots(exclude_pid=None):
+    # 終了したワーカーのファイルと、2窓分より長く更新されていないファイルは消す
+    # exclude_pidには、メモリ上の集計を別に足すプロセス(自分自身)を指定する
+    directory = settings.METRICS_SNAPSHOT_DIR
+    if not directory or not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for filename in sorted(os.listdir(directory)):
+        if not (filename.startswith('metrics-') and filename.endswith('.json')):
+            continue
+        try:
+            pid = int(filename[len('metrics-'):-len('.json')])
+        except ValueError:
+            continue
+        if pid == exclude_pid:
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            stale = time.time() - os.path.getmtime(path) > settings.METRICS_WINDOW * 2
+            if stale or not process_alive(pid):
+                os.remove(path)
+                continue
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            # 他のプロセスが先に消した
+            continue
+        snapshots.append(data['views'])
+    return snapshots
+
+
+def summarize(snapshot):
+    rows = []
+    for name, stats in sorted(snapshot.items()):
+        count = stats['count'] or 1
+        rows.append({
+            'view': name,
+            'count': stats['count'],
+            'queries': stats['queries'] / count,
+            'db_ms': stats['db_ms'] / count,
+            'template_ms': stats['template_ms'] / count,
+            'total_ms': stats['total_ms'] / count,
+            'bytes': stats['bytes'] / count,
+            'buckets': dict(zip([str(limit) for limit in BUCKETS_MS] + ['inf'], stats['buckets'])),
+        })
+    return rows
+
+
+registry = Registry()
@@ -0,0 +1,35 @@
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import RequestTimer, registry
+
+
+class MetricsMiddleware:
+    # ビューごとのSQL件数・DB時間・テンプレート描画時間・レスポンスサイズを記録する
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            timer = stack.enter_context(RequestTimer())
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        match = request.resolver_match
+        name = match.view_name if match else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        registry.record(name, timer, total_ms, size)
+        response['Server-Timing'] = 'db;dur={:.1f};desc="{} queries", tpl;dur={:.1f}, total;dur={:.1f}'.format(
+            timer.db_ms, timer.queries, timer.template_ms, total_ms)
+        return response
@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from trips.models import Trip
+from .metrics import load_snapshots, registry
+
+
+class MetricsMiddlewareTest(TestCase):
+
+    def setUp(self):
+        registry.reset()
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username='testuser',
+            email='test@email.com',
+            password='testpass123',
+        )
+        Trip.objects.create(title='testtitle', prefecture='北海道', content='投稿本文', user=self.user)
+
+    def test_server_timing_and_registry(self):
+        # Server-Timingヘッダーが付き、URL名ごとにクエリ数・描画時間・サイズが記録される
+        response = self.client.get(reverse('index'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('2 queries', response['Server-Timing'])
+        self.client.get(reverse('index'))
+        stats = registry.snapshot()['index']
+        self.assertEqual(stats['count'], 2)
+        # 2回目は一覧の総件数がキャッシュされているので1クエリ
+        self.assertEqual(stats['queries'], 3)
+        self.assertGreater(stats['template_ms'], 0)
+        self.assertEqual(stats['bytes'], len(response.content) * 2)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_sampling(self):
+        # サンプリング率0では計測しない
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(registry.snapshot(), {})
+
+    def test_metrics_endpoint_for_staff_only(self):
+        self.client.get(reverse('index'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.login(email='test@email.com', password='testpass123')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('index', [row['view'] for row in response.json()['views']])
+
+    def test_metrics_endpoint_scope_all(self):
+        # 他のワーカーのファイルは足し、このプロセスのファイルはメモリ上の集計と重ねて数えない
+        self.user.is_staff = True
+        self.user.save()
+        self.client.login(email='test@email.com', password='testpass123')
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_SNAPSHOT_DIR=directory, METRICS_FLUSH_INTERVAL=0):
+                self.client.get(reverse('index'))
+                other = dict(registry.snapshot(), other_view=registry.snapshot()['index'])
+                with open(os.path.join(directory, 'metrics-{}.json'.format(os.getppid())), 'w') as f:
+                    json.dump({'updated_at': time.time(), 'views': other}, f)
+                response = self.client.get(reverse('metrics'), {'scope': 'all'})
+        rows = {row['view']: row for row in response.json()['views']}
+        self.assertEqual(rows['index']['count'], 2)
+        self.assertEqual(rows['other_view']['count'], 1)
+
+    def test_load_snapshots_prunes_dead_workers(self):
+        # 終了したワーカーのファイルと古いファイルは消し、動いているワーカーの分だけ読む
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_SNAPSHOT_DIR=directory):
+            dead = subprocess.Popen([sys.executable, '-c', ''])
+            dead.wait()
+            for pid in (os.getpid(), os.getppid(), dead.pid):
+                with open(os.path.join(directory, 'metrics-{}.json'.format(pid)), 'w') as f:
+                    json.dump({'updated_at': time.time(), 'views': {}}, f)
+            old = os.path.join(directory, 'metrics-{}.json'.format(os.getppid()))
+            os.utime(old, (time.time() - 60 * 60 * 3, time.time() - 60 * 60 * 3))
+            self.assertEqual(len(load_snapshots()), 1)
+            self.assertEqual(os.listdir(directory), ['metrics-{}.json'.format(os.getpid())])
+
+    def test_dump_metrics_command(self):
+        # ワーカーが書き出した集計を管理コマンドで表示できる
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_SNAPSHOT_DIR=directory, METRICS_FLUSH_INTERVAL=0):
+                self.client.get(reverse('index'))
+                out = StringIO()
+                call_command('dump_metrics', '--json', stdout=out)
+        rows = json.loads(out.getvalue())
+        self.assertEqual(rows[0]['view'], 'index')
+        self.assertEqual(rows[0]['queries'], 2)
@@ -0,0 +1,19 @@
+import os
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from config.db_pool.pool import pool_stats
+
+from .metrics import load_snapshots, merge_snapshots, registry, summarize
+
+
+@staff_member_required
+def metrics(request):
+    # このプロセスの集計と、他のワーカーが書き出した集計をまとめて返す
+    snapshots = [registry.snapshot()]
+    if request.GET.get('scope') == 'all':
+        # このプロセスが書き出したファイルはメモリ上の集計と同じなので読まない
+        snapshots += load_snapshots(exclude_pid=os.getpid())
+    # DB接続のプール(config/db_pool)の待ち時間・枯渇回数はこのプロセスの分だけ
+    return JsonResponse({'pid': os.getpid(), 'views': summarize(merge_snapshots(snapshots)), 'db_pools': pool_stats()})
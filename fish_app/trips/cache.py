@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Trip
+
+
+def touch_trip(trip_id):
+    # 更新日時を進めて、この釣行のキャッシュ(詳細ページ・一覧のカード)を使われないようにする
+    Trip.objects.filter(pk=trip_id).update(updated_at=timezone.now())
+
+
+def touch_user_trips(user_id):
+    # 詳細ページには投稿者とコメントしたユーザーの名前が出るので、名前が変わったらその釣行をまとめて進める
+    trip_ids = Trip.objects.filter(Q(user_id=user_id) | Q(comment__user_id=user_id)).values('pk')
+    Trip.objects.filter(pk__in=trip_ids).update(updated_at=timezone.now())
+
+
+def trip_version(trip_id):
+    return Trip.objects.filter(pk=trip_id).values_list('updated_at', flat=True).first()
+
+
+def detail_key(trip_id, version):
+    return 'trip-detail:{}:{}'.format(trip_id, version.isoformat())
+
+
+def get_detail(trip_id, version):
+    return cache.get(detail_key(trip_id, version))
+
+
+def set_detail(trip_id, version, content):
+    cache.set(detail_key(trip_id, version), content, settings.TRIP_CACHE_TIMEOUT)
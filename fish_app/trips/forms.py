@@ -1,8 +1,27 @@
 from django import forms
-from .models import  Comment, Trip
+from .models import  Comment, Result, Trip
 from django.core.validators import RegexValidator
+from .normalize import normalize_fish_name, normalize_width
 from .prefectures import choice_prefectures
 
+
+class FishNameField(forms.CharField):
+    # 半角カナやひらがなで入力されてもカタカナにそろえてから検証する
+    default_validators = [RegexValidator(r'^([ァ-ン]|ー)+$','全角カナで入力してください')]
+
+    def to_python(self, value):
+        return normalize_fish_name(super().to_python(value))
+
+
+class ResultForm(forms.ModelForm):
+    fish_name = FishNameField(label='魚名', max_length=20,
+                widget=forms.TextInput(attrs={'placeholder':'全角カナ'}))
+
+    class Meta:
+        model = Result
+        fields = ('fish_name','image')
+        widgets = {'image':forms.FileInput(attrs={'class':'form-control-file'})}
+
 class TripForm(forms.ModelForm):
     prefecture = forms.ChoiceField(label='場所',choices=choice_prefectures)
     class Meta:
@@ -12,12 +31,31 @@ class TripForm(forms.ModelForm):
 
 
 class TripFindForm(forms.Form):
-    keyword_fish_name = forms.CharField(label='魚名',required=True,
-                validators=[RegexValidator(r'^([ァ-ン]|ー)+$','全角カナで入力してください')],
-                widget=forms.TextInput(attrs={'placeholder':'全角カナ','class':'form-control mr-3'}))
+    keyword_fish_name = FishNameField(label='魚名',required=False,
+                widget=forms.TextInput(attrs={'placeholder':'カナ・ひらがな','class':'form-control mr-3',
+                                              'list':'fish-name-suggestions','autocomplete':'off'}))
+    keyword = forms.CharField(label='キーワード',required=False,max_length=100,
+                widget=forms.TextInput(attrs={'placeholder':'タイトル・内容','class':'form-control mr-3'}))
     keyword_prefecture = forms.ChoiceField(label='場所',choices=choice_prefectures,required=False,
                 widget=forms.Select(attrs={'class':'form-control mr-3'}))
 
+    def clean_keyword(self):
+        return normalize_width(self.cleaned_data['keyword'])
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('keyword_fish_name') and not cleaned_data.get('keyword') and not self.errors:
+            raise forms.ValidationError('魚名かキーワードを入力してください')
+        return cleaned_data
+
+
+class StatsForm(forms.Form):
+    # 統計API(trips.stats)の絞り込み条件
+    fish = FishNameField(required=False, max_length=20)
+    prefecture = forms.ChoiceField(choices=choice_prefectures, required=False)
+    year = forms.IntegerField(required=False, min_value=1900, max_value=9999)
+    limit = forms.IntegerField(required=False, min_value=1, max_value=50)
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -1,36 +1,78 @@
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.ticker 
-import base64
+from functools import lru_cache
 from io import BytesIO
-matplotlib.use('AGG')
-def output_graph():
+
+MONTHS = list(range(1, 13))
+
+# 同じ分布のグラフは使い回す。キーは12ヶ月分の件数のタプル
+CHART_CACHE_SIZE = 256
+
+SVG_WIDTH = 600
+SVG_HEIGHT = 300
+SVG_MARGIN = 30
+
+
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def render_png(counts):
+    # matplotlib(とNumPy)は読み込みに時間とメモリがかかるので、PNGを初めて描くときに読み込む
+    # SVGのグラフだけを返すワーカーは読み込まずに済む(benchmarks.startup で確認できる)
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    # pyplotのグローバル状態を使わず、Figureを直接作って描画する
+    figure = Figure(figsize=(10, 5))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    bars = ax.bar(MONTHS, counts)
+    ax.bar_label(bars, padding=3)
+    ax.set_xlabel('month', fontsize=18)
+    ax.set_ylabel('posts', fontsize=18)
+    ax.set_xticks(MONTHS)
+    ax.tick_params(axis='x', labelsize=18)
+    ax.set_yticks([])
+    figure.tight_layout()
     buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    img = buffer.getvalue()
-    graph = base64.b64encode(img)
-    graph = graph.decode('utf-8')
-    buffer.close()
-    return graph
-
-def plot_graph(x,y):
-  plt.switch_backend("AGG")
-  plt.figure(figsize=(10,5))
-  gr= plt.bar(x,y)
-  def autolabel(gr):
-    for rect in gr:
-        height = rect.get_height()
-        plt.annotate('{}'.format(height),
-            xy=(rect.get_x() + rect.get_width() / 2, height),
-            xytext=(0, 3),
-            textcoords="offset points",
-            ha='center', va='bottom')
-  autolabel(gr)
-  plt.xlabel("month",fontsize=18)
-  plt.ylabel("posts",fontsize=18)
-  plt.tight_layout()
-  plt.xticks(range(1,13),fontsize=18)
-  plt.yticks([])
-  graph = output_graph()
-  return graph
\ No newline at end of file
+    try:
+        figure.savefig(buffer, format='png')
+        return buffer.getvalue()
+    finally:
+        buffer.close()
+        figure.clear()
+
+
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def render_svg(counts):
+    # matplotlibを使わずに棒グラフのSVGを組み立てる
+    peak = max(max(counts), 1)
+    plot_height = SVG_HEIGHT - SVG_MARGIN * 2
+    slot = (SVG_WIDTH - SVG_MARGIN) / len(MONTHS)
+    parts = [
+        '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {0} {1}" role="img">'.format(
+            SVG_WIDTH, SVG_HEIGHT),
+        '<line x1="{0}" y1="{1}" x2="{2}" y2="{1}" stroke="#333"/>'.format(
+            SVG_MARGIN, SVG_HEIGHT - SVG_MARGIN, SVG_WIDTH),
+    ]
+    for month, count in zip(MONTHS, counts):
+        height = plot_height * count / peak
+        x = SVG_MARGIN + slot * (month - 1) + slot * 0.1
+        y = SVG_HEIGHT - SVG_MARGIN - height
+        center = x + slot * 0.4
+        parts.append(
+            '<rect x="{0:.1f}" y="{1:.1f}" width="{2:.1f}" height="{3:.1f}" fill="#1f77b4"/>'.format(
+                x, y, slot * 0.8, height))
+        parts.append('<text x="{0:.1f}" y="{1:.1f}" text-anchor="middle" font-size="14">{2}</text>'.format(
+            center, y - 4, count))
+        parts.append('<text x="{0:.1f}" y="{1}" text-anchor="middle" font-size="14">{2}</text>'.format(
+            center, SVG_HEIGHT - SVG_MARGIN + 18, month))
+    parts.append('<text x="12" y="{0}" font-size="14" transform="rotate(-90 12 {0})" text-anchor="middle">posts</text>'.format(
+        SVG_HEIGHT // 2))
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def chart_svg(counts):
+    return render_svg(tuple(counts))
+
+
+def chart_png(counts):
+    return render_png(tuple(counts))
+
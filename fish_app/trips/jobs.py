@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+
+from jobs.queue import register
+from . import timeline
+from .models import Result, Trip
+from .thumbnails import delete_thumbnails, generate_thumbnails, normalize_image
+
+
+@register('trips.process_result_image')
+def process_result_image(result_id):
+    result = Result.objects.filter(pk=result_id).select_related('trip').first()
+    if result is None or not result.image:
+        return
+    original = name = result.image.name
+    image_hash = thumbnail_widths = ''
+    # ファイルがない場合は処理するものがないので、そのまま処理済みにする
+    if default_storage.exists(name):
+        name, image_hash = normalize_image(name)
+        thumbnail_widths = generate_thumbnails(name)
+    # 処理中に画像が差し替えられていたら、古い画像から作ったものは保存せずに消す
+    updated = Result.objects.filter(pk=result_id, image=original).update(
+        image=name, image_hash=image_hash, thumbnail_widths=thumbnail_widths, image_ready=True)
+    if not updated:
+        if name != original:
+            delete_thumbnails(name, thumbnail_widths)
+            default_storage.delete(name)
+        return
+    if name != original:
+        default_storage.delete(original)
+    result.trip.refresh_listing()
+
+
+@register('trips.fan_out_trip')
+def fan_out_trip(trip_id):
+    trip = Trip.objects.filter(pk=trip_id).first()
+    if trip is not None:
+        timeline.fan_out_trip(trip)
+
+
+@register('trips.follow_timeline')
+def follow_timeline(owner_id, followed_id):
+    owner = get_user_model().objects.filter(pk=owner_id).first()
+    if owner is not None:
+        timeline.add_followed_trips(owner, followed_id)
+
+
+@register('trips.unfollow_timeline')
+def unfollow_timeline(owner_id, followed_id):
+    owner = get_user_model().objects.filter(pk=owner_id).first()
+    if owner is None:
+        return
+    timeline.remove_followed_trips(owner, followed_id)
+    # フォロー数が上限を下回ったら、表示時に引く方式から書き込み済みのタイムラインに戻す
+    if owner.following_count == settings.TIMELINE_READ_THRESHOLD:
+        timeline.rebuild_timeline(owner)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from trips.models import Trip
+from trips.transfer import FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = '釣行・釣果・コメントをJSONL(釣行ごとに1行)またはCSV(釣果ごとに1行)で書き出す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument('--output', '-o', default='-', help='書き出すファイル(省略すると標準出力)')
+        parser.add_argument('--user', help='このユーザー名の釣行だけ書き出す')
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.all()
+        if options['user']:
+            trips = trips.filter(user__username=options['user'])
+        lines = export_lines(options['format'], trips)
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            output.writelines(lines)
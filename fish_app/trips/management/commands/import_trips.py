@@ -0,0 +1,41 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trips.transfer import CHUNK_SIZE, FORMATS, import_records, read_records
+
+# 表示する検証エラーの上限
+MAX_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = 'export_tripsの形式(JSONL/CSV)の釣行・釣果・コメントをまとめて取り込む'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='取り込むファイル(-で標準入力)')
+        parser.add_argument('--format', choices=FORMATS, help='省略するとファイルの拡張子で判断する')
+        parser.add_argument('--batch-size', type=int, default=CHUNK_SIZE, help='一度に保存する釣行の数')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        started = time.perf_counter()
+        try:
+            if path == '-':
+                report = import_records(read_records(sys.stdin, format), options['batch_size'])
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as lines:
+                    report = import_records(read_records(lines, format), options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        elapsed = time.perf_counter() - started
+
+        for line_number, message in report.errors[:MAX_ERRORS]:
+            self.stderr.write('{}行目: {}'.format(line_number, message))
+        if len(report.errors) > MAX_ERRORS:
+            self.stderr.write('ほか{}件のエラー'.format(len(report.errors) - MAX_ERRORS))
+        self.stdout.write('{}件の釣行・{}件の釣果・{}件のコメントを取り込みました({:.0f}行/秒、エラー{}件)'.format(
+            report.trips, report.results, report.comments, report.rows / elapsed if elapsed else 0, len(report.errors)))
+        if report.trips:
+            self.stdout.write('フォロワーのタイムラインに入れるには rebuild_timelines を実行してください')
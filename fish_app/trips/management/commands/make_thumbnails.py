@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from trips.models import Result, Trip
+from trips.thumbnails import make_thumbnails
+
+
+def init_worker():
+    # spawnで起動した場合に備えてワーカー側でもDjangoを初期化する
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = '既存の釣果画像のサムネイルをまとめて作成する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='並列で処理するプロセス数')
+        parser.add_argument('--force', action='store_true', help='作成済みのサムネイルも作り直す')
+
+    def handle(self, *args, **options):
+        images = dict(Result.objects.exclude(image='').exclude(image=None).values_list('image', 'thumbnail_widths'))
+        names = list(images)
+        widths = [images[name] for name in names]
+        forces = [options['force']] * len(names)
+        if options['workers'] > 1:
+            # フォーク前にDB接続を閉じ、子プロセスと共有しないようにする
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+                results = list(pool.map(make_thumbnails, names, widths, forces, chunksize=8))
+        else:
+            results = [make_thumbnails(*args) for args in zip(names, widths, forces)]
+
+        # 作れた幅を保存する。作れなかった画像は空にして、srcsetを出さないようにする
+        trip_ids = set()
+        for name, thumbnail_widths, error in results:
+            if thumbnail_widths != images[name]:
+                Result.objects.filter(image=name).update(thumbnail_widths=thumbnail_widths)
+                trip_ids.update(Result.objects.filter(image=name).values_list('trip_id', flat=True))
+        if trip_ids:
+            Trip.objects.refresh_listings(trip_ids)
+        created = sum(1 for name, thumbnail_widths, error in results if error is None)
+        skipped = sum(1 for name, thumbnail_widths, error in results if error == 'skipped')
+        for name, thumbnail_widths, error in results:
+            if error not in (None, 'skipped'):
+                self.stderr.write('{}: {}'.format(name, error))
+        self.stdout.write('作成: {}件 / 作成済み: {}件 / 失敗: {}件'.format(
+            created, skipped, len(results) - created - skipped))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from trips.models import MonthlyCatch, Result
+
+
+class Command(BaseCommand):
+    help = '釣果(Result)から年月別の釣果数(MonthlyCatch)を作り直す'
+
+    def handle(self, *args, **options):
+        catches = Result.objects.values_list(
+            'fish_name', 'trip__prefecture', 'created_at__year', 'created_at__month').annotate(total=Count('id')).order_by()
+        with transaction.atomic():
+            MonthlyCatch.objects.all().delete()
+            MonthlyCatch.objects.bulk_create(
+                MonthlyCatch(fish_name=fish_name, prefecture=prefecture, year=year, month=month, count=total)
+                for fish_name, prefecture, year, month, total in catches.iterator()
+            )
+        self.stdout.write('{}件の月別釣果数を再集計しました'.format(MonthlyCatch.objects.count()))
@@ -0,0 +1,22 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from trips.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = 'フォロー関係と釣行から各ユーザーのタイムラインを作り直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help='対象のユーザーID(省略すると全員)')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('id')
+        if options['user_ids']:
+            users = users.filter(id__in=options['user_ids'])
+        total = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                total += rebuild_timeline(user)
+        self.stdout.write('{}件のタイムラインを作り直しました'.format(total))
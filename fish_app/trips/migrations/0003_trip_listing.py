@@ -0,0 +1,35 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+def fill_trip_listing(apps, schema_editor):
+    Trip = apps.get_model('trips', 'Trip')
+    Result = apps.get_model('trips', 'Result')
+    listings = {}
+    for trip_id, fish_name, image in Result.objects.order_by('trip_id', 'id').values_list('trip_id', 'fish_name', 'image').iterator():
+        cover_image, fish_names = listings.setdefault(trip_id, [image or '', []])
+        fish_names.append(fish_name)
+    for trip_id, (cover_image, fish_names) in listings.items():
+        Trip.objects.filter(pk=trip_id).update(cover_image=cover_image, fish_summary=' '.join(fish_names))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0002_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='cover_image',
+            field=models.ImageField(blank=True, editable=False, upload_to='images/', verbose_name='カバー画像'),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='fish_summary',
+            field=models.TextField(blank=True, editable=False, verbose_name='釣果の魚名'),
+        ),
+        migrations.RunPython(fill_trip_listing, migrations.RunPython.noop),
+    ]
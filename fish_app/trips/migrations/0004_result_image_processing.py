@@ -0,0 +1,23 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0003_trip_listing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='画像のハッシュ値'),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='image_ready',
+            field=models.BooleanField(default=True, editable=False, verbose_name='画像処理済み'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0005_timeline_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新日時'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:56
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# GINインデックスはPostgreSQLにしかないので、モデルのMeta.indexesではなくここで作る
+SEARCH_INDEXES = [
+    ('trip_search_vector_idx', 'trip USING gin (search_vector)'),
+    ('trip_title_trgm_idx', 'trip USING gin (title gin_trgm_ops)'),
+    ('trip_content_trgm_idx', 'trip USING gin (content gin_trgm_ops)'),
+    ('monthly_catch_fish_trgm_idx', 'monthly_catch USING gin (fish_name gin_trgm_ops)'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in SEARCH_INDEXES:
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS {} ON {}'.format(name, definition))
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in SEARCH_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+def backfill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from trips.search import trip_search_document
+
+    Trip = apps.get_model('trips', 'Trip')
+    for trip in Trip.objects.only('id', 'title', 'content').iterator():
+        Trip.objects.filter(pk=trip.pk).update(search_vector=trip_search_document(trip.title, trip.content))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0006_trip_updated_at'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='trip',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+        migrations.RunPython(backfill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.0.4 on 2026-10-18 17:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rebuild_monthly_catch(apps, schema_editor):
+    # 既存の行には年がないので、釣果から年月別に数え直す
+    MonthlyCatch = apps.get_model('trips', 'MonthlyCatch')
+    Result = apps.get_model('trips', 'Result')
+    catches = Result.objects.values_list(
+        'fish_name', 'trip__prefecture', 'created_at__year', 'created_at__month').annotate(total=Count('id')).order_by()
+    MonthlyCatch.objects.all().delete()
+    MonthlyCatch.objects.bulk_create(
+        [MonthlyCatch(fish_name=fish_name, prefecture=prefecture, year=year, month=month, count=total)
+         for fish_name, prefecture, year, month, total in catches.iterator()],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0007_trip_search'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='monthlycatch',
+            name='unique_monthly_catch',
+        ),
+        migrations.AddField(
+            model_name='monthlycatch',
+            name='year',
+            field=models.PositiveSmallIntegerField(default=2000, verbose_name='年'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(rebuild_monthly_catch, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='monthlycatch',
+            constraint=models.UniqueConstraint(fields=('fish_name', 'prefecture', 'year', 'month'), name='unique_monthly_catch'),
+        ),
+        migrations.AddIndex(
+            model_name='monthlycatch',
+            index=models.Index(fields=['prefecture', 'year'], name='monthly_catch_pref_year_idx'),
+        ),
+    ]
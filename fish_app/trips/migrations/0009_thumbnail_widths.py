@@ -0,0 +1,23 @@
+# Generated by Django 3.0.4 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0008_monthly_catch_year'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='thumbnail_widths',
+            field=models.CharField(blank=True, editable=False, max_length=20, verbose_name='サムネイルの幅'),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='cover_thumbnail_widths',
+            field=models.CharField(blank=True, editable=False, max_length=20, verbose_name='カバー画像のサムネイルの幅'),
+        ),
+    ]
@@ -1,11 +1,36 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import RegexValidator
+from django.utils import timezone
+
+class TripManager(models.Manager):
+
+    def refresh_listings(self, trip_ids=None):
+        # bulk_createなどシグナルを通らずに釣果を入れた後に、一覧用の値をまとめて作り直す
+        results = Result.objects.order_by('trip_id', 'id')
+        if trip_ids is not None:
+            results = results.filter(trip_id__in=trip_ids)
+        listings = {}
+        rows = results.values_list('trip_id', 'fish_name', 'image', 'image_ready', 'thumbnail_widths').iterator()
+        for trip_id, fish_name, image, image_ready, thumbnail_widths in rows:
+            cover = ((image or ''), thumbnail_widths) if image_ready else ('', '')
+            cover, fish_names = listings.setdefault(trip_id, [cover, []])
+            fish_names.append(fish_name)
+        for trip_id, ((cover_image, cover_thumbnail_widths), fish_names) in listings.items():
+            self.filter(pk=trip_id).update(
+                cover_image=cover_image, cover_thumbnail_widths=cover_thumbnail_widths,
+                fish_summary=' '.join(fish_names), updated_at=timezone.now())
+
 
 class Trip(models.Model):
     class Meta:
         db_table = 'trip'
         verbose_name = '釣行'
+        indexes = [
+            models.Index(fields=['-created_at'], name='trip_created_idx'),
+            models.Index(fields=['user', '-created_at'], name='trip_user_created_idx'),
+        ]
 
     def __str__(self):
         return '<' 'trip_id=' + str(self.id) + 'user=' + str(self.user) + '>'
@@ -15,12 +40,36 @@ class Trip(models.Model):
     content = models.CharField(max_length=1000, verbose_name='内容')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='作成日時')
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    # 釣行・釣果・コメントが変わるたびに更新する。キャッシュのキーに使う(trips.cache)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新日時')
+    # 一覧ページ用に釣果から作る値。Resultの保存・削除時に更新する
+    cover_image = models.ImageField(upload_to='images/', verbose_name='カバー画像', blank=True, editable=False)
+    cover_thumbnail_widths = models.CharField(max_length=20, blank=True, editable=False, verbose_name='カバー画像のサムネイルの幅')
+    fish_summary = models.TextField(verbose_name='釣果の魚名', blank=True, editable=False)
+    # タイトルと内容の全文検索用。PostgreSQLでのみ保存時に作る(trips.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = TripManager()
+
+    def refresh_listing(self):
+        results = list(self.result_set.order_by('id').values_list('fish_name', 'image', 'image_ready', 'thumbnail_widths'))
+        ready = results and results[0][2]
+        self.cover_image = (results[0][1] or '') if ready else ''
+        self.cover_thumbnail_widths = results[0][3] if ready else ''
+        self.fish_summary = ' '.join(result[0] for result in results)
+        self.updated_at = timezone.now()
+        Trip.objects.filter(pk=self.pk).update(
+            cover_image=self.cover_image, cover_thumbnail_widths=self.cover_thumbnail_widths,
+            fish_summary=self.fish_summary, updated_at=self.updated_at)
 
 
 class Result(models.Model):
     class Meta:
         db_table = 'result'
         verbose_name = '釣果'
+        indexes = [
+            models.Index(fields=['fish_name', '-created_at', '-id'], name='result_fish_created_idx'),
+        ]
 
     def __str__(self):
         return '<' 'result_id=' + str(self.id) + '>'
@@ -29,12 +78,20 @@ class Result(models.Model):
     image = models.ImageField(upload_to='images/', verbose_name='画像(任意)', null=True, blank=True)
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now=True, verbose_name='投稿日時')
+    # 画像の後処理(EXIF除去・縮小・サムネイル作成)はジョブで行い、終わるまでFalse
+    image_ready = models.BooleanField(default=True, editable=False, verbose_name='画像処理済み')
+    image_hash = models.CharField(max_length=64, blank=True, editable=False, verbose_name='画像のハッシュ値')
+    # 作成済みのサムネイルの幅("320,640")。作っていない・失敗した画像は空で、srcsetを出さない
+    thumbnail_widths = models.CharField(max_length=20, blank=True, editable=False, verbose_name='サムネイルの幅')
 
 
 class Comment(models.Model):
     class Meta:
         db_table = 'comment'
         verbose_name = 'コメント'
+        indexes = [
+            models.Index(fields=['trip', 'created_at'], name='comment_trip_created_idx'),
+        ]
 
     def __str__(self):
         return '<' 'comment_id=' + str(self.id) + '>'
@@ -43,5 +100,65 @@ class Comment(models.Model):
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now=True, verbose_name='投稿日時')
-    
-    
\ No newline at end of file
+
+
+class MonthlyCatchManager(models.Manager):
+
+    def histogram(self, fish_name, prefecture='', year=None):
+        # 1月〜12月の釣果数をリストで返す。魚名はリストで複数指定できる。yearを省略すると全年の合計
+        if isinstance(fish_name, str):
+            catches = self.filter(fish_name=fish_name)
+        else:
+            catches = self.filter(fish_name__in=fish_name)
+        if prefecture:
+            catches = catches.filter(prefecture=prefecture)
+        if year is not None:
+            catches = catches.filter(year=year)
+        counts = dict(catches.values_list('month').annotate(total=models.Sum('count')).order_by())
+        return [counts.get(month, 0) for month in range(1, 13)]
+
+
+class MonthlyCatch(models.Model):
+    # 釣果を魚名・都道府県・年月ごとに数えておく集計テーブル。Resultの保存・削除時に増減する(trips.signals)
+    class Meta:
+        db_table = 'monthly_catch'
+        verbose_name = '月別釣果数'
+        constraints = [
+            models.UniqueConstraint(fields=['fish_name', 'prefecture', 'year', 'month'], name='unique_monthly_catch'),
+        ]
+        indexes = [
+            models.Index(fields=['prefecture', 'year'], name='monthly_catch_pref_year_idx'),
+        ]
+
+    def __str__(self):
+        return ('<' 'fish_name=' + self.fish_name + ' prefecture=' + self.prefecture
+                + ' year=' + str(self.year) + ' month=' + str(self.month) + '>')
+
+    fish_name = models.CharField(max_length=20, verbose_name='魚名')
+    prefecture = models.CharField(max_length=4, verbose_name='都道府県')
+    year = models.PositiveSmallIntegerField(verbose_name='年')
+    month = models.PositiveSmallIntegerField(verbose_name='月')
+    count = models.PositiveIntegerField(default=0, verbose_name='釣果数')
+
+    objects = MonthlyCatchManager()
+
+
+class TimelineEntry(models.Model):
+    # フォロー中のユーザーの釣行を、投稿時に各フォロワーのタイムラインへ書き込んでおく(trips.timeline)
+    class Meta:
+        db_table = 'timeline_entry'
+        verbose_name = 'タイムライン'
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'trip'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-trip'], name='timeline_owner_created_idx'),
+        ]
+
+    def __str__(self):
+        return '<' 'owner=' + str(self.owner_id) + ' trip_id=' + str(self.trip_id) + '>'
+
+    owner = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='timeline_entries')
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='timeline_entries')
+    # 並び替えに使うので釣行の作成日時をコピーしておく
+    created_at = models.DateTimeField(verbose_name='作成日時')
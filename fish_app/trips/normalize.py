@@ -0,0 +1,31 @@
+import re
+import unicodedata
+
+# ひらがな(ぁ〜ゖ)とカタカナ(ァ〜ヶ)はコード位置が0x60ずれている
+HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(0x3041, 0x3097)}
+
+
+def normalize_width(value):
+    # 半角カナ・全角英数・濁点の結合文字などをNFKCでそろえる
+    return unicodedata.normalize('NFKC', value or '').strip()
+
+
+def to_katakana(value):
+    return normalize_width(value).translate(HIRAGANA_TO_KATAKANA)
+
+
+def normalize_fish_name(value):
+    # 魚名はカタカナで保存するので、入力のゆれ(半角カナ・ひらがな・空白)を吸収してから検証する
+    return re.sub(r'\s+', '', to_katakana(value))
+
+
+def search_terms(value):
+    # 日本語には単語の区切りがないので、英数字以外の連続は2文字ずつずらして区切る(bi-gram)
+    # ひらがなとカタカナは同じ語として扱う
+    terms = []
+    for word in re.findall(r'\w+', to_katakana(value).lower()):
+        if word.isascii() or len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
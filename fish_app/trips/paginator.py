@@ -0,0 +1,171 @@
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+def encode_cursor(row):
+    # (created_at, id)の組をURLに載せられる文字列にする
+    if isinstance(row, dict):
+        created_at, pk = row['created_at'], row['id']
+    else:
+        created_at, pk = row.created_at, row.pk
+    return '{}_{}'.format(created_at.isoformat(), pk)
+
+
+def decode_cursor(value):
+    try:
+        created_at, pk = value.rsplit('_', 1)
+        return datetime.datetime.fromisoformat(created_at), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous else None
+
+
+def keyset_paginate(queryset, per_page, after=None, before=None, id_field='pk'):
+    # OFFSETを使わず、(created_at, id)の降順でafterより古い/beforeより新しい行を取る
+    # id_fieldには同じ日時の行の並びを決める列を指定する(カーソルの値と対応させる)
+    after = decode_cursor(after)
+    before = decode_cursor(before)
+    if before is not None:
+        created_at, pk = before
+        rows = list(queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, **{id_field + '__gt': pk})
+        ).order_by('created_at', id_field)[:per_page + 1])
+        # カーソルの行とそれより古い行は残っているので、次のページは常にある
+        # 新しい行がなければ(カーソルの行が先頭になった)最初のページを返す
+        if rows:
+            return KeysetPage(rows[:per_page][::-1], has_next=True, has_previous=len(rows) > per_page)
+        after = None
+    if after is not None:
+        created_at, pk = after
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, **{id_field + '__lt': pk}))
+    rows = list(queryset.order_by('-created_at', '-' + id_field)[:per_page + 1])
+    return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=after is not None)
+
+
+def estimated_count(queryset):
+    # 絞り込みのない大きな表はPostgreSQLの統計情報(pg_class.reltuples)の推定値を使う
+    # 推定値とCOUNT(*)のどちらになったかによらず、結果をPAGINATOR_COUNT_TIMEOUT秒キャッシュする
+    key = 'paginator-count:' + hashlib.md5(str(queryset.query).encode()).hexdigest()
+    count = cache.get(key)
+    if count is not None:
+        return count
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where and not queryset.query.distinct:
+        # 推定値が閾値より小さければ、同じクエリの中で数える
+        table = connection.ops.quote_name(queryset.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT CASE WHEN reltuples >= %s THEN reltuples::bigint ELSE (SELECT COUNT(*) FROM {}) END '
+                'FROM pg_class WHERE oid = to_regclass(%s)'.format(table),
+                [settings.PAGINATOR_ESTIMATE_THRESHOLD, table])
+            row = cursor.fetchone()
+        count = int(row[0]) if row else queryset.count()
+    else:
+        count = queryset.count()
+    cache.set(key, count, settings.PAGINATOR_COUNT_TIMEOUT)
+    return count
+
+
+class WindowedPage(Page):
+
+    def __init__(self, object_list, number, paginator, has_next, has_previous):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self._has_next else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self._has_previous and self.object_list else None
+
+    @property
+    def page_window(self):
+        # 前後window件のページ番号だけを返す。件数は推定なので、次のページがあれば少なくともそこまでは出す
+        last = max(self.paginator.num_pages, self.number + 1 if self._has_next else self.number)
+        return range(max(1, self.number - self.paginator.window), min(last, self.number + self.paginator.window) + 1)
+
+
+class WindowedPaginator(Paginator):
+    # ListViewのpaginator_class用。(created_at, id)の降順に並べ、総件数は推定値(estimated_count)を使う
+    # 前後のページへはカーソル(after/before)でOFFSETを使わずに移動し、番号で飛ぶときだけOFFSETを使う
+    # 件数が推定なので、ページ番号の上限は確かめず、行がなければEmptyPageにする。orphansは使わない
+    window = 5
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, after=None, before=None):
+        super().__init__(object_list.order_by('-created_at', '-pk'), per_page, orphans, allow_empty_first_page)
+        self.after = after
+        self.before = before
+
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('ページ番号が整数ではありません')
+        if number < 1:
+            raise EmptyPage('ページ番号が1より小さいです')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if decode_cursor(self.after) or decode_cursor(self.before):
+            page = keyset_paginate(self.object_list, self.per_page, self.after, self.before)
+            rows, has_next, has_previous = page.object_list, page.has_next, page.has_previous
+        else:
+            bottom = (number - 1) * self.per_page
+            rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+            has_next, has_previous = len(rows) > self.per_page, number > 1
+            rows = rows[:self.per_page]
+        if not rows and number > 1:
+            raise EmptyPage('このページには結果がありません')
+        return WindowedPage(rows, number, self, has_next, has_previous)
+
+
+class WindowedPaginationMixin:
+    # ListViewにWindowedPaginatorと、リクエストのカーソルを渡す
+    paginator_class = WindowedPaginator
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return self.paginator_class(
+            queryset, per_page, orphans=orphans, allow_empty_first_page=allow_empty_first_page,
+            after=self.request.GET.get('after'), before=self.request.GET.get('before'), **kwargs)
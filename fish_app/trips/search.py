@@ -0,0 +1,121 @@
+import difflib
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Max, Q, Sum, TextField, Value, When
+
+from .models import MonthlyCatch, Result, Trip
+from .normalize import normalize_fish_name, search_terms
+from .suggest import suggest
+
+# 部分一致で拾う魚名・「もしかして」に出す魚名の上限
+FISH_CANDIDATE_LIMIT = 10
+# PostgreSQL以外で「もしかして」に出す類似度の下限(difflibの一致率)
+FISH_SIMILARITY_THRESHOLD = 0.5
+SUGGEST_LIMIT = 10
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def fish_name_totals():
+    return MonthlyCatch.objects.values('fish_name').annotate(total=Sum('count')).filter(total__gt=0).order_by()
+
+
+def fish_name_candidates(fish_name, limit=FISH_CANDIDATE_LIMIT):
+    # 入力を含む魚名(サバ→サバ・マサバ・ゴマサバ)を、完全一致・前方一致・釣果数の順に並べて返す
+    # 魚名の種類は少ないので、釣果ではなく集計テーブルから探す
+    fish_name = normalize_fish_name(fish_name)
+    if not fish_name:
+        return []
+    rows = fish_name_totals().filter(fish_name__contains=fish_name)
+    candidates = sorted(rows, key=lambda row: (
+        row['fish_name'] != fish_name, not row['fish_name'].startswith(fish_name), -row['total'], row['fish_name']))
+    return candidates[:limit]
+
+
+def similar_fish_names(fish_name, limit=FISH_CANDIDATE_LIMIT):
+    # 入力を含む魚名がないときに「もしかして」として出す、表記の近い魚名(カサコ→カサゴ)
+    fish_name = normalize_fish_name(fish_name)
+    if not fish_name:
+        return []
+    if uses_postgres():
+        # pg_trgmの類似度(gin_trgm_opsのインデックスで絞り込める)
+        rows = fish_name_totals().filter(fish_name__trigram_similar=fish_name).annotate(
+            similarity=Max(TrigramSimilarity('fish_name', fish_name)))
+        candidates = [(row['similarity'], row) for row in rows]
+    else:
+        candidates = []
+        for row in fish_name_totals():
+            similarity = difflib.SequenceMatcher(None, fish_name, row['fish_name']).ratio()
+            if similarity >= FISH_SIMILARITY_THRESHOLD:
+                candidates.append((similarity, row))
+    candidates.sort(key=lambda c: (-c[0], -c[1]['total'], c[1]['fish_name']))
+    return [row for similarity, row in candidates[:limit]]
+
+
+def suggest_fish_names(prefix, limit=SUGGEST_LIMIT):
+    # 入力途中の魚名を前方一致で補完する。釣果の多い魚を先に出す
+    # 入力のたびに呼ばれるので、データベースではなくプロセスのメモリの索引から引く(trips.suggest)
+    return suggest(prefix, limit)
+
+
+def trip_search_document(title, content):
+    # bi-gramに区切った文字列を'simple'設定でtsvectorにする。タイトルの一致を重く扱う
+    return (SearchVector(Value(' '.join(search_terms(title)), output_field=TextField()), config='simple', weight='A')
+            + SearchVector(Value(' '.join(search_terms(content)), output_field=TextField()), config='simple', weight='B'))
+
+
+def update_search_vector(trip):
+    if uses_postgres():
+        Trip.objects.filter(pk=trip.pk).update(search_vector=trip_search_document(trip.title, trip.content))
+
+
+def refresh_search_vectors(trip_ids=None, batch_size=1000):
+    # bulk_createなどシグナルを通らずに入れた釣行の検索用の値をまとめて作る
+    if not uses_postgres():
+        return 0
+    trips = Trip.objects.order_by('id').only('id', 'title', 'content')
+    if trip_ids is not None:
+        trips = trips.filter(id__in=trip_ids)
+    batch = []
+    total = 0
+    for trip in trips.iterator(chunk_size=batch_size):
+        trip.search_vector = trip_search_document(trip.title, trip.content)
+        batch.append(trip)
+        if len(batch) >= batch_size:
+            total += len(batch)
+            Trip.objects.bulk_update(batch, ['search_vector'])
+            batch = []
+    total += len(batch)
+    Trip.objects.bulk_update(batch, ['search_vector'])
+    return total
+
+
+def search_trips(keyword, prefecture='', fish_names=None):
+    # タイトル・内容にキーワードを含む釣行を関連度の高い順に返す
+    trips = Trip.objects.select_related('user')
+    if prefecture:
+        trips = trips.filter(prefecture=prefecture)
+    if fish_names is not None:
+        trips = trips.filter(id__in=Result.objects.filter(fish_name__in=fish_names).values('trip_id'))
+    if uses_postgres():
+        terms = search_terms(keyword)
+        if not terms:
+            return trips.none()
+        # 1文字の語はbi-gramに現れないので前方一致で探す
+        query = SearchQuery(' & '.join(term + ':*' if len(term) == 1 else term for term in terms),
+                            config='simple', search_type='raw')
+        return trips.filter(Q(search_vector=query) | Q(title__trigram_similar=keyword)).annotate(
+            rank=SearchRank(F('search_vector'), query) + TrigramSimilarity('title', keyword),
+        ).order_by('-rank', '-created_at', '-id')
+    return trips.filter(Q(title__icontains=keyword) | Q(content__icontains=keyword)).annotate(
+        rank=Case(When(title__icontains=keyword, then=Value(2)), default=Value(1), output_field=IntegerField()),
+    ).order_by('-rank', '-created_at', '-id')
+
+
+def search_page(queryset, page, per_page):
+    # 関連度順はキーセットで区切れないのでOFFSETで取る。1件多く読んで次ページの有無を調べる
+    rows = list(queryset[(page - 1) * per_page:page * per_page + 1])
+    return rows[:per_page], len(rows) > per_page
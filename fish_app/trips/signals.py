@@ -0,0 +1,187 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from accounts.models import Connection
+from jobs.queue import enqueue
+
+from .cache import touch_trip, touch_user_trips
+from .models import Comment, MonthlyCatch, Result, Trip
+from .search import update_search_vector
+from .suggest import fish_name_index
+from .thumbnails import delete_thumbnails
+
+
+def add_monthly_catch(fish_name, prefecture, year, month, delta):
+    if delta > 0:
+        catch, created = MonthlyCatch.objects.get_or_create(
+            fish_name=fish_name, prefecture=prefecture, year=year, month=month, defaults={'count': delta})
+        if not created:
+            MonthlyCatch.objects.filter(pk=catch.pk).update(count=F('count') + delta)
+    elif delta < 0:
+        updated = MonthlyCatch.objects.filter(
+            fish_name=fish_name, prefecture=prefecture, year=year, month=month, count__gte=-delta
+        ).update(count=F('count') + delta)
+        if not updated:
+            return
+    else:
+        return
+    # 集計テーブルに書けた分だけ、コミット後に候補の件数へ反映する
+    transaction.on_commit(lambda: fish_name_index.add(fish_name, delta))
+
+
+def monthly_catch_key(result):
+    return (result.fish_name, result.trip.prefecture, result.created_at.year, result.created_at.month)
+
+
+@receiver(pre_save, sender=Result)
+def remember_result_catch(sender, instance, raw=False, **kwargs):
+    # created_atはauto_nowなので保存のたびに年月が変わりうる。保存前の集計キーを覚えておく
+    instance._old_catch_key = None
+    instance._old_image = None
+    instance._old_thumbnail_widths = ''
+    if raw or instance.pk is None:
+        return
+    old = Result.objects.filter(pk=instance.pk).values_list(
+        'fish_name', 'trip__prefecture', 'created_at__year', 'created_at__month', 'image', 'thumbnail_widths').first()
+    if old is not None:
+        instance._old_catch_key = old[:4]
+        instance._old_image, instance._old_thumbnail_widths = old[4:]
+
+
+@receiver(post_save, sender=Result)
+def update_result_catch(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    new_key = monthly_catch_key(instance)
+    old_key = getattr(instance, '_old_catch_key', None)
+    if old_key == new_key:
+        return
+    if old_key is not None:
+        add_monthly_catch(*old_key, -1)
+    add_monthly_catch(*new_key, 1)
+
+
+@receiver(pre_delete, sender=Result)
+def remember_deleted_result_catch(sender, instance, **kwargs):
+    instance._old_catch_key = monthly_catch_key(instance)
+
+
+@receiver(post_delete, sender=Result)
+def delete_result_catch(sender, instance, **kwargs):
+    add_monthly_catch(*instance._old_catch_key, -1)
+
+
+def delete_unused_thumbnails(name, widths):
+    # コミット後に消す。ロールバックされた場合や、同じ画像を別の釣果がまだ使っている場合は残す
+    def delete():
+        if not Result.objects.filter(image=name).exists():
+            delete_thumbnails(name, widths)
+    if name and widths:
+        transaction.on_commit(delete)
+
+
+@receiver(post_save, sender=Result)
+def enqueue_result_image(sender, instance, raw=False, **kwargs):
+    # 画像がアップロード・差し替えされたときだけ、リクエストの外で後処理する
+    old_image = getattr(instance, '_old_image', None)
+    if raw or (instance.image.name or None) == (old_image or None):
+        return
+    delete_unused_thumbnails(old_image, instance._old_thumbnail_widths)
+    Result.objects.filter(pk=instance.pk).update(image_ready=not instance.image, thumbnail_widths='')
+    instance.image_ready = not instance.image
+    instance.thumbnail_widths = ''
+    if instance.image:
+        # ロールバックされた保存や、コミット前の行をワーカーが読まないように、コミット後に積む
+        result_id = instance.pk
+        transaction.on_commit(lambda: enqueue('trips.process_result_image', result_id=result_id))
+
+
+@receiver(post_delete, sender=Result)
+def delete_result_thumbnails(sender, instance, **kwargs):
+    if instance.image:
+        delete_unused_thumbnails(instance.image.name, instance.thumbnail_widths)
+
+
+@receiver(post_save, sender=Result)
+@receiver(post_delete, sender=Result)
+def refresh_trip_listing(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance.trip.refresh_listing()
+
+
+@receiver(pre_save, sender=Trip)
+def remember_trip_prefecture(sender, instance, raw=False, **kwargs):
+    instance._old_prefecture = None
+    if raw or instance.pk is None:
+        return
+    instance._old_prefecture = Trip.objects.filter(pk=instance.pk).values_list('prefecture', flat=True).first()
+
+
+@receiver(post_save, sender=Trip)
+def move_trip_catches(sender, instance, raw=False, **kwargs):
+    # 釣行の都道府県が変わったら、紐づく釣果の集計を新しい都道府県へ移す
+    old_prefecture = getattr(instance, '_old_prefecture', None)
+    if raw or old_prefecture is None or old_prefecture == instance.prefecture:
+        return
+    catches = Result.objects.filter(trip=instance).values_list(
+        'fish_name', 'created_at__year', 'created_at__month').annotate(total=Count('id')).order_by()
+    for fish_name, year, month, total in catches:
+        add_monthly_catch(fish_name, old_prefecture, year, month, -total)
+        add_monthly_catch(fish_name, instance.prefecture, year, month, total)
+
+
+@receiver(post_save, sender=Trip)
+def update_trip_search_vector(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_search_vector(instance)
+
+
+@receiver(post_save, sender=Trip)
+def enqueue_trip_fan_out(sender, instance, created, raw=False, **kwargs):
+    # 新しい釣行はフォロワーのタイムラインへリクエストの外で書き込む
+    # 画像の後処理と同じく、ロールバックされた釣行やコミット前の行をジョブが読まないようにコミット後に積む
+    if created and not raw:
+        trip_id = instance.pk
+        transaction.on_commit(lambda: enqueue('trips.fan_out_trip', trip_id=trip_id))
+
+
+@receiver(post_save, sender=Connection)
+def enqueue_follow_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        payload = {'owner_id': instance.follower_id, 'followed_id': instance.followed_id}
+        transaction.on_commit(lambda: enqueue('trips.follow_timeline', **payload))
+
+
+@receiver(post_delete, sender=Connection)
+def enqueue_unfollow_timeline(sender, instance, **kwargs):
+    payload = {'owner_id': instance.follower_id, 'followed_id': instance.followed_id}
+    transaction.on_commit(lambda: enqueue('trips.unfollow_timeline', **payload))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_commented_trip(sender, instance, raw=False, **kwargs):
+    # 釣果の変更はrefresh_listingで更新日時が進む。コメントはここで進める
+    if not raw:
+        touch_trip(instance.trip_id)
+
+
+@receiver(pre_save, sender=get_user_model())
+def remember_username(sender, instance, raw=False, update_fields=None, **kwargs):
+    # ログイン時のlast_loginの保存などユーザー名を含まない保存では調べない
+    instance._old_username = None
+    if raw or instance.pk is None or (update_fields is not None and 'username' not in update_fields):
+        return
+    instance._old_username = sender.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=get_user_model())
+def touch_renamed_user_trips(sender, instance, raw=False, **kwargs):
+    # ユーザー名はキャッシュのキー(更新日時)に含まれないので、変わったら関係する釣行のキャッシュを使われないようにする
+    old_username = getattr(instance, '_old_username', None)
+    if not raw and old_username is not None and old_username != instance.username:
+        touch_user_trips(instance.pk)
@@ -0,0 +1,56 @@
+from django.db.models import Sum
+
+from .models import MonthlyCatch
+from .prefectures import choice_prefectures
+
+PREFECTURES = [value for value, label in choice_prefectures if value]
+MONTHS = list(range(1, 13))
+
+
+def catches(fish_name='', prefecture='', year=None):
+    # 集計はすべて年月別の集計テーブル(MonthlyCatch)から求め、釣果は数えない
+    rows = MonthlyCatch.objects.filter(count__gt=0)
+    if fish_name:
+        rows = rows.filter(fish_name=fish_name)
+    if prefecture:
+        rows = rows.filter(prefecture=prefecture)
+    if year is not None:
+        rows = rows.filter(year=year)
+    return rows
+
+
+def top_species(prefecture='', year=None, limit=10):
+    rows = catches(prefecture=prefecture, year=year).values_list('fish_name').annotate(
+        total=Sum('count')).order_by('-total', 'fish_name')[:limit]
+    return [{'fish_name': fish_name, 'count': total} for fish_name, total in rows]
+
+
+def top_species_by_prefecture(year=None, limit=5):
+    # 都道府県ごとの上位の魚種。1回の集計で全都道府県分を作る
+    rows = catches(year=year).values_list('prefecture', 'fish_name').annotate(
+        total=Sum('count')).order_by('prefecture', '-total', 'fish_name')
+    ranking = {prefecture: [] for prefecture in PREFECTURES}
+    for prefecture, fish_name, total in rows:
+        species = ranking.get(prefecture)
+        if species is not None and len(species) < limit:
+            species.append({'fish_name': fish_name, 'count': total})
+    return [{'prefecture': prefecture, 'species': ranking[prefecture]} for prefecture in PREFECTURES]
+
+
+def seasonality(fish_name='', year=None):
+    # 都道府県×月の釣果数(ヒートマップ用)。行は都道府県の並び順
+    rows = catches(fish_name, year=year).values_list('prefecture', 'month').annotate(total=Sum('count')).order_by()
+    counts = {prefecture: [0] * len(MONTHS) for prefecture in PREFECTURES}
+    for prefecture, month, total in rows:
+        if prefecture in counts:
+            counts[prefecture][month - 1] = total
+    return {
+        'months': MONTHS,
+        'rows': [{'prefecture': prefecture, 'counts': counts[prefecture]} for prefecture in PREFECTURES],
+        'max': max((max(row) for row in counts.values()), default=0),
+    }
+
+
+def yearly(fish_name='', prefecture=''):
+    rows = catches(fish_name, prefecture).values_list('year').annotate(total=Sum('count')).order_by('year')
+    return [{'year': year, 'count': total} for year, total in rows]
@@ -0,0 +1,80 @@
+import bisect
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import MonthlyCatch
+from .normalize import normalize_fish_name
+
+
+class FishNameIndex:
+    # 魚名の補完候補をプロセスのメモリで引くための、ソート済みの魚名のリストと釣果数
+    # 前方一致する魚名はbisectで探した位置から連続して並んでいる
+
+    def __init__(self):
+        self.names = []
+        self.counts = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def load(self, counts):
+        names = sorted(name for name, count in counts.items() if count > 0)
+        with self.lock:
+            self.counts = {name: counts[name] for name in names}
+            self.names = names
+            self.loaded_at = time.monotonic()
+
+    def load_from_db(self):
+        # 釣果の魚名ごとの件数は集計テーブルの合計と同じなので、釣果を数えずに済む
+        self.load(dict(MonthlyCatch.objects.values_list('fish_name').annotate(total=Sum('count')).order_by()))
+
+    def clear(self):
+        with self.lock:
+            self.names = []
+            self.counts = {}
+            self.loaded_at = None
+
+    def is_stale(self):
+        # 他のプロセスで保存された釣果は届かないので、FISH_INDEX_TTL秒ごとに読み直す
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > settings.FISH_INDEX_TTL
+
+    def add(self, fish_name, delta):
+        # 釣果の保存・削除のたびに件数を増減する。読み込む前なら次の読み込みに任せる
+        with self.lock:
+            if self.loaded_at is None:
+                return
+            count = self.counts.get(fish_name, 0) + delta
+            if count > 0:
+                if fish_name not in self.counts:
+                    bisect.insort(self.names, fish_name)
+                self.counts[fish_name] = count
+            elif fish_name in self.counts:
+                del self.counts[fish_name]
+                del self.names[bisect.bisect_left(self.names, fish_name)]
+
+    def lookup(self, prefix, limit):
+        # 前方一致する魚名を釣果の多い順にlimit件返す
+        with self.lock:
+            start = bisect.bisect_left(self.names, prefix)
+            # 前方一致する範囲の終わりは、prefixの後ろに最大の文字を付けた位置
+            end = bisect.bisect_right(self.names, prefix + '\U0010ffff', start)
+            matches = [(self.counts[name], name) for name in self.names[start:end]]
+        return [name for count, name in heapq.nsmallest(limit, matches, key=lambda m: (-m[0], m[1]))]
+
+    def __len__(self):
+        return len(self.names)
+
+
+fish_name_index = FishNameIndex()
+
+
+def suggest(prefix, limit):
+    prefix = normalize_fish_name(prefix)
+    if not prefix:
+        return []
+    if fish_name_index.is_stale():
+        fish_name_index.load_from_db()
+    return fish_name_index.lookup(prefix, limit)
@@ -0,0 +1,14 @@
+from django import template
+
+from trips import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(image, widths, ext='jpg'):
+    # ImageFieldの値またはファイル名と、作成済みのサムネイルの幅(thumbnail_widths)からsrcset属性の値を作る
+    name = getattr(image, 'name', image)
+    if not name or not widths:
+        return ''
+    return thumbnails.srcset(name, widths, ext)
@@ -84,13 +84,24 @@ class TestTripFindView(TestCase):
         form = TripFindForm(self.data)
         self.assertTrue(form.is_valid())
     
+    def test_form_normalizes_fish_name(self):
+        # ひらがな・半角カナはカタカナにそろえて通過する
+        for value in ('かれい', 'ｶﾚｲ', ' カレイ '):
+            self.data['keyword_fish_name'] = value
+            form = TripFindForm(self.data)
+            self.assertTrue(form.is_valid())
+            self.assertEqual(form.cleaned_data['keyword_fish_name'], 'カレイ')
+        # 魚名がなくてもキーワードがあれば通過する
+        form = TripFindForm({'keyword_fish_name': '', 'keyword': '堤防'})
+        self.assertTrue(form.is_valid())
+
     def test_form_wrong_find(self):
         # keyword_fish_nameの値が空白ではエラーが起こる
         self.data['keyword_fish_name'] = ''
         form = TripFindForm(self.data)
         self.assertFalse(form.is_valid())
-        # keyword_fish_nameの値がひらがなではエラーが起こる
-        self.data['keyword_fish_name'] = 'かれい'
+        # keyword_fish_nameもkeywordも空白ではエラーが起こる
+        self.data['keyword'] = '   '
         form = TripFindForm(self.data)
         self.assertFalse(form.is_valid())
         # keyword_fish_nameの値がアルファベットではエラーが起こる
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+from django.test import SimpleTestCase
+
+from trips import graph
+
+
+class TestGraph(SimpleTestCase):
+    def setUp(self):
+        graph.render_png.cache_clear()
+        graph.render_svg.cache_clear()
+        self.counts = [2, 0, 2, 0, 0, 0, 0, 0, 0, 0, 0, 1]
+
+    def test_chart_png(self):
+        # PNG画像が生成され、同じ分布では再描画せずキャッシュを使う
+        png = graph.chart_png(self.counts)
+        self.assertTrue(png.startswith(b'\x89PNG'))
+        self.assertEqual(graph.chart_png(list(self.counts)), png)
+        self.assertEqual(graph.render_png.cache_info().hits, 1)
+        self.assertEqual(graph.render_png.cache_info().misses, 1)
+
+    def test_chart_svg(self):
+        # 12本の棒と件数ラベルを持つSVGが生成される
+        svg = graph.chart_svg(self.counts)
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertEqual(svg.count('<rect'), 12)
+        self.assertIn('>2</text>', svg)
+        # 全て0件でもゼロ除算にならない
+        self.assertEqual(graph.chart_svg([0] * 12).count('<rect'), 12)
+
+    def test_urls_do_not_import_matplotlib(self):
+        # URLconf(全ビュー)を読み込んでもmatplotlib・NumPyは読み込まれない。他のテストの影響を受けないよう別プロセスで確かめる
+        code = ('import django; django.setup(); import config.urls, sys; '
+                'print(",".join(name for name in ("matplotlib", "numpy") if name in sys.modules))')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        self.assertEqual(output.strip(), '')
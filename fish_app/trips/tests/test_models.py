@@ -0,0 +1,73 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from trips.models import MonthlyCatch, Result, Trip
+
+
+def old_histogram(fish_name, prefecture=''):
+    # 集計テーブル導入前のsearchビューと同じ方法で月別の件数を数える
+    results = Result.objects.filter(fish_name=fish_name)
+    if prefecture:
+        results = results.filter(trip__prefecture=prefecture)
+    result_list = list(results.values_list('created_at__month', flat=True))
+    return [result_list.count(i) for i in range(1, 13)]
+
+
+class TestMonthlyCatch(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='testuser',
+            email='test@email.com',
+            password='testpass123',
+        )
+        self.trip1 = Trip.objects.create(title='testtitle1', prefecture='北海道', content='投稿本文1', user=self.user)
+        self.trip2 = Trip.objects.create(title='testtitle2', prefecture='沖縄県', content='投稿本文2', user=self.user)
+        for month, trip, fish_name in [
+            (1, self.trip1, 'アジ'), (1, self.trip1, 'アジ'), (3, self.trip1, 'アジ'),
+            (3, self.trip2, 'アジ'), (12, self.trip2, 'アジ'), (5, self.trip2, 'サバ'),
+        ]:
+            self.create_result(month, trip, fish_name)
+
+    def create_result(self, month, trip, fish_name):
+        # created_atはauto_nowなので保存時刻を差し替えて月を指定する
+        with mock.patch('django.utils.timezone.now', return_value=datetime.datetime(2021, month, 10, 12, 0)):
+            return Result.objects.create(fish_name=fish_name, trip=trip)
+
+    def assert_matches_old(self):
+        for fish_name in ['アジ', 'サバ', 'カレイ']:
+            for prefecture in ['', '北海道', '沖縄県', '東京都']:
+                self.assertEqual(
+                    MonthlyCatch.objects.histogram(fish_name, prefecture), old_histogram(fish_name, prefecture))
+
+    def test_histogram_matches_old_code_path(self):
+        self.assertEqual(MonthlyCatch.objects.histogram('アジ'), [2, 0, 2, 0, 0, 0, 0, 0, 0, 0, 0, 1])
+        self.assert_matches_old()
+
+    def test_histogram_follows_result_changes(self):
+        # 魚名の変更、再保存による月の変更、削除が集計に反映される
+        result = Result.objects.filter(fish_name='サバ').get()
+        result.fish_name = 'アジ'
+        with mock.patch('django.utils.timezone.now', return_value=datetime.datetime(2021, 7, 1, 12, 0)):
+            result.save()
+        self.assert_matches_old()
+        Result.objects.filter(trip=self.trip1, created_at__month=1).first().delete()
+        self.assert_matches_old()
+        self.trip2.delete()
+        self.assert_matches_old()
+
+    def test_histogram_follows_trip_prefecture(self):
+        # 釣行の都道府県を変更すると集計も移動する
+        self.trip1.prefecture = '沖縄県'
+        self.trip1.save()
+        self.assertEqual(MonthlyCatch.objects.histogram('アジ', '北海道'), [0] * 12)
+        self.assert_matches_old()
+
+    def test_rebuild_monthly_catch(self):
+        MonthlyCatch.objects.all().delete()
+        call_command('rebuild_monthly_catch', stdout=StringIO())
+        self.assert_matches_old()
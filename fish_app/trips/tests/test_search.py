@@ -0,0 +1,116 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from trips import search
+from trips.models import MonthlyCatch, Result, Trip
+from trips.normalize import normalize_fish_name, search_terms
+from trips.suggest import FishNameIndex, fish_name_index
+
+
+class TestNormalize(TestCase):
+    def test_normalize_fish_name(self):
+        # 半角カナ・ひらがな・濁点の結合文字・空白をカタカナにそろえる
+        self.assertEqual(normalize_fish_name('ｺﾞﾏｻﾊﾞ'), 'ゴマサバ')
+        self.assertEqual(normalize_fish_name('ごまさば'), 'ゴマサバ')
+        self.assertEqual(normalize_fish_name('ゴマ サバ'), 'ゴマサバ')
+
+    def test_search_terms(self):
+        # 日本語は2文字ずつ、英数字は単語ごとに区切る
+        self.assertEqual(search_terms('さば釣り GT'), ['サバ', 'バ釣', '釣リ', 'gt'])
+        self.assertEqual(search_terms('鯛'), ['鯛'])
+
+
+class TestFishNameIndex(TestCase):
+    def test_lookup(self):
+        # 前方一致する魚名を釣果の多い順に返し、件数が0になった魚名は消す
+        index = FishNameIndex()
+        index.load({'マサバ': 3, 'マダイ': 5, 'マグロ': 0, 'サバ': 9})
+        self.assertEqual(index.lookup('マ', 10), ['マダイ', 'マサバ'])
+        self.assertEqual(index.lookup('マ', 1), ['マダイ'])
+        index.add('マアジ', 1)
+        index.add('マダイ', -5)
+        self.assertEqual(index.lookup('マ', 10), ['マサバ', 'マアジ'])
+        self.assertEqual(index.names, ['サバ', 'マアジ', 'マサバ'])
+        self.assertEqual(index.lookup('ア', 10), [])
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        fish_name_index.clear()
+        self.user = get_user_model().objects.create_user(
+            username='testuser', email='test@email.com', password='testpass123')
+        self.trip1 = Trip.objects.create(title='堤防で釣り', prefecture='北海道', content='朝まずめに回遊', user=self.user)
+        self.trip2 = Trip.objects.create(title='船釣り', prefecture='東京都', content='堤防より沖が良い', user=self.user)
+        Result.objects.create(fish_name='マサバ', trip=self.trip1)
+        Result.objects.create(fish_name='ゴマサバ', trip=self.trip1)
+        Result.objects.create(fish_name='サバ', trip=self.trip2)
+        Result.objects.create(fish_name='カサゴ', trip=self.trip2)
+
+    def test_fish_name_candidates(self):
+        # 入力を含む魚名を、完全一致・前方一致の順に返す
+        names = [row['fish_name'] for row in search.fish_name_candidates('さば')]
+        self.assertEqual(names, ['サバ', 'ゴマサバ', 'マサバ'])
+        # 含まれなければ表記の近い魚名を「もしかして」として返す
+        self.assertEqual(search.fish_name_candidates('カサコ'), [])
+        self.assertEqual([row['fish_name'] for row in search.similar_fish_names('カサコ')], ['カサゴ'])
+
+    def test_search_view_partial_fish_name(self):
+        # 部分一致した魚名の釣果をまとめて表示する
+        response = self.client.get(reverse('search'), {'keyword_fish_name': 'ｻﾊﾞ'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total'], 3)
+        self.assertEqual({result['fish_name'] for result in response.context['results']}, {'サバ', 'マサバ', 'ゴマサバ'})
+        # ログイン状態で内容が変わるので、共有キャッシュには置かせない
+        self.assertIn('private', response['Cache-Control'])
+        response = self.client.get(reverse('search'), {'keyword_fish_name': 'カサコ'})
+        self.assertEqual(len(response.context['results']), 0)
+        self.assertContains(response, 'もしかして')
+
+    def test_search_view_keyword(self):
+        # タイトルに一致する釣行を、内容だけに一致する釣行より先に表示する
+        response = self.client.get(reverse('search'), {'keyword': '堤防'})
+        self.assertEqual(response.context['trips'], [self.trip1, self.trip2])
+        # 魚名と組み合わせると、その魚の釣果がある釣行だけに絞る
+        response = self.client.get(reverse('search'), {'keyword': '堤防', 'keyword_fish_name': 'カサゴ'})
+        self.assertEqual(response.context['trips'], [self.trip2])
+
+    def test_suggest(self):
+        # 前方一致する魚名を釣果の多い順に返す
+        Result.objects.create(fish_name='マサバ', trip=self.trip2)
+        response = self.client.get(reverse('search_suggest'), {'q': 'ま'})
+        self.assertEqual(response.json(), {'suggestions': ['マサバ']})
+        response = self.client.get(reverse('search_suggest'), {'q': ''})
+        self.assertEqual(response.json(), {'suggestions': []})
+
+
+@override_settings(FISH_INDEX_TTL=60 * 60)
+class TestSuggestIndex(TransactionTestCase):
+    # 索引へはコミット後に反映するので、トランザクションを実際にコミットするTransactionTestCaseを使う
+
+    def setUp(self):
+        fish_name_index.clear()
+        user = get_user_model().objects.create_user(username='testuser', email='test@email.com', password='testpass123')
+        self.trip = Trip.objects.create(title='堤防で釣り', prefecture='北海道', content='朝まずめに回遊', user=user)
+        Result.objects.create(fish_name='マサバ', trip=self.trip)
+
+    def test_suggest_follows_result_changes(self):
+        # 読み込んだ後の釣果の保存・削除は、データベースを読み直さずに索引へ反映する
+        self.assertEqual(search.suggest_fish_names('マ'), ['マサバ'])
+        result = Result.objects.create(fish_name='マダイ', trip=self.trip)
+        with self.assertNumQueries(0):
+            self.assertEqual(search.suggest_fish_names('ﾏ'), ['マサバ', 'マダイ'])
+        result.delete()
+        self.assertEqual(search.suggest_fish_names('マ'), ['マサバ'])
+
+    def test_suggest_ignores_rolled_back_changes(self):
+        # ロールバックされた保存や、集計テーブルに行のない減算は索引に反映しない
+        self.assertEqual(search.suggest_fish_names('マ'), ['マサバ'])
+        with self.assertRaises(ValueError), transaction.atomic():
+            Result.objects.create(fish_name='マダイ', trip=self.trip)
+            raise ValueError
+        self.assertEqual(search.suggest_fish_names('マ'), ['マサバ'])
+        MonthlyCatch.objects.all().delete()
+        Result.objects.get().delete()
+        self.assertEqual(fish_name_index.counts, {'マサバ': 1})
@@ -0,0 +1,67 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from trips import stats
+from trips.models import MonthlyCatch, Result, Trip
+
+
+class TestStats(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='testuser', email='test@email.com', password='testpass123')
+        self.hokkaido = Trip.objects.create(title='testtitle1', prefecture='北海道', content='投稿本文1', user=user)
+        self.okinawa = Trip.objects.create(title='testtitle2', prefecture='沖縄県', content='投稿本文2', user=user)
+        for year, month, trip, fish_name in [
+            (2020, 5, self.hokkaido, 'ホッケ'), (2021, 5, self.hokkaido, 'ホッケ'), (2021, 6, self.hokkaido, 'ホッケ'),
+            (2021, 6, self.hokkaido, 'サケ'), (2021, 1, self.okinawa, 'グルクン'), (2020, 1, self.okinawa, 'ホッケ'),
+        ]:
+            self.create_result(year, month, trip, fish_name)
+
+    def create_result(self, year, month, trip, fish_name):
+        with mock.patch('django.utils.timezone.now', return_value=datetime.datetime(year, month, 10, 12, 0)):
+            return Result.objects.create(fish_name=fish_name, trip=trip)
+
+    def test_rollups_by_year(self):
+        # 年ごとに集計し、年を省略すると全年の合計になる
+        self.assertEqual(MonthlyCatch.objects.histogram('ホッケ', '北海道', 2021)[4:6], [1, 1])
+        self.assertEqual(MonthlyCatch.objects.histogram('ホッケ', '北海道')[4:6], [2, 1])
+        self.assertEqual(stats.yearly('ホッケ'), [{'year': 2020, 'count': 2}, {'year': 2021, 'count': 2}])
+        # 再保存で年が変わると集計も移る
+        result = Result.objects.filter(fish_name='サケ').get()
+        with mock.patch('django.utils.timezone.now', return_value=datetime.datetime(2022, 6, 1, 12, 0)):
+            result.save()
+        self.assertEqual(stats.yearly('サケ'), [{'year': 2022, 'count': 1}])
+        # 全件の作り直しでも同じ結果になる
+        before = sorted(MonthlyCatch.objects.filter(count__gt=0).values_list('fish_name', 'prefecture', 'year', 'month', 'count'))
+        call_command('rebuild_monthly_catch', stdout=StringIO())
+        self.assertEqual(sorted(MonthlyCatch.objects.values_list('fish_name', 'prefecture', 'year', 'month', 'count')), before)
+
+    def test_species_endpoint(self):
+        response = self.client.get(reverse('stats_species'), {'prefecture': '北海道'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['species'], [{'fish_name': 'ホッケ', 'count': 3}, {'fish_name': 'サケ', 'count': 1}])
+        # 都道府県を省略すると全都道府県の上位の魚種を返す
+        response = self.client.get(reverse('stats_species'), {'year': 2021, 'limit': 1})
+        prefectures = {row['prefecture']: row['species'] for row in response.json()['prefectures']}
+        self.assertEqual(len(prefectures), 47)
+        self.assertEqual(prefectures['北海道'], [{'fish_name': 'ホッケ', 'count': 2}])
+        self.assertEqual(prefectures['沖縄県'], [{'fish_name': 'グルクン', 'count': 1}])
+        self.assertEqual(prefectures['東京都'], [])
+        # 不正な条件は400
+        self.assertEqual(self.client.get(reverse('stats_species'), {'prefecture': '北海'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('stats_species'), {'year': 'abc'}).status_code, 400)
+
+    def test_seasonality_endpoint(self):
+        response = self.client.get(reverse('stats_seasonality'), {'fish': 'ほっけ'})
+        data = response.json()
+        self.assertEqual(data['fish_name'], 'ホッケ')
+        rows = {row['prefecture']: row['counts'] for row in data['rows']}
+        self.assertEqual(rows['北海道'], [0, 0, 0, 0, 2, 1, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(rows['沖縄県'], [1] + [0] * 11)
+        self.assertEqual(data['max'], 2)
+        self.assertIn('max-age', response['Cache-Control'])
@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from jobs.queue import run_pending
+from trips.models import Result, Trip
+from trips.thumbnails import thumbnail_name, thumbnail_names
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_image(name='fish.jpg', size=(1200, 800)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (0, 120, 200)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestThumbnails(TransactionTestCase):
+    # 不要になったサムネイルはon_commitで消すので、トランザクションを実際にコミットするTransactionTestCaseを使う
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='testuser',
+            email='test@email.com',
+            password='testpass123',
+        )
+        self.trip = Trip.objects.create(title='testtitle', prefecture='北海道', content='投稿本文', user=self.user)
+        # 釣行の投稿で積まれたタイムラインのジョブを先に済ませておく
+        run_pending()
+
+    def test_thumbnails_created_on_upload(self):
+        # アップロード直後は処理待ちで、詳細ページにはプレースホルダーが表示される
+        result = Result.objects.create(fish_name='アジ', image=make_image(size=(3000, 2000)), trip=self.trip)
+        self.assertFalse(result.image_ready)
+        response = self.client.get(reverse('trip_detail', args=[self.trip.id]))
+        self.assertContains(response, '画像を処理しています')
+        self.assertNotContains(response, result.image.name)
+        # ジョブの実行後、各幅のJPEGとWebPのサムネイルが元画像の隣に作られる
+        uploaded = result.image.name
+        self.assertEqual(run_pending(), 1)
+        result.refresh_from_db()
+        self.assertTrue(result.image_ready)
+        self.assertEqual(len(result.image_hash), 64)
+        # 処理後の画像はハッシュを付けた別の名前で保存し、元の画像は消す(/media/はブラウザにキャッシュされるため)
+        self.assertEqual(result.image.name, '{}_{}.jpg'.format(os.path.splitext(uploaded)[0], result.image_hash[:12]))
+        self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, uploaded)))
+        self.assertEqual(result.thumbnail_widths, '320,640')
+        with Image.open(os.path.join(MEDIA_ROOT, result.image.name)) as image:
+            self.assertEqual(image.size, (2048, 1365))
+        for name in thumbnail_names(result.image.name, result.thumbnail_widths):
+            self.assertTrue(os.path.exists(os.path.join(MEDIA_ROOT, name)), name)
+        with Image.open(os.path.join(MEDIA_ROOT, thumbnail_name(result.image.name, 320, 'webp'))) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 213))
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.cover_image, result.image.name)
+        # 一覧と詳細ページはsrcsetでサムネイルを参照する
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, thumbnail_name(result.image.name, 320, 'webp') + ' 320w')
+        response = self.client.get(reverse('trip_detail', args=[self.trip.id]))
+        self.assertContains(response, thumbnail_name(result.image.name, 640, 'jpg') + ' 640w')
+
+    def test_srcset_uses_written_widths(self):
+        # 元画像より広いサムネイルは作らず、元画像の幅の1つだけをsrcsetに出す
+        result = Result.objects.create(fish_name='アジ', image=make_image(size=(200, 150)), trip=self.trip)
+        run_pending()
+        result.refresh_from_db()
+        self.assertEqual(result.thumbnail_widths, '200')
+        response = self.client.get(reverse('trip_detail', args=[self.trip.id]))
+        self.assertContains(response, thumbnail_name(result.image.name, 200, 'webp') + ' 200w')
+        self.assertNotContains(response, '320w')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, thumbnail_name(result.image.name, 200, 'jpg') + ' 200w')
+
+    def test_no_srcset_without_thumbnails(self):
+        # サムネイルを作っていない画像(バックフィル前・作成の失敗)はsrcsetを出さず、元画像だけを表示する
+        result = Result.objects.create(fish_name='アジ', image=make_image(), trip=self.trip)
+        run_pending()
+        Result.objects.filter(pk=result.pk).update(thumbnail_widths='')
+        self.trip.refresh_listing()
+        result.refresh_from_db()
+        for url in (reverse('trip_detail', args=[self.trip.id]), reverse('index')):
+            response = self.client.get(url)
+            self.assertContains(response, result.image.url)
+            self.assertNotContains(response, 'srcset')
+
+    def test_thumbnails_deleted_with_result(self):
+        # 画像の差し替え・釣果の削除で、使われなくなったサムネイルを消す
+        result = Result.objects.create(fish_name='アジ', image=make_image(), trip=self.trip)
+        run_pending()
+        result.refresh_from_db()
+        old_thumbnails = thumbnail_names(result.image.name, result.thumbnail_widths)
+        result.image = make_image('other.jpg')
+        result.save()
+        for name in old_thumbnails:
+            self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, name)), name)
+        run_pending()
+        result.refresh_from_db()
+        thumbnails = thumbnail_names(result.image.name, result.thumbnail_widths)
+        self.assertEqual(len(thumbnails), 4)
+        result.delete()
+        for name in thumbnails:
+            self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, name)), name)
+
+    def test_make_thumbnails_command(self):
+        # 既存の画像のサムネイルを管理コマンドで後から作れる
+        result = Result.objects.create(fish_name='アジ', image=make_image(), trip=self.trip)
+        run_pending()
+        result.refresh_from_db()
+        Result.objects.filter(pk=result.pk).update(thumbnail_widths='')
+        for name in thumbnail_names(result.image.name, '320,640'):
+            os.remove(os.path.join(MEDIA_ROOT, name))
+        out = StringIO()
+        call_command('make_thumbnails', '--workers', '1', stdout=out)
+        self.assertIn('作成: 1件', out.getvalue())
+        result.refresh_from_db()
+        self.assertEqual(result.thumbnail_widths, '320,640')
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.cover_thumbnail_widths, '320,640')
+        for name in thumbnail_names(result.image.name, result.thumbnail_widths):
+            self.assertTrue(os.path.exists(os.path.join(MEDIA_ROOT, name)), name)
+        out = StringIO()
+        call_command('make_thumbnails', '--workers', '1', stdout=out)
+        self.assertIn('作成済み: 1件', out.getvalue())
@@ -0,0 +1,89 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from accounts import social
+from trips.models import TimelineEntry, Trip
+from trips.views import TIMELINE_PAGE_SIZE
+
+
+@override_settings(JOBS_EAGER=True, TIMELINE_LENGTH=5, TIMELINE_TRIM_SLACK=0, TIMELINE_READ_THRESHOLD=2)
+class TestTimeline(TransactionTestCase):
+    # タイムラインのジョブはコミット後に積むので、トランザクションを実際にコミットするTransactionTestCaseを使う
+    def setUp(self):
+        User = get_user_model()
+        self.reader = User.objects.create_user(username='reader', email='reader@email.com', password='testpass123')
+        self.author = User.objects.create_user(username='author', email='author@email.com', password='testpass123')
+        self.other = User.objects.create_user(username='other', email='other@email.com', password='testpass123')
+        social.follow(self.reader, self.author)
+
+    def create_trip(self, user, title):
+        return Trip.objects.create(title=title, prefecture='北海道', content='投稿本文', user=user)
+
+    def timeline_titles(self):
+        self.client.login(email='reader@email.com', password='testpass123')
+        response = self.client.get(reverse('timeline'))
+        self.assertEqual(response.status_code, 200)
+        return [trip.title for trip in response.context['trips']]
+
+    def test_trips_are_fanned_out_to_followers(self):
+        self.create_trip(self.author, 'フォロー中の投稿')
+        self.create_trip(self.other, 'フォローしていない投稿')
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.reader).count(), 1)
+        self.assertEqual(self.timeline_titles(), ['フォロー中の投稿'])
+
+    def test_fan_out_runs_after_commit(self):
+        # コミットされるまでタイムラインには書き込まず、ロールバックされた釣行・フォローは反映しない
+        self.create_trip(self.other, 'フォローしていない投稿')
+        with transaction.atomic():
+            self.create_trip(self.author, 'コミット後に届く投稿')
+            self.assertFalse(TimelineEntry.objects.filter(owner=self.reader).exists())
+        self.assertEqual(self.timeline_titles(), ['コミット後に届く投稿'])
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.create_trip(self.author, 'ロールバックされた投稿')
+            raise ValueError
+        with self.assertRaises(ValueError), transaction.atomic():
+            social.follow(self.reader, self.other)
+            raise ValueError
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.reader).count(), 1)
+
+    def test_follow_and_unfollow_update_timeline(self):
+        self.create_trip(self.other, '以前の投稿')
+        # フォローすると相手の過去の投稿が入り、外すと消える
+        social.follow(self.reader, self.other)
+        self.assertEqual(self.timeline_titles(), ['以前の投稿'])
+        social.unfollow(self.reader, self.other)
+        self.assertEqual(self.timeline_titles(), [])
+
+    def test_timeline_is_trimmed(self):
+        for i in range(7):
+            self.create_trip(self.author, '投稿{}'.format(i))
+        entries = TimelineEntry.objects.filter(owner=self.reader).order_by('-created_at', '-trip_id')
+        self.assertEqual([entry.trip.title for entry in entries], ['投稿{}'.format(i) for i in range(6, 1, -1)])
+
+    def test_heavy_followers_read_on_demand(self):
+        # フォロー数がTIMELINE_READ_THRESHOLDを超えたユーザーには書き込まず、表示時に引く
+        social.follow(self.reader, self.other)
+        third = get_user_model().objects.create_user(username='third', email='third@email.com')
+        social.follow(self.reader, third)
+        self.create_trip(third, '表示時に引く投稿')
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.reader, trip__user=third).exists())
+        self.assertEqual(self.timeline_titles(), ['表示時に引く投稿'])
+        # 上限を下回ったら書き込み済みのタイムラインに戻る
+        social.unfollow(self.reader, self.other)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.reader, trip__user=third).exists())
+        self.assertEqual(self.timeline_titles(), ['表示時に引く投稿'])
+
+    def test_timeline_pages(self):
+        with self.settings(TIMELINE_LENGTH=50):
+            for i in range(TIMELINE_PAGE_SIZE + 1):
+                self.create_trip(self.author, '投稿{}'.format(i))
+        self.client.login(email='reader@email.com', password='testpass123')
+        response = self.client.get(reverse('timeline'))
+        self.assertEqual(len(response.context['trips']), TIMELINE_PAGE_SIZE)
+        response = self.client.get(reverse('timeline') + response.context['next_url'])
+        self.assertEqual([trip.title for trip in response.context['trips']], ['投稿0'])
+        # ログインしていなければログインページへ
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('timeline')).status_code, 302)
@@ -0,0 +1,100 @@
+import datetime
+import io
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase
+from django.urls import reverse
+
+from trips import transfer
+from trips.models import Comment, MonthlyCatch, Result, Trip
+
+
+class TestTransfer(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='testuser', email='test@email.com', password='testpass123')
+        self.staff = User.objects.create_user(username='staff', email='staff@email.com', password='testpass123', is_staff=True)
+        self.trip = Trip.objects.create(title='堤防で釣り', prefecture='北海道', content='投稿本文', user=self.user)
+        Result.objects.create(fish_name='ホッケ', trip=self.trip)
+        Result.objects.create(fish_name='サケ', trip=self.trip)
+        Comment.objects.create(content='コメント', trip=self.trip, user=self.staff)
+        Trip.objects.create(title='ボウズ', prefecture='東京都', content='釣れず', user=self.staff)
+
+    def export(self, format):
+        output = io.StringIO()
+        call_command('export_trips', format=format, stdout=output)
+        return output.getvalue()
+
+    def import_text(self, text, format):
+        return transfer.import_records(transfer.read_records(io.StringIO(text), format), batch_size=1)
+
+    def test_jsonl_round_trip(self):
+        exported = self.export('jsonl')
+        records = [json.loads(line) for line in exported.splitlines()]
+        self.assertEqual(len(records), 2)
+        self.assertEqual([result['fish_name'] for result in records[0]['results']], ['ホッケ', 'サケ'])
+        self.assertEqual(records[0]['comments'][0]['user'], 'staff')
+        # 削除してから取り込むと、日時も含めて同じ内容に戻る
+        Trip.objects.all().delete()
+        report = self.import_text(exported, 'jsonl')
+        self.assertEqual((report.trips, report.results, report.comments, report.errors), (2, 2, 1, []))
+        imported = [json.loads(line) for line in self.export('jsonl').splitlines()]
+        for record in records + imported:
+            del record['id']
+        self.assertEqual(imported, records)
+        # シグナルを通らない分の一覧用の値と集計も更新される
+        trip = Trip.objects.get(title='堤防で釣り')
+        self.assertEqual(trip.fish_summary, 'ホッケ サケ')
+        self.assertEqual(sum(MonthlyCatch.objects.histogram('ホッケ', '北海道')), 1)
+
+    def test_failed_batch_keeps_committed_catches(self):
+        # 途中のバッチで失敗しても、それまでに取り込んだ釣行の釣果は集計に入っている
+        exported = self.export('jsonl')
+        Trip.objects.all().delete()
+        bulk_create = Comment.objects.bulk_create
+
+        def fail_without_comments(objs, **kwargs):
+            if not objs:
+                raise DatabaseError('failed')
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Comment.objects, 'bulk_create', side_effect=fail_without_comments):
+            with self.assertRaises(DatabaseError):
+                self.import_text(exported, 'jsonl')
+        self.assertEqual(list(Trip.objects.values_list('title', flat=True)), ['堤防で釣り'])
+        self.assertEqual(sum(MonthlyCatch.objects.histogram('ホッケ', '北海道')), 1)
+
+    def test_csv_import_validates_fish_names(self):
+        self.assertEqual(self.export('csv').splitlines()[0], ','.join(transfer.CSV_COLUMNS))
+        text = '\n'.join([
+            ','.join(transfer.CSV_COLUMNS),
+            '1,testuser,磯釣り,静岡県,内容,2019-04-01T06:00:00,めじな,,2019-04-01T07:00:00',
+            '1,testuser,磯釣り,静岡県,内容,2019-04-01T06:00:00,ｶﾜﾊｷﾞ,,',
+            '2,testuser,ローマ字,静岡県,内容,,karei,,',
+            '3,nobody,知らない人,静岡県,内容,,アジ,,',
+            '4,testuser,場所違い,静岡,内容,,アジ,,',
+        ])
+        report = self.import_text(text, 'csv')
+        self.assertEqual((report.trips, report.results), (1, 2))
+        self.assertEqual([line for line, message in report.errors], [4, 5, 6])
+        trip = Trip.objects.get(title='磯釣り')
+        self.assertEqual(trip.created_at, datetime.datetime(2019, 4, 1, 6, 0))
+        self.assertEqual(list(trip.result_set.order_by('id').values_list('fish_name', flat=True)), ['メジナ', 'カワハギ'])
+        self.assertEqual(MonthlyCatch.objects.histogram('メジナ', '静岡県', 2019)[3], 1)
+
+    def test_export_endpoint(self):
+        # スタッフ以外は管理画面のログインへ
+        self.client.login(email='test@email.com', password='testpass123')
+        self.assertEqual(self.client.get(reverse('export')).status_code, 302)
+        self.client.login(email='staff@email.com', password='testpass123')
+        response = self.client.get(reverse('export'), {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('trips.csv', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(self.client.get(reverse('export'), {'format': 'xml'}).status_code, 400)
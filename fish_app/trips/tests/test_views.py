@@ -1,12 +1,35 @@
 import datetime
+import importlib
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
 from django.http import response
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
-from django.urls import reverse
+from django.core.cache import cache
+from django.urls import Resolver404, resolve, reverse
+
+import config.urls
 
 from trips.forms import  TripFindForm
+from trips.jobs import process_result_image
 from trips.models import Trip, Result, Comment
+from trips.paginator import encode_cursor, estimated_count
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
 
+def process_images():
+    # 画像の後処理はコミット後に積まれ、TestCaseではコミットされないので、ワーカーの代わりにここで実行する
+    for result_id in Result.objects.filter(image_ready=False).values_list('id', flat=True):
+        process_result_image(result_id)
+
+
+# ジョブはその場で実行する
+@override_settings(JOBS_EAGER=True)
 class TestViews(TestCase):
     def setUp(self):
         self.user1 = get_user_model().objects.create_user(
@@ -43,6 +66,7 @@ class TestViews(TestCase):
             image='testimage2.jpg',
             trip=self.trip2
         )
+        process_images()
         self.comment1 = Comment.objects.create(
             content='コメント本文1',
             user=self.user1,
@@ -61,6 +85,88 @@ class TestViews(TestCase):
         self.assertContains(response, 'testtitle2')
         self.assertTemplateUsed(response, 'trips/index.html')
     
+    def test_listing_views_query_count(self):
+        # 一覧ページのクエリ数は表示件数によらず一定。総件数はキャッシュするので2回目からはCOUNTしない
+        cache.clear()
+        for i in range(6):
+            trip = Trip.objects.create(title=f'listing{i}', prefecture='北海道', content='本文', user=self.user1)
+            Result.objects.create(fish_name='アジ', image=f'listing{i}.jpg', trip=trip)
+            Result.objects.create(fish_name='サバ', trip=trip)
+        process_images()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'アジ サバ')
+        self.assertContains(response, 'listing5.jpg')
+        with self.assertNumQueries(1):
+            self.client.get(reverse('index'))
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('user_trips', kwargs={'pk':self.user1.id}))
+        self.assertContains(response, 'アジ サバ')
+        self.assertContains(response, 'listing5.jpg')
+
+    @skipUnless(connection.vendor == 'postgresql', 'pg_classの推定値はPostgreSQLでのみ使う')
+    def test_listing_estimated_count(self):
+        # 絞り込みのない表は、閾値以上なら統計情報の推定値を1クエリで返し、その結果をキャッシュする
+        cache.clear()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE trip')
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = 'trip'")
+            reltuples = int(cursor.fetchone()[0])
+        Trip.objects.create(title='推定値には入らない', prefecture='北海道', content='本文', user=self.user1)
+        with self.settings(PAGINATOR_ESTIMATE_THRESHOLD=1), self.assertNumQueries(1):
+            self.assertEqual(estimated_count(Trip.objects.all()), reltuples)
+        with self.assertNumQueries(0):
+            self.assertEqual(estimated_count(Trip.objects.all()), reltuples)
+        # 閾値より小さければ正確に数える
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(estimated_count(Trip.objects.all()), reltuples + 1)
+
+    def test_top_view_pagination(self):
+        # 前後のページへはカーソルで移動し、ページ番号は前後5ページ分だけ表示する
+        cache.clear()
+        Trip.objects.all().delete()
+        base = datetime.datetime(2020, 1, 1)
+        for i in range(70):
+            trip = Trip.objects.create(title=f'page{i:02}', prefecture='北海道', content='本文', user=self.user1)
+            Trip.objects.filter(pk=trip.pk).update(created_at=base + datetime.timedelta(hours=i))
+        response = self.client.get(reverse('index'))
+        page = response.context['page_obj']
+        self.assertEqual([trip.title for trip in page], ['page69', 'page68', 'page67', 'page66', 'page65', 'page64'])
+        self.assertEqual(list(page.page_window), [1, 2, 3, 4, 5, 6])
+        response = self.client.get(reverse('index'), {'page': 2, 'after': page.next_cursor})
+        page = response.context['page_obj']
+        self.assertEqual(page.number, 2)
+        self.assertEqual(page[0].title, 'page63')
+        response = self.client.get(reverse('index'), {'page': 1, 'before': page.previous_cursor})
+        self.assertEqual(response.context['page_obj'][0].title, 'page69')
+        # 先頭の行より新しいカーソルで戻っても、次のページへのリンクは残り、最初のページを表示する
+        newest = response.context['page_obj'][0]
+        for before in (page.previous_cursor, encode_cursor(newest)):
+            response = self.client.get(reverse('index'), {'page': 1, 'before': before})
+            page_obj = response.context['page_obj']
+            self.assertEqual(page_obj[0].title, 'page69')
+            self.assertTrue(page_obj.has_next())
+            self.assertFalse(page_obj.has_previous())
+        # ページ番号で飛ぶときは同じ並びでOFFSETを使う
+        response = self.client.get(reverse('index'), {'page': 8})
+        page = response.context['page_obj']
+        self.assertEqual(page[0].title, 'page27')
+        self.assertEqual(list(page.page_window), [3, 4, 5, 6, 7, 8, 9, 10, 11, 12])
+        self.assertContains(response, '?page=9&after=')
+        self.assertEqual(self.client.get(reverse('index'), {'page': 20}).status_code, 404)
+
+    def test_trip_listing_follows_results(self):
+        # 釣果の追加・削除で一覧用の魚名とカバー画像が更新される
+        self.trip1.refresh_from_db()
+        self.assertEqual(self.trip1.fish_summary, 'テストウオイチ')
+        self.assertEqual(self.trip1.cover_image, 'testimage1.jpg')
+        Result.objects.create(fish_name='アジ', trip=self.trip1)
+        self.result1.delete()
+        self.trip1.refresh_from_db()
+        self.assertEqual(self.trip1.fish_summary, 'アジ')
+        self.assertFalse(self.trip1.cover_image)
+
     def test_create_view_for_logged_in_user(self):
         self.client.login(email='test1@email.com', password='testpass123')
         response = self.client.get(reverse('create'))
@@ -138,6 +244,72 @@ class TestViews(TestCase):
         self.assertNotContains(response, '編集')
         self.assertNotContains(response, '削除')
 
+    def test_trip_detail_cache(self):
+        url = reverse('trip_detail', args=[self.trip1.id])
+        self.client.get(url)
+        # 2回目以降は更新日時を確認する1クエリだけで返す
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, 'コメント本文1')
+        # コメント・釣果が変わるとキャッシュは使われない
+        Comment.objects.create(content='新しいコメント', user=self.user2, trip=self.trip1)
+        self.assertContains(self.client.get(url), '新しいコメント')
+        Result.objects.create(fish_name='アタラシイサカナ', trip=self.trip1)
+        self.assertContains(self.client.get(url), 'アタラシイサカナ')
+        self.comment1.delete()
+        self.assertNotContains(self.client.get(url), 'コメント本文1')
+        # キャッシュされたページがあってもログイン中の投稿者には編集ボタンが表示される
+        self.client.login(email='test1@email.com', password='testpass123')
+        self.assertContains(self.client.get(url), '編集')
+        self.client.login(email='test2@email.com', password='testpass123')
+        response = self.client.get(url)
+        self.assertNotContains(response, '編集')
+        self.assertContains(response, reverse('comment_delete', args=[Comment.objects.get(content='新しいコメント').id]))
+
+    def test_trip_detail_cache_username(self):
+        # 投稿者・コメントしたユーザーの名前が変わるとキャッシュは使われない
+        url = reverse('trip_detail', args=[self.trip1.id])
+        Comment.objects.create(content='コメント本文3', user=self.user2, trip=self.trip1)
+        self.assertContains(self.client.get(url), 'testuser2')
+        for user, username in ((self.user1, 'renamed1'), (self.user2, 'renamed2')):
+            user.username = username
+            user.save()
+            self.assertContains(self.client.get(url), username)
+
+    def test_trip_detail_query_count(self):
+        # コメントが増えてもクエリ数は変わらない
+        url = reverse('trip_detail', args=[self.trip1.id])
+        self.client.login(email='test2@email.com', password='testpass123')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        for i in range(5):
+            Comment.objects.create(content='追加のコメント{}'.format(i), user=[self.user1, self.user2][i % 2], trip=self.trip1)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertContains(response, '追加のコメント4')
+
+    def test_trip_detail_conditional_get(self):
+        # 変わっていなければETag/Last-Modifiedで304を返す
+        url = reverse('trip_detail', args=[self.trip1.id])
+        response = self.client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        # コメントが付くと版が変わる
+        Comment.objects.create(content='新しいコメント', user=self.user2, trip=self.trip1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        # ログイン中のユーザーには別のETagになる
+        self.client.login(email='test1@email.com', password='testpass123')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '編集')
+        self.assertIn('private', response['Cache-Control'])
+
     def test_comment_delete_view_for_logged_in_user(self):
         # ログイン状態でコメント投稿者は自身のコメントを削除できる
         self.client.login(email='test1@email.com', password='testpass123')
@@ -161,11 +333,10 @@ class TestViews(TestCase):
         response = self.client.get(reverse('search'))
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'trips/trip_search.html')
-        self.assertContains(response, 'csrfmiddlewaretoken')
         self.assertIsInstance(response.context['form'], TripFindForm)
         # 検索すると魚名と都道府県が一致するresultが表示される
         data={'keyword_fish_name':self.result1.fish_name, 'keyword_prefecture':'北海道'}
-        response = self.client.post(reverse('search'),data)
+        response = self.client.get(reverse('search'),data)
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, self.trip1.title)
         self.assertContains(response, self.trip1.user.username)
@@ -174,13 +345,60 @@ class TestViews(TestCase):
         self.assertContains(response, f'{created_at.year}年{created_at.month}月{created_at.day}日')
         # 検索すると魚名が一致して都道府県が一致しないresultは表示されない
         data={'keyword_fish_name':self.result1.fish_name, 'keyword_prefecture':'東京都'}
-        response = self.client.post(reverse('search'),data)
+        response = self.client.get(reverse('search'),data)
         self.assertNotContains(response, self.trip1.title)
         # 検索すると都道府県が一致して魚名が一致しないresultは表示されない
         data={'keyword_fish_name':'テストウオデハナイ', 'keyword_prefecture':self.trip1.prefecture}
-        response = self.client.post(reverse('search'),data)
+        response = self.client.get(reverse('search'),data)
         self.assertNotContains(response, self.trip1.title)
     
+    def test_search_view_pagination(self):
+        # POSTで検索するとGETの検索URLへリダイレクトされる
+        data={'keyword_fish_name':self.result1.fish_name, 'keyword_prefecture':''}
+        response = self.client.post(reverse('search'),data)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('keyword_fish_name=', response['Location'])
+        # 検索結果は新しい順にページ分割され、次ページ・前ページへ移動できる
+        for i in range(13):
+            Result.objects.create(fish_name=self.result1.fish_name, trip=self.trip1)
+        response = self.client.get(reverse('search'),data)
+        self.assertEqual(response.context['total'], 14)
+        self.assertEqual(len(response.context['results']), 12)
+        self.assertIsNone(response.context['previous_url'])
+        first_page = [result['id'] for result in response.context['results']]
+        response = self.client.get(reverse('search') + response.context['next_url'])
+        second_page = [result['id'] for result in response.context['results']]
+        self.assertEqual(len(second_page), 2)
+        self.assertIsNone(response.context['next_url'])
+        self.assertEqual(sorted(first_page + second_page, reverse=True), first_page + second_page)
+        response = self.client.get(reverse('search') + response.context['previous_url'])
+        self.assertEqual([result['id'] for result in response.context['results']], first_page)
+
+    def test_search_chart_view(self):
+        # 検索結果ページはグラフを画像URLで参照する
+        data={'keyword_fish_name':self.result1.fish_name, 'keyword_prefecture':'北海道'}
+        response = self.client.get(reverse('search'),data)
+        self.assertContains(response, reverse('search_chart_svg'))
+        self.assertNotContains(response, 'base64')
+        # グラフ画像はETagとCache-Control付きで返される
+        params = {'fish':self.result1.fish_name, 'pref':'北海道'}
+        response = self.client.get(reverse('search_chart'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('max-age', response['Cache-Control'])
+        etag = response['ETag']
+        response = self.client.get(reverse('search_chart_svg'), params)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertNotEqual(response['ETag'], etag)
+        # 件数が変わっていなければ304を返す
+        response = self.client.get(reverse('search_chart'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # 釣果が増えるとETagが変わる
+        Result.objects.create(fish_name=self.result1.fish_name, trip=self.trip1)
+        response = self.client.get(reverse('search_chart'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_trip_delete_view(self):
         # ログイン状態でtrip投稿者は自身の投稿を削除できる
         self.client.login(email='test1@email.com', password='testpass123')
@@ -215,4 +433,51 @@ class TestViews(TestCase):
         self.client.logout()
         response = self.client.get(reverse('update', args=[self.trip1.id]))
         self.assertEqual(response.status_code, 302)
-        self.assertRedirects(response, f'/accounts/login/?next=/trips/{self.trip1.id}/update/')
\ No newline at end of file
+        self.assertRedirects(response, f'/accounts/login/?next=/trips/{self.trip1.id}/update/')
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestMediaViews(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.makedirs(os.path.join(MEDIA_ROOT, 'images'), exist_ok=True)
+        os.makedirs(os.path.join(MEDIA_ROOT, 'private'), exist_ok=True)
+        for name in ('images/public.jpg', 'private/secret.jpg'):
+            with open(os.path.join(MEDIA_ROOT, name), 'wb') as f:
+                f.write(b'jpeg')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='testuser',
+            email='test@email.com',
+            password='testpass123',
+        )
+
+    def test_media_not_served_by_django_in_production(self):
+        # DEBUG=Falseではファイルが存在してもDjangoは/media/を配信しない(nginxが配信する)
+        with override_settings(DEBUG=False):
+            urls = importlib.reload(config.urls)
+            self.assertNotIn('media/(?P<path>.*)', [str(pattern.pattern) for pattern in urls.urlpatterns])
+            with self.assertRaises(Resolver404):
+                resolve('/media/images/public.jpg', urlconf=urls)
+        response = self.client.get('/media/images/public.jpg')
+        self.assertEqual(response.status_code, 404)
+
+    def test_private_media(self):
+        # 非公開ファイルはログインユーザーにだけX-Accel-Redirectで返す
+        response = self.client.get('/media/private/secret.jpg')
+        self.assertEqual(response.status_code, 302)
+        self.client.login(email='test@email.com', password='testpass123')
+        response = self.client.get('/media/private/secret.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/private/secret.jpg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.content, b'')
+        # 存在しないファイルやprivateの外を指すパスは404
+        self.assertEqual(self.client.get('/media/private/nothing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/private/../images/public.jpg').status_code, 404)
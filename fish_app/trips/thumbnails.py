@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# 一覧のカード(約300px)と詳細ページ・高解像度画面向けの幅
+THUMBNAIL_WIDTHS = (320, 640)
+THUMBNAIL_FORMATS = (('jpg', 'JPEG'), ('webp', 'WEBP'))
+THUMBNAIL_QUALITY = 80
+# アップロードされた元画像もこの長辺まで縮小する
+MAX_IMAGE_SIZE = 2048
+IMAGE_QUALITY = 90
+
+
+def thumbnail_name(name, width, ext):
+    # images/foo.png -> images/foo_320w.webp のように元画像の隣に置く
+    root, _ = os.path.splitext(name)
+    return '{}_{}w.{}'.format(root, width, ext)
+
+
+def parse_widths(widths):
+    # Result.thumbnail_widthsに保存した "320,640" のような値を幅のリストにする
+    return [int(width) for width in widths.split(',') if width] if widths else []
+
+
+def format_widths(widths):
+    return ','.join(str(width) for width in widths)
+
+
+def thumbnail_names(name, widths):
+    return [thumbnail_name(name, width, ext) for width in parse_widths(widths) for ext, _ in THUMBNAIL_FORMATS]
+
+
+def has_thumbnails(name, widths, storage=default_storage):
+    return bool(widths) and all(storage.exists(thumbnail) for thumbnail in thumbnail_names(name, widths))
+
+
+def delete_thumbnails(name, widths, storage=default_storage):
+    for thumbnail in thumbnail_names(name, widths):
+        storage.delete(thumbnail)
+
+
+def normalize_image(name, storage=default_storage):
+    # 向きを補正して縮小し、保存し直すことでEXIF(位置情報など)を取り除く。保存後の名前とSHA-256を返す
+    # /media/は長期間キャッシュされるので、同じ名前で上書きせず、内容のハッシュを付けた別の名前で保存する
+    with storage.open(name) as f:
+        image = Image.open(f)
+        format = image.format or 'JPEG'
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if max(image.size) > MAX_IMAGE_SIZE:
+        image.thumbnail((MAX_IMAGE_SIZE, MAX_IMAGE_SIZE), Image.LANCZOS)
+    if format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format, quality=IMAGE_QUALITY)
+    content = buffer.getvalue()
+    image_hash = hashlib.sha256(content).hexdigest()
+    root, ext = os.path.splitext(name)
+    name = storage.save('{}_{}{}'.format(root, image_hash[:12], ext), ContentFile(content))
+    return name, image_hash
+
+
+def generate_thumbnails(name, storage=default_storage):
+    # 作ったサムネイルの幅を "320,640" の形で返す。元画像より広い幅は作らず、元画像の幅で1つにまとめる
+    with storage.open(name) as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    widths = sorted({min(width, image.width) for width in THUMBNAIL_WIDTHS})
+    for width in widths:
+        if image.width > width:
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        else:
+            resized = image
+        for ext, format in THUMBNAIL_FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, format, quality=THUMBNAIL_QUALITY)
+            thumbnail = thumbnail_name(name, width, ext)
+            if storage.exists(thumbnail):
+                storage.delete(thumbnail)
+            storage.save(thumbnail, ContentFile(buffer.getvalue()))
+    return format_widths(widths)
+
+
+def make_thumbnails(name, widths='', force=False):
+    # 管理コマンドのプロセスプールからも呼ぶので、例外は投げずに(名前, 作った幅, エラー内容)を返す
+    try:
+        if not default_storage.exists(name):
+            return name, '', 'missing'
+        if force or not has_thumbnails(name, widths):
+            return name, generate_thumbnails(name), None
+        return name, widths, 'skipped'
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning('thumbnail generation failed for %s: %s', name, e)
+        return name, '', str(e)
+
+
+def srcset(name, widths, ext):
+    return ', '.join(
+        '{} {}w'.format(default_storage.url(thumbnail_name(name, width, ext)), width) for width in parse_widths(widths))
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.db.models import Count
+
+from accounts.models import Connection
+
+from .models import TimelineEntry, Trip
+from .paginator import keyset_paginate
+
+
+def reads_on_demand(user):
+    # フォロー数が多いユーザーはタイムラインを書き込まず、表示のたびにフォロー中の釣行を引く
+    return user.following_count > settings.TIMELINE_READ_THRESHOLD
+
+
+def fan_out_trip(trip):
+    # 釣行を投稿者のフォロワーのタイムラインへ書き込み、長くなったタイムラインを切り詰める
+    owner_ids = list(Connection.objects.filter(
+        followed_id=trip.user_id, follower__following_count__lte=settings.TIMELINE_READ_THRESHOLD,
+    ).values_list('follower_id', flat=True))
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=owner_id, trip=trip, created_at=trip.created_at) for owner_id in owner_ids],
+        batch_size=500, ignore_conflicts=True)
+    trim_timelines(owner_ids)
+    return len(owner_ids)
+
+
+def trim_timelines(owner_ids):
+    # TIMELINE_LENGTHを超えた分は、TIMELINE_TRIM_SLACK件たまってからまとめて削除する
+    length = settings.TIMELINE_LENGTH
+    long_timelines = TimelineEntry.objects.filter(owner_id__in=owner_ids).values('owner_id').annotate(
+        total=Count('id')).filter(total__gt=length + settings.TIMELINE_TRIM_SLACK).order_by()
+    for row in long_timelines:
+        entries = TimelineEntry.objects.filter(owner_id=row['owner_id'])
+        last = entries.order_by('-created_at', '-trip_id').values('created_at', 'trip_id')[length - 1]
+        entries.filter(created_at__lte=last['created_at']).exclude(
+            created_at=last['created_at'], trip_id__gte=last['trip_id']).delete()
+
+
+def add_followed_trips(owner, followed_id):
+    # フォローしたときに、相手の最近の釣行をタイムラインに入れる
+    if reads_on_demand(owner):
+        return 0
+    trips = Trip.objects.filter(user_id=followed_id).order_by('-created_at', '-id').values_list(
+        'id', 'created_at')[:settings.TIMELINE_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner=owner, trip_id=trip_id, created_at=created_at) for trip_id, created_at in trips],
+        batch_size=500, ignore_conflicts=True)
+    trim_timelines([owner.id])
+    return len(trips)
+
+
+def remove_followed_trips(owner, followed_id):
+    return TimelineEntry.objects.filter(owner=owner, trip__user_id=followed_id).delete()[0]
+
+
+def rebuild_timeline(owner):
+    TimelineEntry.objects.filter(owner=owner).delete()
+    if reads_on_demand(owner):
+        return 0
+    trips = Trip.objects.filter(user__followed__follower=owner).order_by('-created_at', '-id').values_list(
+        'id', 'created_at')[:settings.TIMELINE_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner=owner, trip_id=trip_id, created_at=created_at) for trip_id, created_at in trips],
+        batch_size=500)
+    return len(trips)
+
+
+def following_trips(user):
+    return Trip.objects.filter(user__followed__follower=user).select_related('user')
+
+
+def timeline_page(user, per_page, after=None, before=None, on_demand=None):
+    # 書き込み済みのタイムラインからページを作る。on_demandを指定すると方式を固定できる(ベンチマーク用)
+    if on_demand is None:
+        on_demand = reads_on_demand(user)
+    if on_demand:
+        return keyset_paginate(following_trips(user), per_page, after, before)
+    entries = TimelineEntry.objects.filter(owner=user).select_related('trip__user')
+    page = keyset_paginate(entries, per_page, after, before, id_field='trip_id')
+    # カーソルは(created_at, trip_id)なので、釣行に置き換えても同じ値になる
+    page.object_list = [entry.trip for entry in page.object_list]
+    return page
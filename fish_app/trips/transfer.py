@@ -0,0 +1,287 @@
+import contextlib
+import csv
+import datetime
+import itertools
+import json
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F, Max
+
+from .models import Comment, MonthlyCatch, Result, Trip
+from .normalize import normalize_fish_name
+from .prefectures import choice_prefectures
+from .suggest import fish_name_index
+
+# 書き出し・取り込みで一度に扱う釣行の数。メモリに載るのはこの件数分だけ
+CHUNK_SIZE = 500
+FORMATS = ('jsonl', 'csv')
+# CSVは釣果1件を1行にする(釣行の列は釣果ごとに繰り返す)。コメントはJSONLにだけ含める
+CSV_COLUMNS = ['trip_id', 'user', 'title', 'prefecture', 'content', 'created_at',
+               'fish_name', 'image', 'result_created_at']
+PREFECTURES = {value for value, label in choice_prefectures if value}
+
+
+@contextlib.contextmanager
+def explicit_timestamps(*models):
+    # auto_now / auto_now_add を一時的に外して、過去の日時で投入できるようにする
+    # モデルのフィールドを書き換えるので、管理コマンドなど他のリクエストと並行しない場所でだけ使う
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def chunked(iterable, size):
+    iterable = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterable, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def format_datetime(value):
+    return value.isoformat() if value else ''
+
+
+def trip_records(trips=None, chunk_size=CHUNK_SIZE):
+    # 釣行ごとに釣果とコメントをまとめた辞書を返す。釣果・コメントはCHUNK_SIZE件の釣行ごとにまとめて引く
+    if trips is None:
+        trips = Trip.objects.all()
+    rows = trips.order_by('id').values_list(
+        'id', 'user__username', 'title', 'prefecture', 'content', 'created_at').iterator(chunk_size=chunk_size)
+    for chunk in chunked(rows, chunk_size):
+        trip_ids = [row[0] for row in chunk]
+        results = {}
+        for trip_id, fish_name, image, created_at in Result.objects.filter(trip_id__in=trip_ids).order_by(
+                'trip_id', 'id').values_list('trip_id', 'fish_name', 'image', 'created_at'):
+            results.setdefault(trip_id, []).append(
+                {'fish_name': fish_name, 'image': image or '', 'created_at': format_datetime(created_at)})
+        comments = {}
+        for trip_id, username, content, created_at in Comment.objects.filter(trip_id__in=trip_ids).order_by(
+                'trip_id', 'id').values_list('trip_id', 'user__username', 'content', 'created_at'):
+            comments.setdefault(trip_id, []).append(
+                {'user': username, 'content': content, 'created_at': format_datetime(created_at)})
+        for trip_id, username, title, prefecture, content, created_at in chunk:
+            yield {
+                'id': trip_id, 'user': username, 'title': title, 'prefecture': prefecture, 'content': content,
+                'created_at': format_datetime(created_at),
+                'results': results.get(trip_id, []), 'comments': comments.get(trip_id, []),
+            }
+
+
+class LineBuffer:
+    # csv.writerの書き込み先。書いた1行をそのまま返す
+    def write(self, value):
+        return value
+
+
+def export_lines(format, trips=None):
+    # StreamingHttpResponseや標準出力にそのまま流せる文字列を1行ずつ返す
+    records = trip_records(trips)
+    if format == 'jsonl':
+        for record in records:
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+        return
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(CSV_COLUMNS)
+    for record in records:
+        trip_columns = [record[column] for column in ('id', 'user', 'title', 'prefecture', 'content', 'created_at')]
+        # 釣果のない釣行も1行出す
+        for result in record['results'] or [{'fish_name': '', 'image': '', 'created_at': ''}]:
+            yield writer.writerow(trip_columns + [result['fish_name'], result['image'], result['created_at']])
+
+
+def read_records(lines, format):
+    # (行番号, 釣行の辞書)を返す。CSVは同じtrip_idの連続した行を1件の釣行にまとめる
+    if format == 'jsonl':
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, ValueError('JSONとして読めません: {}'.format(e))
+                continue
+            yield line_number, record
+        return
+    reader = csv.DictReader(lines)
+    missing = set(CSV_COLUMNS) - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError('CSVの列が足りません: {}'.format(', '.join(sorted(missing))))
+    rows = ((reader.line_num, row) for row in reader)
+    for trip_id, group in itertools.groupby(rows, key=lambda item: item[1]['trip_id']):
+        group = list(group)
+        line_number, first = group[0]
+        yield line_number, {
+            'id': trip_id, 'user': first['user'], 'title': first['title'], 'prefecture': first['prefecture'],
+            'content': first['content'], 'created_at': first['created_at'],
+            'results': [{'fish_name': row['fish_name'], 'image': row['image'], 'created_at': row['result_created_at']}
+                        for line, row in group if row['fish_name']],
+            'comments': [],
+        }
+
+
+def parse_datetime(value, default):
+    if not value:
+        return default
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValidationError('日時の形式が正しくありません: {}'.format(value))
+
+
+def build_objects(record, users, now):
+    # 1件の釣行の辞書から保存前のTrip・Result・Commentを作り、モデルの検証を通す
+    if not isinstance(record, dict):
+        raise ValidationError('釣行の形式が正しくありません')
+    user_id = users.get(record.get('user'))
+    if user_id is None:
+        raise ValidationError('ユーザーが存在しません: {}'.format(record.get('user')))
+    if record.get('prefecture') not in PREFECTURES:
+        raise ValidationError('都道府県が正しくありません: {}'.format(record.get('prefecture')))
+    created_at = parse_datetime(record.get('created_at'), now)
+    trip = Trip(user_id=user_id, title=record.get('title') or '', prefecture=record['prefecture'],
+                content=record.get('content') or '', created_at=created_at, updated_at=now)
+    trip.clean_fields(exclude=['user', 'cover_image', 'fish_summary', 'search_vector'])
+    results = []
+    for result in record.get('results') or []:
+        # 魚名は画面からの入力と同じくカタカナにそろえてから、Resultの検証(全角カナ)を通す
+        obj = Result(fish_name=normalize_fish_name(result.get('fish_name')), image=result.get('image') or None,
+                     created_at=parse_datetime(result.get('created_at'), created_at))
+        obj.clean_fields(exclude=['trip', 'image', 'image_hash'])
+        results.append(obj)
+    comments = []
+    for comment in record.get('comments') or []:
+        comment_user_id = users.get(comment.get('user'))
+        if comment_user_id is None:
+            raise ValidationError('ユーザーが存在しません: {}'.format(comment.get('user')))
+        obj = Comment(user_id=comment_user_id, content=comment.get('content') or '',
+                      created_at=parse_datetime(comment.get('created_at'), created_at))
+        obj.clean_fields(exclude=['trip', 'user'])
+        comments.append(obj)
+    return trip, results, comments
+
+
+def bulk_create_trips(trips):
+    # PostgreSQLはbulk_createで採番されたIDが返る。返らないデータベースでは、
+    # トランザクション内で直前の最大IDより後ろを挿入順に読み直す
+    if connection.features.can_return_rows_from_bulk_insert:
+        return Trip.objects.bulk_create(trips)
+    last_id = Trip.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    Trip.objects.bulk_create(trips)
+    for trip, pk in zip(trips, Trip.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)):
+        trip.pk = trip.id = pk
+    return trips
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.trips = 0
+        self.results = 0
+        self.comments = 0
+        self.errors = []
+
+    @property
+    def rows(self):
+        return self.trips + self.results + self.comments
+
+
+def import_batch(batch, report):
+    from .search import trip_search_document, uses_postgres
+
+    # bulk_createはシグナルを送らないので、一覧用の値と検索用の値はここで作ってから保存する
+    for trip, results, comments in batch:
+        trip.fish_summary = ' '.join(result.fish_name for result in results)
+        trip.cover_image = results[0].image or '' if results else ''
+        if uses_postgres():
+            trip.search_vector = trip_search_document(trip.title, trip.content)
+    catches = Counter()
+    with transaction.atomic():
+        bulk_create_trips([trip for trip, results, comments in batch])
+        for trip, results, comments in batch:
+            for obj in results + comments:
+                obj.trip_id = trip.pk
+            for result in results:
+                catches[(result.fish_name, trip.prefecture, result.created_at.year, result.created_at.month)] += 1
+        results = [result for trip, results, comments in batch for result in results]
+        comments = [comment for trip, results, comments in batch for comment in comments]
+        Result.objects.bulk_create(results, batch_size=CHUNK_SIZE)
+        Comment.objects.bulk_create(comments, batch_size=CHUNK_SIZE)
+        # 月別の集計は全件を数え直さず、取り込んだ釣果の分だけ同じトランザクションで足す
+        # 途中のバッチで失敗しても、コミット済みの釣行は集計に入っている
+        merge_monthly_catches(catches)
+    report.trips += len(batch)
+    report.results += len(results)
+    report.comments += len(comments)
+
+
+def import_records(records, batch_size=CHUNK_SIZE):
+    # 釣行をbatch_size件ずつ検証してbulk_createする。検証に失敗した釣行は飛ばしてreport.errorsに残す
+    report = ImportReport()
+    User = get_user_model()
+    now = datetime.datetime.now()
+    with explicit_timestamps(Trip, Result, Comment):
+        for chunk in chunked(records, batch_size):
+            usernames = set()
+            for line_number, record in chunk:
+                if isinstance(record, dict):
+                    usernames.add(record.get('user'))
+                    usernames.update(comment.get('user') for comment in record.get('comments') or []
+                                     if isinstance(comment, dict))
+            users = dict(User.objects.filter(username__in=[name for name in usernames if name]).values_list(
+                'username', 'id'))
+            batch = []
+            for line_number, record in chunk:
+                try:
+                    if isinstance(record, Exception):
+                        raise record
+                    batch.append(build_objects(record, users, now))
+                except (ValidationError, ValueError, AttributeError) as e:
+                    message = '; '.join(e.messages) if isinstance(e, ValidationError) else str(e)
+                    report.errors.append((line_number, message))
+            if batch:
+                import_batch(batch, report)
+    return report
+
+
+def merge_monthly_catches(catches):
+    # (魚名, 都道府県, 年, 月)ごとの件数を集計テーブルにまとめて足す。既存の行は加算し、ない行は作る
+    # キーを並べてから区切るので、1回に読む既存の行は数種類の魚の分だけになる
+    for chunk in chunked(sorted(catches.items()), CHUNK_SIZE):
+        keys = dict(chunk)
+        existing = MonthlyCatch.objects.filter(
+            fish_name__in={key[0] for key in keys}, prefecture__in={key[1] for key in keys},
+            year__in={key[2] for key in keys}).values_list('id', 'fish_name', 'prefecture', 'year', 'month')
+        # 足す件数はほとんどが小さな数なので、件数ごとにまとめて1回のUPDATEにする
+        updated = {}
+        for pk, *key in existing:
+            count = keys.pop(tuple(key), None)
+            if count is not None:
+                updated.setdefault(count, []).append(pk)
+        with transaction.atomic():
+            for count, pks in updated.items():
+                MonthlyCatch.objects.filter(pk__in=pks).update(count=F('count') + count)
+            MonthlyCatch.objects.bulk_create(
+                [MonthlyCatch(fish_name=fish_name, prefecture=prefecture, year=year, month=month, count=count)
+                 for (fish_name, prefecture, year, month), count in keys.items()])
+    fish_counts = Counter()
+    for (fish_name, prefecture, year, month), count in catches.items():
+        fish_counts[fish_name] += count
+
+    # 索引はプロセスのメモリにあるので、コミットされてから反映する
+    def add_to_index():
+        for fish_name, count in fish_counts.items():
+            fish_name_index.add(fish_name, count)
+    transaction.on_commit(add_to_index)
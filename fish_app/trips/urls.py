@@ -1,11 +1,19 @@
 from django.urls import path
-from .views import TripDeleteView, TripDetailView, TopView, UserTripsView, CommentDeleteView
+from .views import TimelineView, TripDeleteView, TripDetailView, TopView, UserTripsView, CommentDeleteView
 from . import views
 
 urlpatterns = [
   path('index/', TopView.as_view(), name="index" ),
+  path('timeline/', TimelineView.as_view(), name='timeline'),
   path('create/', views.make_inline_formset, name='create'),
   path('search/',views.search,name='search'),
+  path('search/suggest/',views.search_suggest,name='search_suggest'),
+  path('search/chart.png',views.search_chart,{'format':'png'},name='search_chart'),
+  path('search/chart.svg',views.search_chart,{'format':'svg'},name='search_chart_svg'),
+  path('export/',views.export,name='export'),
+  path('stats/species/',views.stats_species,name='stats_species'),
+  path('stats/seasonality/',views.stats_seasonality,name='stats_seasonality'),
+  path('stats/years/',views.stats_years,name='stats_years'),
   path('<int:pk>/',TripDetailView.as_view(),name='trip_detail'),
   path('<int:pk>/update/',views.update_inline_formset, name='update'),
   path('user/<int:pk>/',UserTripsView.as_view(),name='user_trips'),
@@ -1,26 +1,64 @@
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
 from django.shortcuts import render
 from django.views.generic import DetailView, ListView, DeleteView
 from django.views import View
 from django.views.generic.edit import FormMixin
-from .forms import CommentForm, TripForm, TripFindForm
-from .models import Comment, Trip, Result
+from .forms import CommentForm, ResultForm, StatsForm, TripForm, TripFindForm
+from .models import Comment, MonthlyCatch, Trip, Result
 from django.shortcuts import redirect
-from . import graph
+from . import cache as trip_cache
+from . import graph, stats, timeline, transfer
+from . import search as search_index
+from .paginator import WindowedPaginationMixin, keyset_paginate
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse
-
-
-class TopView(ListView):
+from django.core.files.storage import default_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.views.static import serve
+from urllib.parse import quote
+import mimetypes
+import os
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, urlencode
+from django.views.decorators.http import require_GET
+import hashlib
+
+SEARCH_PAGE_SIZE = 12
+TIMELINE_PAGE_SIZE = 6
+SEARCH_MAX_AGE = 60
+SEARCH_CHART_MAX_AGE = 60 * 10
+STATS_MAX_AGE = 60 * 10
+STATS_TOP_SPECIES = 10
+STATS_TOP_SPECIES_BY_PREFECTURE = 5
+PRIVATE_MEDIA_MAX_AGE = 60 * 60
+
+
+class TopView(WindowedPaginationMixin, ListView):
     template_name = 'trips/index.html'
     model = Trip
     paginate_by = 6
 
     def get_queryset(self):
-        return Trip.objects.all().select_related('user').prefetch_related('result_set').order_by('-created_at')
+        return Trip.objects.all().select_related('user').order_by('-created_at')
+
+
+class TimelineView(LoginRequiredMixin, View):
+    # フォロー中のユーザーの釣行を新しい順に。カーソルで前後のページへ移動する
+    def get(self, request):
+        page = timeline.timeline_page(
+            request.user, TIMELINE_PAGE_SIZE, after=request.GET.get('after'), before=request.GET.get('before'))
+        next_url = '?' + urlencode({'after': page.next_cursor}) if page.has_next else None
+        previous_url = '?' + urlencode({'before': page.previous_cursor}) if page.has_previous else None
+        return render(request, 'trips/timeline.html', {
+            'trips': page, 'next_url': next_url, 'previous_url': previous_url,
+        })
 
 
 @login_required
@@ -29,12 +67,9 @@ def make_inline_formset(request):
     ResultFormSet = forms.inlineformset_factory(
         parent_model=Trip,
         model=Result,
-        fields=('fish_name','image'),
+        form=ResultForm,
         extra=1,
         can_delete=False,
-        widgets={'image':forms.FileInput(attrs={'class':'form-control-file'}),
-                 'fish_name':forms.TextInput(attrs={'placeholder':'全角カナ'})
-        }
     )
     if request.method == 'POST':
         title = request.POST['title']
@@ -70,12 +105,9 @@ def update_inline_formset(request,pk):
     ResultFormSet = forms.inlineformset_factory(
         parent_model=Trip,
         model=Result,
-        fields=('fish_name','image'),
+        form=ResultForm,
         extra=1,
         can_delete=False,
-        widgets={'image':forms.FileInput(attrs={'class':'form-control-file'}),
-                 'fish_name':forms.TextInput(attrs={'placeholder':'全角カナ'})
-        }
     )
     if request.method == 'POST':
         trip = Trip.objects.get(id=pk)
@@ -110,36 +142,149 @@ def update_inline_formset(request,pk):
 
 def search(request):
     if (request.method == 'POST'):
-        form = TripFindForm(request.POST)
-        keyword_fish_name = request.POST['keyword_fish_name']
-        keyword_prefecture = request.POST['keyword_prefecture']
-        if keyword_prefecture == '':
-            results = Result.objects.filter(fish_name=keyword_fish_name).values(
-                'fish_name','image','trip_id','created_at','trip__title','trip__prefecture','trip__user__username','trip__user__id')
-            for result in results:
-                result['image_url'] = f"/media/{result['image']}"
-        else:
-            results = Result.objects.filter(fish_name=keyword_fish_name).filter(trip__prefecture=keyword_prefecture).values(
-                'fish_name','image','trip_id','created_at','trip__title','trip__prefecture','trip__user__username','trip__user__id')
-            for result in results:
-                result['image_url'] = f"/media/{result['image']}"
-        result_list = list(results.values_list('created_at__month',flat=True))
-        x = list(range(1,13))
-        y = []
-        for i in range(1,13):
-            y.append(result_list.count(i))
-        chart = graph.plot_graph(x,y)
-
-        return render(request, 'trips/trip_search.html', {'form':form, 'results':results, 'chart':chart})
-    else:
-        form =TripFindForm()
+        # 検索はGETで行う。POSTで送られた場合は同じ条件のURLへ転送する
+        query = urlencode({key: request.POST.get(key, '') for key in ('keyword_fish_name', 'keyword', 'keyword_prefecture')})
+        return redirect(reverse('search') + '?' + query)
+    form = TripFindForm(request.GET or None)
+    if not form.is_valid():
         return render(request, 'trips/trip_search.html', {'form':form})
 
+    keyword_fish_name = form.cleaned_data['keyword_fish_name']
+    keyword = form.cleaned_data['keyword']
+    keyword_prefecture = form.cleaned_data['keyword_prefecture']
+    params = {'keyword_fish_name':keyword_fish_name, 'keyword':keyword, 'keyword_prefecture':keyword_prefecture}
+    context = {'form':form}
+    fish_names = None
+    if keyword_fish_name:
+        # 部分一致した魚名(サバ→マサバ・ゴマサバ)の釣果をまとめて探す。なければ表記の近い魚名を示す
+        context['fish_candidates'] = search_index.fish_name_candidates(keyword_fish_name)
+        fish_names = [candidate['fish_name'] for candidate in context['fish_candidates']]
+        if not fish_names:
+            context['similar_fish_names'] = [
+                dict(candidate, url='?' + urlencode(dict(params, keyword_fish_name=candidate['fish_name'])))
+                for candidate in search_index.similar_fish_names(keyword_fish_name)]
+
+    if keyword:
+        # キーワードがあれば、タイトル・内容に一致する釣行を関連度順に表示する
+        try:
+            page_number = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page_number = 1
+        trips = search_index.search_trips(keyword, keyword_prefecture, fish_names)
+        trips, has_next = search_index.search_page(trips, page_number, SEARCH_PAGE_SIZE)
+        context.update({
+            'trips':trips,
+            'next_url':'?' + urlencode(dict(params, page=page_number + 1)) if has_next else None,
+            'previous_url':'?' + urlencode(dict(params, page=page_number - 1)) if page_number > 1 else None,
+        })
+    else:
+        results = Result.objects.filter(fish_name__in=fish_names)
+        if keyword_prefecture:
+            results = results.filter(trip__prefecture=keyword_prefecture)
+        results = results.values(
+            'id','fish_name','image','image_ready','thumbnail_widths','trip_id','created_at','trip__title','trip__prefecture','trip__user__username','trip__user__id')
+        page = keyset_paginate(results, SEARCH_PAGE_SIZE, after=request.GET.get('after'), before=request.GET.get('before'))
+        for result in page:
+            result['image_url'] = default_storage.url(result['image']) if result['image'] else ''
+        # 総件数は集計テーブルの合計から求め、検索結果全件は数えない
+        context.update({
+            'results':page,
+            'total':sum(MonthlyCatch.objects.histogram(fish_names, keyword_prefecture)),
+            'chart_url':reverse('search_chart_svg') + '?' + urlencode({'fish':fish_names, 'pref':keyword_prefecture}, doseq=True),
+            'next_url':'?' + urlencode(dict(params, after=page.next_cursor)) if page.has_next else None,
+            'previous_url':'?' + urlencode(dict(params, before=page.previous_cursor)) if page.has_previous else None,
+        })
+    response = render(request, 'trips/trip_search.html', context)
+    # ヘッダーにログイン中のユーザーが表示されるので、共有キャッシュには置かせずブラウザだけで使う
+    patch_cache_control(response, private=True, max_age=SEARCH_MAX_AGE)
+    return response
+
+
+@require_GET
+def search_suggest(request):
+    # 魚名入力欄の補完候補
+    response = JsonResponse({'suggestions':search_index.suggest_fish_names(request.GET.get('q', ''))})
+    patch_cache_control(response, public=True, max_age=SEARCH_MAX_AGE)
+    return response
+
+
+@require_GET
+def search_chart(request, format):
+    # 月別の件数が同じならETagも同じになり、ブラウザやnginxのキャッシュが使える
+    counts = MonthlyCatch.objects.histogram(request.GET.getlist('fish'), request.GET.get('pref', ''))
+    etag = '"{}-{}"'.format(format, hashlib.md5(','.join(map(str, counts)).encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if format == 'png':
+            response = HttpResponse(graph.chart_png(counts), content_type='image/png')
+        else:
+            response = HttpResponse(graph.chart_svg(counts), content_type='image/svg+xml')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=SEARCH_CHART_MAX_AGE)
+    return response
+
+
+def stats_response(request, build):
+    # 統計APIの共通処理。条件が不正なら400、集計テーブルから作った値をJSONで返す
+    form = StatsForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors':form.errors}, status=400)
+    response = JsonResponse(build(form.cleaned_data))
+    patch_cache_control(response, public=True, max_age=STATS_MAX_AGE)
+    return response
+
+
+@require_GET
+def stats_species(request):
+    # ?prefecture= を指定するとその都道府県の上位の魚種、省略すると都道府県ごとの上位の魚種
+    def build(data):
+        if data['prefecture']:
+            return {'prefecture':data['prefecture'], 'year':data['year'],
+                    'species':stats.top_species(data['prefecture'], data['year'], data['limit'] or STATS_TOP_SPECIES)}
+        return {'year':data['year'],
+                'prefectures':stats.top_species_by_prefecture(data['year'], data['limit'] or STATS_TOP_SPECIES_BY_PREFECTURE)}
+    return stats_response(request, build)
+
+
+@require_GET
+def stats_seasonality(request):
+    # 都道府県×月の釣果数。?fish= で魚種、?year= で年を絞る
+    def build(data):
+        return dict(stats.seasonality(data['fish'], data['year']), fish_name=data['fish'], year=data['year'])
+    return stats_response(request, build)
+
+
+@require_GET
+def stats_years(request):
+    def build(data):
+        return {'fish_name':data['fish'], 'prefecture':data['prefecture'],
+                'years':stats.yearly(data['fish'], data['prefecture'])}
+    return stats_response(request, build)
+
+
+@staff_member_required
+@require_GET
+def export(request):
+    # 釣行・釣果・コメントを少しずつ読みながら返すので、件数が多くてもメモリを使い切らない
+    format = request.GET.get('format', 'jsonl')
+    if format not in transfer.FORMATS:
+        return HttpResponse(status=400)
+    content_type = 'text/csv; charset=utf-8' if format == 'csv' else 'application/x-ndjson; charset=utf-8'
+    response = StreamingHttpResponse(transfer.export_lines(format), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="trips.{}"'.format(format)
+    return response
+
 
 class TripDetailView(FormMixin, DetailView):
     model = Trip
     form_class = CommentForm
 
+    def get_queryset(self):
+        # 釣果・コメントとコメントの投稿者もまとめて引き、コメントの数によらずクエリ数を一定にする
+        return Trip.objects.select_related('user').prefetch_related(
+            Prefetch('result_set', queryset=Result.objects.order_by('id')),
+            Prefetch('comment_set', queryset=Comment.objects.select_related('user').order_by('created_at', 'id')))
+
     def get_success_url(self):
         return reverse('trip_detail', kwargs={'pk': self.object.id})
 
@@ -148,6 +293,46 @@ class TripDetailView(FormMixin, DetailView):
         context['form'] = CommentForm(initial={'trip': self.object})
         return context
 
+    def get_etag(self, version):
+        # ログイン中のユーザーには編集・削除ボタンとCSRFトークンが入るので、ユーザーとCSRFのCookieごとに変える
+        etag = 'trip-{}-{}'.format(self.kwargs['pk'], version.isoformat())
+        if self.request.user.is_authenticated:
+            csrf_token = self.request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+            etag += '-{}-{}'.format(self.request.user.id, hashlib.md5(csrf_token.encode()).hexdigest())
+        return '"{}"'.format(etag)
+
+    def get(self, request, *args, **kwargs):
+        # 釣行・釣果・コメントが変わると更新日時が進むので、それをETag/Last-Modifiedにして304を返す
+        version = trip_cache.trip_version(kwargs['pk'])
+        if version is None:
+            raise Http404
+        etag = self.get_etag(version)
+        last_modified = int(version.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.render_page(request, version, *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # 毎回更新の有無を確かめさせる。ログイン中のページは共有キャッシュに置かせない
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    def render_page(self, request, version, *args, **kwargs):
+        # 未ログインのユーザーには、釣行の更新日時ごとにキャッシュしたページを返す
+        # ログイン中のユーザーは編集・削除ボタンが異なるので、テンプレートの断片キャッシュだけを使う
+        if request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+        content = trip_cache.get_detail(kwargs['pk'], version)
+        if content is None:
+            response = super().get(request, *args, **kwargs)
+            response.render()
+            trip_cache.set_detail(kwargs['pk'], version, response.content)
+            return response
+        return HttpResponse(content)
+
     def post(self, request, *args, **kwargs):
         if not request.user.id:
             return redirect(to='login')
@@ -167,13 +352,13 @@ class TripDetailView(FormMixin, DetailView):
 
 
 
-class UserTripsView(ListView):
+class UserTripsView(WindowedPaginationMixin, ListView):
     model = Trip
     template_name = 'trips/user_trips.html'
     paginate_by = 6
 
     def get_queryset(self,**kwargs):
-        return Trip.objects.filter(user_id=self.kwargs['pk']).select_related('user').prefetch_related('result_set').order_by('-created_at')
+        return Trip.objects.filter(user_id=self.kwargs['pk']).select_related('user').order_by('-created_at')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -202,3 +387,22 @@ class CommentDeleteView(LoginRequiredMixin,UserPassesTestMixin,View):
         trip = comment.trip
         comment.delete()
         return redirect(to='trip_detail', pk=trip.id)
+
+
+@login_required
+def private_media(request, path):
+    # MEDIA_ROOT/private/以下のファイルはログインユーザーにだけ返す。本体の転送はnginxに任せる
+    private_root = os.path.join(settings.MEDIA_ROOT, 'private')
+    try:
+        full_path = safe_join(private_root, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    if settings.DEBUG:
+        return serve(request, path, document_root=private_root)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    response = HttpResponse(content_type=content_type or 'application/octet-stream')
+    response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_URL + 'private/' + quote(path)
+    patch_cache_control(response, private=True, max_age=PRIVATE_MEDIA_MAX_AGE)
+    return response